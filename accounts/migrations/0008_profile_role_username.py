@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0007_alter_profile_username"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="profile",
+            index=models.Index(
+                fields=["role", "username"], name="profile_role_username"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0008_profile_role_username"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="profile",
+            name="username",
+            field=models.CharField(max_length=20, unique=True),
+        ),
+    ]
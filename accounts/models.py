@@ -15,6 +15,12 @@ class Profile(AbstractUser):
 
     username = models.CharField(max_length=20, unique=True)
 
+    class Meta(AbstractUser.Meta):
+        # The friend directory lists one role at a time in username order
+        indexes = [
+            models.Index(fields=["role", "username"], name="profile_role_username")
+        ]
+
     def clean(self):
         if len(self.username) > 20:
             raise ValidationError("Username cannot exceed 50 characters.")
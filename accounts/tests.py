@@ -1,10 +1,14 @@
+from datetime import timedelta
+
 from django.test import TestCase
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from accounts.models import Client, Profile, Provider
+from appointments.models import Appointment, TimeSlot
 from accounts.forms import ClientEditForm, ProfileEditForm, ProviderEditForm
 
 User = get_user_model()
@@ -178,3 +182,62 @@ class PasswordResetCompleteViewTests(TestCase):
         response = self.client.get(reverse("accounts:password_reset_complete"))
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "accounts/password_reset_complete.html")
+
+
+class DashboardQueryBudgetTests(TestCase):
+    # Session, user, dashboard profile and appointments, whatever the count
+    QUERY_BUDGET = 4
+
+    def setUp(self):
+        self.provider_user = Profile.objects.create_user(
+            username="provider",
+            password="password",
+            role="Provider",
+            email="provider@example.com",
+            first_name="Pat",
+        )
+        Provider.objects.create(user=self.provider_user, specialization="Psychiatry")
+        self.client_user = Profile.objects.create_user(
+            username="client",
+            password="password",
+            role="User",
+            email="client@example.com",
+            first_name="Casey",
+        )
+        Client.objects.create(user=self.client_user)
+
+    def add_appointments(self, count):
+        start = timezone.now() + timedelta(days=1)
+        offset = TimeSlot.objects.count()
+        slots = TimeSlot.objects.bulk_create(
+            TimeSlot(
+                provider=self.provider_user,
+                start_time=start + timedelta(hours=offset + i),
+                end_time=start + timedelta(hours=offset + i + 1),
+                is_available=False,
+            )
+            for i in range(count)
+        )
+        Appointment.objects.bulk_create(
+            Appointment(
+                user=self.client_user, time_slot=slot, appointment_type="Checkup"
+            )
+            for slot in slots
+        )
+
+    def assert_budget(self, username, url):
+        self.client.login(username=username, password="password")
+        total = 0
+        for size in (1, 100, 1000):
+            self.add_appointments(size - total)
+            total = size
+            with self.subTest(appointments=size):
+                with self.assertNumQueries(self.QUERY_BUDGET):
+                    response = self.client.get(url)
+                self.assertEqual(len(response.context["appointments"]), size)
+
+    def test_client_dashboard_query_budget(self):
+        self.assert_budget("client", reverse("accounts:client_dashboard"))
+
+    def test_provider_dashboard_query_budget(self):
+        self.assert_budget("provider", reverse("accounts:provider_dashboard"))
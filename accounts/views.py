@@ -1,6 +1,7 @@
 from django.contrib.auth.decorators import login_required
 
 from appointments.models import Appointment
+from appointments.slots import day_bounds
 from .forms import (
     ClientEditForm,
     ProfileEditForm,
@@ -149,12 +150,25 @@ def client_dashboard(request):
     if request.user.role != "User":
         return redirect("error")  # Redirect to error page if not a client
 
-    today = timezone.now().date().isoformat()
+    today, _ = day_bounds(timezone.localdate())
     # Fetch client-specific data
-    client_data = get_object_or_404(Client, user=request.user)
-    appointments = Appointment.objects.filter(
-        user=request.user, time_slot__start_time__gte=today
-    ).select_related("time_slot")
+    client_data = get_object_or_404(
+        Client.objects.select_related("user"), user=request.user
+    )
+    # Load each appointment with its slot and provider in a single query
+    appointments = (
+        Appointment.objects.filter(user=request.user, time_slot__start_time__gte=today)
+        .select_related("time_slot__provider")
+        .only(
+            "time_slot__start_time",
+            "time_slot__end_time",
+            "time_slot__capacity",
+            "time_slot__booked_seats",
+            "time_slot__provider__first_name",
+            "time_slot__provider__last_name",
+        )
+        .order_by("time_slot__start_time")
+    )
 
     context = {
         "client_data": client_data,
@@ -171,13 +185,28 @@ def provider_dashboard(request):
         return redirect("error")  # Redirect to error page if not a provider
 
     # Filter the slots after today's date
-    today = timezone.now().date().isoformat()
+    today, _ = day_bounds(timezone.localdate())
 
     # Fetch provider-specific data
-    provider_data = get_object_or_404(Provider, user=request.user)
-    appointments = Appointment.objects.filter(
-        time_slot__provider=request.user, time_slot__start_time__gte=today
-    ).select_related("time_slot")
+    provider_data = get_object_or_404(
+        Provider.objects.select_related("user"), user=request.user
+    )
+    # Load each appointment with its slot and client in a single query
+    appointments = (
+        Appointment.objects.filter(
+            time_slot__provider=request.user, time_slot__start_time__gte=today
+        )
+        .select_related("time_slot", "user")
+        .only(
+            "time_slot__start_time",
+            "time_slot__end_time",
+            "time_slot__capacity",
+            "time_slot__booked_seats",
+            "user__first_name",
+            "user__last_name",
+        )
+        .order_by("time_slot__start_time")
+    )
     context = {
         "provider_data": provider_data,
         "appointments": appointments,
@@ -1,6 +1,15 @@
 from django.contrib import admin
-from .models import TimeSlot, Appointment
+from .models import (
+    ArchivedAppointment,
+    ArchivedTimeSlot,
+    Reminder,
+    TimeSlot,
+    Appointment,
+)
 
 # Register your models here.
 admin.site.register(TimeSlot)
 admin.site.register(Appointment)
+admin.site.register(ArchivedTimeSlot)
+admin.site.register(ArchivedAppointment)
+admin.site.register(Reminder)
@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .models import ArchivedAppointment, ArchivedTimeSlot, Appointment, TimeSlot
+
+# Slots moved per transaction. Small enough that each batch holds the write
+# lock for only a few milliseconds, so bookings are never held up for long.
+ARCHIVE_BATCH_SIZE = 200
+
+# Past appointments listed on a user's appointments page
+PAST_APPOINTMENT_LIMIT = 20
+
+SLOT_FIELDS = [
+    "id",
+    "provider_id",
+    "start_time",
+    "end_time",
+    "capacity",
+    "booked_seats",
+    "is_available",
+]
+APPOINTMENT_FIELDS = [
+    "id",
+    "user_id",
+    "time_slot_id",
+    "comments",
+    "appointment_type",
+    "booked_on",
+    "updated_at",
+]
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move up to ``batch_size`` slots that ended before ``cutoff``.
+
+    The slots and their appointments are copied to the archive tables and
+    deleted from the live ones in a single short transaction. The slots are
+    read in ``(end_time, id)`` order off the ``timeslot_end`` index, so each
+    batch, the final empty one included, reads only the rows it moves.
+    Returns the number of ``(slots, appointments)`` moved; ``(0, 0)`` means
+    done.
+    """
+    with transaction.atomic():
+        slots = list(
+            TimeSlot.objects.filter(end_time__lt=cutoff)
+            .order_by("end_time", "id")
+            .values(*SLOT_FIELDS)[:batch_size]
+        )
+        if not slots:
+            return 0, 0
+        slot_ids = [slot["id"] for slot in slots]
+        appointments = list(
+            Appointment.objects.filter(time_slot_id__in=slot_ids).values(
+                *APPOINTMENT_FIELDS
+            )
+        )
+
+        ArchivedTimeSlot.objects.bulk_create(
+            [ArchivedTimeSlot(**slot) for slot in slots], ignore_conflicts=True
+        )
+        ArchivedAppointment.objects.bulk_create(
+            [ArchivedAppointment(**appointment) for appointment in appointments],
+            ignore_conflicts=True,
+        )
+        # Appointments first, so deleting the slots has nothing to cascade to
+        Appointment.objects.filter(time_slot_id__in=slot_ids).delete()
+        TimeSlot.objects.filter(id__in=slot_ids).delete()
+    return len(slots), len(appointments)
+
+
+def archived_appointments(user):
+    """Archived appointments booked by ``user`` or held in their slots."""
+    return (
+        ArchivedAppointment.objects.filter(Q(user=user) | Q(time_slot__provider=user))
+        .select_related("time_slot__provider", "user")
+        .order_by("-time_slot__start_time")
+    )
+
+
+def past_appointments(user, before, limit=PAST_APPOINTMENT_LIMIT):
+    """The latest ``limit`` appointments of ``user`` starting before ``before``.
+
+    Those not archived yet are read from the live table, the rest from the
+    archive, in two queries; the result is newest first.
+    """
+    live = (
+        Appointment.objects.filter(
+            Q(user=user) | Q(time_slot__provider=user),
+            time_slot__start_time__lt=before,
+        )
+        .select_related("time_slot__provider", "user")
+        .order_by("-time_slot__start_time")
+    )
+    archived = archived_appointments(user).filter(time_slot__start_time__lt=before)
+    appointments = list(live[:limit]) + list(archived[:limit])
+    appointments.sort(key=lambda appointment: appointment.time_slot.start_time)
+    return appointments[::-1][:limit]
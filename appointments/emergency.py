@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Provider
+from messaging.conversations import post_message
+
+from .models import Appointment
+from .slots import SlotUnavailable, book_time_slot
+from .soonest import soonest_slots
+
+# Candidates tried before giving up when other bookings keep winning the race
+EMERGENCY_ATTEMPTS = 5
+
+
+def emergency_provider_ids(specializations=None):
+    """Ids of the activated providers in any of ``specializations``."""
+    providers = Provider.objects.filter(is_activated=True)
+    if specializations:
+        providers = providers.filter(specialization__in=specializations)
+    return list(providers.values_list("user_id", flat=True))
+
+
+def book_emergency_appointment(user, specializations=None, comments=""):
+    """Book ``user`` into the soonest free slot and notify its provider.
+
+    Candidates come from the in-memory soonest-slot index, so the search
+    costs no query once the index is warm. The slot is claimed with the same
+    conditional UPDATE as any booking; if another booking took it first, the
+    next soonest candidate is tried. Raises SlotUnavailable when no slot
+    could be claimed.
+    """
+    provider_ids = emergency_provider_ids(specializations)
+    for _ in range(EMERGENCY_ATTEMPTS):
+        candidates = soonest_slots.soonest(provider_ids)
+        if not candidates:
+            break
+        start_time, slot_id, provider_id = min(candidates)
+        appointment = Appointment(
+            user=user, appointment_type="Emergency", comments=comments
+        )
+        try:
+            with transaction.atomic():
+                book_time_slot(appointment, slot_id)
+                when = timezone.localtime(start_time).strftime("%b %d, %Y %H:%M")
+                content = f"Emergency appointment booked for {when}."
+                if comments:
+                    content += f"\n{comments}"
+                post_message(user, provider_id, content)
+        except SlotUnavailable:
+            continue
+        return appointment
+    raise SlotUnavailable
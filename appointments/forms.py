@@ -20,9 +20,17 @@ class AppointmentForm(forms.ModelForm):
 class TimeSlotForm(forms.ModelForm):
     class Meta:
         model = TimeSlot
-        fields = ["start_time", "end_time"]  # Removed "is_available"
+        fields = ["start_time", "end_time", "capacity"]  # Removed "is_available"
+        labels = {"capacity": "Seats"}
 
         widgets = {
             "start_time": forms.DateTimeInput(attrs={"type": "datetime-local"}),
             "end_time": forms.DateTimeInput(attrs={"type": "datetime-local"}),
+            "capacity": forms.NumberInput(attrs={"min": 1}),
         }
+
+    def clean_capacity(self):
+        capacity = self.cleaned_data["capacity"]
+        if capacity < 1:
+            raise forms.ValidationError("A time slot needs at least one seat.")
+        return capacity
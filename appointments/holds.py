@@ -0,0 +1,50 @@
+from django.core.cache import cache
+
+# Seconds a seat stays held for a client after the booking form opens
+HOLD_TTL = 5 * 60
+
+
+def hold_key(slot_id, seat):
+    return f"appointments:slot-hold:{slot_id}:{seat}"
+
+
+def seat_keys(slot):
+    return [hold_key(slot.id, seat) for seat in range(slot.capacity)]
+
+
+def hold_slot(slot, user_id):
+    """Hold a seat of ``slot`` for ``user_id``, returning False if none is free.
+
+    Each seat's hold is a single cache entry that expires after HOLD_TTL
+    seconds, so abandoned forms need no cleanup. As many clients as the
+    slot has seats left may hold it at once. Holding a slot again renews
+    the hold.
+    """
+    keys = seat_keys(slot)
+    holders = cache.get_many(keys)
+    for key, holder in list(holders.items()):
+        if holder == user_id:
+            if cache.touch(key, HOLD_TTL):
+                return True
+            # The hold expired between the two calls
+            del holders[key]
+    if len(holders) >= slot.seats_left:
+        return False
+    return any(cache.add(key, user_id, HOLD_TTL) for key in keys if key not in holders)
+
+
+def release_slot(slot, user_id):
+    """Drop ``user_id``'s hold on a seat of ``slot``, if they have one."""
+    holders = cache.get_many(seat_keys(slot))
+    cache.delete_many([key for key, holder in holders.items() if holder == user_id])
+
+
+def without_held(slots, user_id):
+    """Drop the slots whose seats left are all held by others, in one cache read."""
+    slots = list(slots)
+    holds = cache.get_many([key for slot in slots for key in seat_keys(slot)])
+
+    def held_by_others(slot):
+        return sum(holds.get(key, user_id) != user_id for key in seat_keys(slot))
+
+    return [slot for slot in slots if held_by_others(slot) < slot.seats_left]
@@ -0,0 +1,127 @@
+import hashlib
+from datetime import timezone as datetime_timezone
+
+from django.core import signing
+from django.db.models import Count, Max, Q
+
+from .models import Appointment
+
+# Salt for calendar feed tokens, so they cannot be swapped for other signatures
+FEED_SALT = "appointments.calendar_feed"
+
+# Rows fetched per round trip while streaming a feed
+FEED_CHUNK_SIZE = 500
+
+
+def feed_token(user):
+    """Return the secret token identifying ``user``'s calendar feed."""
+    return signing.Signer(salt=FEED_SALT).sign(str(user.pk))
+
+
+def feed_user_id(token):
+    """Return the user id a feed token was issued for, or None if invalid."""
+    try:
+        return int(signing.Signer(salt=FEED_SALT).unsign(token))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def feed_appointments(user_id):
+    """Appointments shown in a user's feed: booked by them or with them."""
+    return Appointment.objects.filter(
+        Q(user_id=user_id) | Q(time_slot__provider_id=user_id)
+    )
+
+
+def feed_version(appointments):
+    """Return ``(etag, last_modified)`` describing ``appointments``.
+
+    Uses a single aggregate query. The row count catches cancellations, the
+    latest ``updated_at`` catches new bookings and reschedules.
+    """
+    state = appointments.aggregate(count=Count("id"), last=Max("updated_at"))
+    last = state["last"]
+    key = f"{state['count']}:{last.isoformat() if last else ''}"
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    return etag, last
+
+
+def escape(text):
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line):
+    """Fold a content line to 75 octets as RFC 5545 requires."""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        # Never split inside a multi-byte UTF-8 sequence
+        while limit < len(encoded) and (encoded[limit] & 0xC0) == 0x80:
+            limit -= 1
+        parts.append(encoded[:limit].decode())
+        encoded = encoded[limit:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def format_datetime(value):
+    return value.astimezone(datetime_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def event_lines(appointment, user_id):
+    slot = appointment.time_slot
+    if slot.provider_id == user_id:
+        summary = (
+            f"{appointment.appointment_type} with {appointment.user.get_full_name()}"
+        )
+    else:
+        summary = f"{appointment.appointment_type} with {slot.provider.get_full_name()}"
+    yield "BEGIN:VEVENT"
+    yield f"UID:appointment-{appointment.id}@calmseek"
+    yield f"DTSTAMP:{format_datetime(appointment.updated_at)}"
+    yield f"DTSTART:{format_datetime(slot.start_time)}"
+    yield f"DTEND:{format_datetime(slot.end_time)}"
+    yield f"SUMMARY:{escape(summary.strip())}"
+    if appointment.comments:
+        yield f"DESCRIPTION:{escape(appointment.comments)}"
+    yield "END:VEVENT"
+
+
+def calendar_stream(user_id):
+    """Yield the iCalendar document for ``user_id`` line by line.
+
+    Appointments are read with a chunked iterator, so memory use does not
+    grow with the number of events.
+    """
+    appointments = (
+        feed_appointments(user_id)
+        .select_related("time_slot__provider", "user")
+        .only(
+            "appointment_type",
+            "comments",
+            "updated_at",
+            "time_slot__start_time",
+            "time_slot__end_time",
+            "time_slot__provider__first_name",
+            "time_slot__provider__last_name",
+            "user__first_name",
+            "user__last_name",
+        )
+        .order_by("time_slot__start_time", "id")
+    )
+    yield fold("BEGIN:VCALENDAR")
+    yield fold("VERSION:2.0")
+    yield fold("PRODID:-//CalmSeek//Appointments//EN")
+    yield fold("CALSCALE:GREGORIAN")
+    yield fold("X-WR-CALNAME:CalmSeek Appointments")
+    for appointment in appointments.iterator(chunk_size=FEED_CHUNK_SIZE):
+        yield "".join(fold(line) for line in event_lines(appointment, user_id))
+    yield fold("END:VCALENDAR")
@@ -0,0 +1,48 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from appointments.archive import ARCHIVE_BATCH_SIZE, archive_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Move time slots that have ended, and their appointments, to the "
+        "archive tables. Rows are moved in small batches, each in its own "
+        "transaction, so the command can run while the site takes bookings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=0,
+            help="Keep slots that ended within this many days.",
+        )
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to sleep between batches.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        total_slots = total_appointments = 0
+        while True:
+            slots, appointments = archive_batch(cutoff, options["batch_size"])
+            if not slots:
+                break
+            total_slots += slots
+            total_appointments += appointments
+            if options["pause"]:
+                time.sleep(options["pause"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {total_slots} time slots and "
+                f"{total_appointments} appointments."
+            )
+        )
@@ -0,0 +1,127 @@
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Profile, Provider
+from appointments.models import TimeSlot
+from appointments.soonest import soonest_slots
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Time POST /appointments/emergency/ end to end against a synthetic "
+        "TimeSlot table: the provider query, the claim, the appointment and "
+        "the message to the provider, each booking committed as in "
+        "production. It runs on a freshly migrated database in a temporary "
+        "directory, so the real one is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slots", type=int, default=1_000_000)
+        parser.add_argument("--providers", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                directory, "benchmark.sqlite3"
+            )
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            setup_test_environment()
+            try:
+                self.run(options)
+            finally:
+                teardown_test_environment()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        specializations = [value for value, _ in Provider.MENTAL_HEALTH_SPECIALIZATIONS]
+        rng = random.Random(0)
+        now = timezone.now()
+        with transaction.atomic():
+            providers = Profile.objects.bulk_create(
+                Profile(
+                    username=f"bench_{i}",
+                    email=f"bench_{i}@example.com",
+                    password="!",
+                    role="Provider",
+                )
+                for i in range(options["providers"])
+            )
+            Provider.objects.bulk_create(
+                Provider(
+                    user=provider,
+                    specialization=specializations[i % len(specializations)],
+                    is_activated=True,
+                )
+                for i, provider in enumerate(providers)
+            )
+            provider_ids = [p.id for p in providers]
+            created = 0
+            while created < options["slots"]:
+                count = min(options["batch_size"], options["slots"] - created)
+                batch = []
+                for _ in range(count):
+                    # Spread slots over a year either side of today
+                    start = now + timedelta(hours=rng.randint(-24 * 365, 24 * 365))
+                    batch.append(
+                        TimeSlot(
+                            provider_id=rng.choice(provider_ids),
+                            start_time=start,
+                            end_time=start + timedelta(hours=1),
+                            is_available=rng.random() < 0.5,
+                        )
+                    )
+                TimeSlot.objects.bulk_create(batch)
+                created += count
+            user = Profile.objects.create(
+                username="bench_client",
+                email="bench_client@example.com",
+                password="!",
+                role="User",
+            )
+
+        soonest_slots.clear()
+        client = Client()
+        client.force_login(user)
+        url = reverse("appointments:emergency_appointment")
+        self.stdout.write(
+            f"{options['slots']} slots, {options['providers']} providers, "
+            f"{options['repeat']} bookings each"
+        )
+        self.stdout.write(
+            f"{'':>20} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}"
+        )
+        for label, data in (
+            ("any provider", {}),
+            ("one specialization", {"specialization": specializations[0]}),
+        ):
+            samples = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                response = client.post(url, data)
+                samples.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f"Booking failed: {response.content!r}")
+            samples.sort()
+            self.stdout.write(
+                f"{label:>20} {percentile(samples, 0.5):>9.2f} "
+                f"{percentile(samples, 0.95):>9.2f} "
+                f"{percentile(samples, 0.99):>9.2f} {samples[-1] * 1000:>9.2f}"
+            )
@@ -0,0 +1,141 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Profile
+from appointments.models import TimeSlot
+from appointments.slots import (
+    SLOT_PAGE_SIZE,
+    available_time_slots,
+    slot_page,
+)
+from appointments.soonest import SoonestSlotIndex
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the slot-availability queries against a synthetic TimeSlot table "
+        "of growing size. All rows are created inside a transaction that is "
+        "rolled back, so the database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slots", type=int, default=1_000_000)
+        parser.add_argument("--providers", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        providers = Profile.objects.bulk_create(
+            Profile(
+                username=f"bench_{i}",
+                email=f"bench_{i}@example.com",
+                password="!",
+                role="Provider",
+            )
+            for i in range(options["providers"])
+        )
+        provider_ids = [p.id for p in providers]
+        rng = random.Random(0)
+        now = timezone.now()
+
+        checkpoints = []
+        size = 10_000
+        while size < options["slots"]:
+            checkpoints.append(size)
+            size *= 10
+        checkpoints.append(options["slots"])
+
+        self.stdout.write(
+            f"{'slots':>10} {'all (ms)':>10} {'provider (ms)':>14} {'day (ms)':>10} "
+            f"{'page 1000 (ms)':>15} {'soonest (ms)':>13} {'warm p99 (ms)':>14}"
+        )
+        created = 0
+        for target in checkpoints:
+            while created < target:
+                count = min(options["batch_size"], target - created)
+                batch = []
+                for _ in range(count):
+                    # Spread slots over a year either side of today
+                    start = now + timedelta(hours=rng.randint(-24 * 365, 24 * 365))
+                    batch.append(
+                        TimeSlot(
+                            provider_id=rng.choice(provider_ids),
+                            start_time=start,
+                            end_time=start + timedelta(hours=1),
+                            is_available=rng.random() < 0.5,
+                        )
+                    )
+                TimeSlot.objects.bulk_create(batch)
+                created += count
+
+            provider_id = rng.choice(provider_ids)
+            day = (now + timedelta(days=3)).date().isoformat()
+            timings = [
+                self.time_query(lambda: available_time_slots()[:50], options),
+                self.time_query(
+                    lambda: available_time_slots(provider_id)[:50], options
+                ),
+                self.time_query(
+                    lambda: available_time_slots(provider_id, day)[:50], options
+                ),
+            ]
+            # Keyset cursor for page 1000, located once with OFFSET (untimed)
+            offset = SLOT_PAGE_SIZE * 999 - 1
+            deep = available_time_slots()[offset:].first()
+            if deep:
+                after = (deep.start_time, deep.id)
+                timings.append(
+                    self.time_query(
+                        lambda: slot_page(available_time_slots(after=after)), options
+                    )
+                )
+            else:
+                timings.append(float("nan"))
+            # Soonest slot of every provider, loaded into a cold index
+            timings.append(
+                self.time_query(
+                    lambda: SoonestSlotIndex().soonest(provider_ids), options
+                )
+            )
+            # The same lookup once the index is warm, as emergency bookings
+            # mostly see it; their candidate search is held to its p99
+            warm = SoonestSlotIndex()
+            warm.soonest(provider_ids)
+            timings.append(
+                self.time_query(
+                    lambda: [min(warm.soonest(provider_ids), default=None)],
+                    options,
+                    percentile=0.99,
+                )
+            )
+            self.stdout.write(
+                f"{created:>10} {timings[0]:>10.3f} {timings[1]:>14.3f} "
+                f"{timings[2]:>10.3f} {timings[3]:>15.3f} {timings[4]:>13.3f} "
+                f"{timings[5]:>14.3f}"
+            )
+
+    def time_query(self, build, options, percentile=0.5):
+        samples = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            list(build())
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        return samples[min(int(len(samples) * percentile), len(samples) - 1)] * 1000
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from appointments.reminders import (
+    REMINDER_BATCH_SIZE,
+    REMINDER_LEAD,
+    schedule_reminders,
+    send_due_reminders,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Write reminders for appointments starting soon to the outbox, then "
+        "send every due reminder in batches over one SMTP connection. Meant "
+        "to run from cron every few minutes; run one copy at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lead-hours",
+            type=float,
+            default=REMINDER_LEAD.total_seconds() / 3600,
+            help="Remind about appointments starting within this many hours.",
+        )
+        parser.add_argument("--batch-size", type=int, default=REMINDER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        scheduled = schedule_reminders(lead=timedelta(hours=options["lead_hours"]))
+        sent, failed = send_due_reminders(batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Scheduled {scheduled} reminders. Sent {sent}, failed {failed}."
+            )
+        )
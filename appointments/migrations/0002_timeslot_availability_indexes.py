@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="timeslot",
+            index=models.Index(
+                condition=models.Q(("is_available", True)),
+                fields=["provider", "start_time"],
+                name="timeslot_provider_avail_start",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="timeslot",
+            index=models.Index(
+                condition=models.Q(("is_available", True)),
+                fields=["start_time"],
+                name="timeslot_avail_start",
+            ),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_booked_seats(apps, schema_editor):
+    # Every existing slot has one seat, taken if it has an appointment
+    for slot_model, appointment_model in [
+        ("TimeSlot", "Appointment"),
+        ("ArchivedTimeSlot", "ArchivedAppointment"),
+    ]:
+        booked = apps.get_model("appointments", appointment_model).objects.values(
+            "time_slot_id"
+        )
+        apps.get_model("appointments", slot_model).objects.filter(id__in=booked).update(
+            booked_seats=1
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments", "0006_reminders"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="appointment",
+            name="unique_appointment_per_slot",
+        ),
+        migrations.RemoveIndex(
+            model_name="timeslot",
+            name="timeslot_booked_start",
+        ),
+        migrations.AddField(
+            model_name="archivedtimeslot",
+            name="booked_seats",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="archivedtimeslot",
+            name="capacity",
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="timeslot",
+            name="booked_seats",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="timeslot",
+            name="capacity",
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.RunPython(count_booked_seats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="timeslot",
+            index=models.Index(
+                condition=models.Q(("booked_seats__gt", 0)),
+                fields=["start_time"],
+                name="timeslot_booked_start",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="appointment",
+            constraint=models.UniqueConstraint(
+                fields=("time_slot", "user"), name="unique_seat_per_client"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="timeslot",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("booked_seats__lte", models.F("capacity"))),
+                name="timeslot_seats_within_capacity",
+            ),
+        ),
+    ]
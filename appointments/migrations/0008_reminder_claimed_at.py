@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments", "0007_timeslot_capacity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reminder",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="reminder",
+            index=models.Index(
+                condition=models.Q(("status", "sending")),
+                fields=["claimed_at"],
+                name="reminder_sending_claimed_at",
+            ),
+        ),
+    ]
@@ -10,8 +10,49 @@ class TimeSlot(models.Model):
     )
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
+    # Seats on offer and seats taken. Both change only through conditional
+    # UPDATEs in appointments.slots, which keep is_available equal to
+    # booked_seats < capacity.
+    capacity = models.PositiveSmallIntegerField(default=1)
+    booked_seats = models.PositiveSmallIntegerField(default=0)
     is_available = models.BooleanField(default=True)
 
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(booked_seats__lte=models.F("capacity")),
+                name="timeslot_seats_within_capacity",
+            ),
+        ]
+        # SQLite renders ``is_available=True`` as a bare column test, which it
+        # cannot seek on, so availability is the index condition rather than
+        # a key column. Each index holds only the open slots, in start order.
+        indexes = [
+            models.Index(
+                fields=["provider", "start_time"],
+                condition=models.Q(is_available=True),
+                name="timeslot_provider_avail_start",
+            ),
+            models.Index(
+                fields=["start_time"],
+                condition=models.Q(is_available=True),
+                name="timeslot_avail_start",
+            ),
+            # Slots with at least one seat taken, in start order, for the
+            # reminder scan
+            models.Index(
+                fields=["start_time"],
+                condition=models.Q(booked_seats__gt=0),
+                name="timeslot_booked_start",
+            ),
+            # Slots in end order, for the archive command's batches
+            models.Index(fields=["end_time"], name="timeslot_end"),
+        ]
+
+    @property
+    def seats_left(self):
+        return self.capacity - self.booked_seats
+
     def __str__(self):
         return f"{self.provider.username} - {self.start_time} to {self.end_time}"
 
@@ -30,6 +71,105 @@ class Appointment(models.Model):
     ]
     appointment_type = models.CharField(max_length=20, choices=APPOINTMENT_TYPES)
     booked_on = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # A slot may have several seats, but a client takes at most one
+        constraints = [
+            models.UniqueConstraint(
+                fields=["time_slot", "user"], name="unique_seat_per_client"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Appointment for {self.user.username} on {self.time_slot.start_time}"
+
+
+# Outbox of appointment reminder emails. A row is written once per
+# recipient and start time, and its status records delivery so that a
+# restarted sender never mails it twice.
+class Reminder(models.Model):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+    STATUSES = [
+        (PENDING, "Pending"),
+        (SENDING, "Sending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+        (SKIPPED, "Skipped"),
+    ]
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.CASCADE, related_name="reminders"
+    )
+    recipient = models.EmailField()
+    starts_at = models.DateTimeField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    send_after = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When a sender last moved it to sending
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["appointment", "recipient", "starts_at"],
+                name="unique_reminder_per_recipient",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["send_after"],
+                condition=models.Q(status="pending"),
+                name="reminder_pending_send_after",
+            ),
+            models.Index(
+                fields=["claimed_at"],
+                condition=models.Q(status="sending"),
+                name="reminder_sending_claimed_at",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Reminder to {self.recipient} ({self.status})"
+
+
+# Archive of past time slots, moved out of TimeSlot by the
+# archive_past_appointments command. Same columns, ids are preserved.
+class ArchivedTimeSlot(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    provider = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="archived_time_slots"
+    )
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    capacity = models.PositiveSmallIntegerField(default=1)
+    booked_seats = models.PositiveSmallIntegerField(default=0)
+    is_available = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.provider.username} - {self.start_time} to {self.end_time}"
+
+
+# Archive of appointments whose time slot has been archived
+class ArchivedAppointment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="archived_appointments"
+    )
+    time_slot = models.ForeignKey(ArchivedTimeSlot, on_delete=models.CASCADE)
+    comments = models.TextField(blank=True)
+    appointment_type = models.CharField(
+        max_length=20, choices=Appointment.APPOINTMENT_TYPES
+    )
+    booked_on = models.DateTimeField()
+    updated_at = models.DateTimeField()
 
     def __str__(self):
         return f"Appointment for {self.user.username} on {self.time_slot.start_time}"
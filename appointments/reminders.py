@@ -0,0 +1,199 @@
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import mail
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import Appointment, Reminder
+
+# How far ahead of an appointment its reminders are written and sent
+REMINDER_LEAD = timedelta(hours=24)
+
+# Reminders claimed and sent per round over the shared SMTP connection
+REMINDER_BATCH_SIZE = 100
+
+# Sending attempts before a reminder is marked failed, and the delay before
+# each retry (multiplied by the attempts made so far)
+MAX_REMINDER_ATTEMPTS = 3
+REMINDER_RETRY_DELAY = timedelta(minutes=5)
+
+# A reminder still sending this long after it was claimed belongs to a
+# sender that died; whether its email went out is unknown, so it is failed
+REMINDER_SENDING_TIMEOUT = timedelta(minutes=30)
+
+
+def reminder_messages(appointment):
+    """Yield ``(recipient, subject, body)`` for each party with an email."""
+    slot = appointment.time_slot
+    when = timezone.localtime(slot.start_time).strftime("%b %d, %Y %H:%M")
+    subject = f"Reminder: {appointment.appointment_type} appointment on {when}"
+    parties = [
+        (appointment.user, slot.provider),
+        (slot.provider, appointment.user),
+    ]
+    for recipient, other in parties:
+        if not recipient.email:
+            continue
+        name = other.get_full_name() or other.username
+        body = (
+            f"Hello {recipient.get_full_name() or recipient.username},\n\n"
+            f"This is a reminder of your {appointment.appointment_type} "
+            f"appointment with {name} on {when}."
+        )
+        yield recipient.email, subject, body
+
+
+def schedule_reminders(now=None, lead=REMINDER_LEAD):
+    """Write outbox rows for appointments starting within ``lead``.
+
+    Booked slots are scanned in start order through the partial
+    ``timeslot_booked_start`` index. Appointments that already have
+    reminders for their current start time are skipped, so running this
+    repeatedly is safe. Returns the number of reminders written.
+    """
+    now = now or timezone.now()
+    scheduled = Reminder.objects.filter(
+        appointment=OuterRef("pk"), starts_at=OuterRef("time_slot__start_time")
+    )
+    appointments = (
+        Appointment.objects.filter(
+            time_slot__booked_seats__gt=0,
+            time_slot__start_time__gte=now,
+            time_slot__start_time__lt=now + lead,
+        )
+        .exclude(Exists(scheduled))
+        .select_related("user", "time_slot__provider")
+    )
+    reminders = [
+        Reminder(
+            appointment=appointment,
+            recipient=recipient,
+            starts_at=appointment.time_slot.start_time,
+            subject=subject,
+            body=body,
+            send_after=now,
+        )
+        for appointment in appointments.iterator(chunk_size=REMINDER_BATCH_SIZE)
+        for recipient, subject, body in reminder_messages(appointment)
+    ]
+    Reminder.objects.bulk_create(
+        reminders, batch_size=REMINDER_BATCH_SIZE, ignore_conflicts=True
+    )
+    return len(reminders)
+
+
+def due_reminders(now):
+    return Reminder.objects.filter(status=Reminder.PENDING, send_after__lte=now)
+
+
+def claim_reminders(now, batch_size=REMINDER_BATCH_SIZE):
+    """Mark up to ``batch_size`` due reminders as sending and return them.
+
+    A reminder is moved out of pending before its email is handed to the
+    backend. If the sender dies mid-batch, the rows it claimed stay in the
+    sending state until ``fail_stuck_reminders`` finds them.
+    """
+    with transaction.atomic():
+        ids = list(
+            due_reminders(now)
+            .select_for_update(skip_locked=True)
+            .order_by("send_after", "id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        Reminder.objects.filter(id__in=ids).update(
+            status=Reminder.SENDING, attempts=F("attempts") + 1, claimed_at=now
+        )
+    return list(
+        Reminder.objects.filter(id__in=ids)
+        .select_related("appointment__time_slot")
+        .order_by("send_after", "id")
+    )
+
+
+def fail_stuck_reminders(now, timeout=REMINDER_SENDING_TIMEOUT):
+    """Mark reminders stuck in sending for ``timeout`` as failed.
+
+    Their sender died while handing the email to the backend, so it may
+    have gone out; they are never sent again, and stay visible as failed
+    for inspection. Rows claimed before ``claimed_at`` was recorded count
+    as stuck. A sender that is only slow still records the reminder as
+    sent when it finishes. Returns the number failed.
+    """
+    return Reminder.objects.filter(
+        Q(claimed_at__lt=now - timeout) | Q(claimed_at__isnull=True),
+        status=Reminder.SENDING,
+    ).update(status=Reminder.FAILED)
+
+
+def send_reminder(reminder, connection, now):
+    """Send ``reminder`` and record its outcome straight away.
+
+    Returns True if it went out, False if it failed and None if it was
+    skipped. Only the reminder whose email is being handed over can be
+    left in sending by a crash.
+    """
+    update = Reminder.objects.filter(id=reminder.id).update
+    start_time = reminder.appointment.time_slot.start_time
+    if start_time != reminder.starts_at or start_time < now:
+        update(status=Reminder.SKIPPED)
+        return None
+    message = mail.EmailMessage(
+        reminder.subject,
+        reminder.body,
+        settings.DEFAULT_FROM_EMAIL,
+        [reminder.recipient],
+        connection=connection,
+    )
+    try:
+        message.send()
+    except (smtplib.SMTPException, OSError):
+        if reminder.attempts < MAX_REMINDER_ATTEMPTS:
+            update(
+                status=Reminder.PENDING,
+                send_after=now + REMINDER_RETRY_DELAY * reminder.attempts,
+            )
+        else:
+            update(status=Reminder.FAILED)
+        return False
+    update(status=Reminder.SENT, sent_at=timezone.now())
+    return True
+
+
+def send_due_reminders(now=None, batch_size=REMINDER_BATCH_SIZE):
+    """Send every due reminder over one SMTP connection.
+
+    Returns ``(sent, failed)``, where failed counts reminders retried later
+    as well as those given up on. Reminders whose appointment has moved or
+    already started are skipped. A reminder that the mail server rejects is
+    retried up to MAX_REMINDER_ATTEMPTS times.
+
+    Each reminder is recorded as sent as soon as the backend accepts it, so
+    a restart never mails it twice. If sending stops with an error, the
+    reminders of the batch not yet tried are put back to pending. The
+    connection is opened before anything is claimed, so a mail server that
+    cannot be reached leaves every reminder pending for the next run.
+    """
+    now = now or timezone.now()
+    sent = failed = 0
+    fail_stuck_reminders(now)
+    if not due_reminders(now).exists():
+        return sent, failed
+    with mail.get_connection() as connection:
+        batch = claim_reminders(now, batch_size)
+        while batch:
+            for tried, reminder in enumerate(batch, 1):
+                try:
+                    outcome = send_reminder(reminder, connection, now)
+                except BaseException:
+                    untried = [later.id for later in batch[tried:]]
+                    Reminder.objects.filter(id__in=untried).update(
+                        status=Reminder.PENDING, attempts=F("attempts") - 1
+                    )
+                    raise
+                sent += outcome is True
+                failed += outcome is False
+            batch = claim_reminders(now, batch_size)
+    return sent, failed
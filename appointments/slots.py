@@ -0,0 +1,372 @@
+import calendar
+import heapq
+from itertools import islice
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_time
+
+from accounts.models import Profile, Provider
+from calmseek import cursors
+
+from .models import Appointment, TimeSlot
+from .soonest import soonest_slots
+
+# Weekday index by name, as submitted by the recurring slot form
+WEEKDAYS = {name: index for index, name in enumerate(calendar.day_name)}
+
+# Slots returned per page by the time slots API
+SLOT_PAGE_SIZE = 20
+MAX_SLOT_PAGE_SIZE = 100
+
+# Slots read per provider by the first query of an earliest-slot search; each
+# further read of the same provider doubles, up to the number requested
+FIRST_SLOT_CHUNK = 4
+
+
+class SlotUnavailable(Exception):
+    """Raised when a slot is taken before it could be claimed."""
+
+
+def day_bounds(day):
+    """Return the aware ``[start, end)`` datetimes covering ``day``."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
+
+
+def parse_day(value):
+    """Parse a ``YYYY-MM-DD`` string, returning None for anything invalid."""
+    if not value:
+        return None
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+
+def parse_time_of_day(value):
+    """Parse a ``HH:MM`` string, returning None for anything invalid."""
+    if not value:
+        return None
+    try:
+        return parse_time(value)
+    except ValueError:
+        return None
+
+
+def available_time_slots(
+    provider_id=None, selected_date=None, specialization=None, after=None
+):
+    """Available slots from today onwards, optionally for a provider and a day.
+
+    Shared by the booking and rescheduling pages. The filters are laid out so
+    that SQLite can answer them from the partial indexes on TimeSlot that
+    hold only available slots, ``timeslot_provider_avail_start`` on
+    ``(provider, start_time)`` or ``timeslot_avail_start`` on
+    ``start_time``, instead of scanning every slot ever created.
+
+    ``after`` is a decoded ``(start_time, id)`` cursor; only slots ordered
+    after it are returned. It replaces today's lower bound rather than adding
+    a second one, so the index seek starts at the cursor.
+    """
+    start, _ = day_bounds(timezone.localdate())
+    if after and after[0] >= start:
+        start_time, slot_id = after
+        slots = TimeSlot.objects.filter(
+            is_available=True, start_time__gte=start_time
+        ).filter(Q(start_time__gt=start_time) | Q(id__gt=slot_id))
+    else:
+        slots = TimeSlot.objects.filter(is_available=True, start_time__gte=start)
+
+    if provider_id:
+        slots = slots.filter(provider_id=provider_id)
+
+    if specialization:
+        slots = slots.filter(provider__provider__specialization=specialization)
+
+    day = parse_day(selected_date)
+    if day:
+        day_start, day_end = day_bounds(day)
+        slots = slots.filter(start_time__gte=day_start, start_time__lt=day_end)
+
+    return slots.select_related("provider").order_by("start_time", "id")
+
+
+def provider_slot_stream(provider_id, filters, limit):
+    """Yield ``provider_id``'s matching available slots in start order.
+
+    Slots are read in growing keyset chunks off the ``(provider, start_time)``
+    index, so a provider whose first slot never makes the result costs one
+    small query.
+    """
+    start, _ = day_bounds(timezone.localdate())
+    slots = (
+        TimeSlot.objects.filter(provider_id=provider_id, is_available=True)
+        .filter(filters)
+        .select_related("provider")
+        .order_by("start_time", "id")
+    )
+    page = slots.filter(start_time__gte=start)
+    chunk = min(FIRST_SLOT_CHUNK, limit)
+    while True:
+        rows = list(page[:chunk])
+        yield from rows
+        if len(rows) < chunk:
+            return
+        last = rows[-1]
+        page = slots.filter(start_time__gte=last.start_time).filter(
+            Q(start_time__gt=last.start_time) | Q(id__gt=last.id)
+        )
+        chunk = min(chunk * 2, limit)
+
+
+def earliest_available_slots(
+    limit=SLOT_PAGE_SIZE,
+    specialization=None,
+    weekdays=None,
+    earliest=None,
+    latest=None,
+):
+    """Return the first ``limit`` available slots across all providers.
+
+    ``weekdays`` holds weekday indexes (Monday is 0); ``earliest`` and
+    ``latest`` bound the local start time of day, inclusive. Each provider's
+    slots are streamed in start order and the streams are merged with a heap,
+    so at most a few chunks per provider are read however many slots lie
+    ahead.
+    """
+    if specialization:
+        provider_ids = Provider.objects.filter(
+            specialization=specialization
+        ).values_list("user_id", flat=True)
+    else:
+        provider_ids = Profile.objects.filter(role="Provider").values_list(
+            "id", flat=True
+        )
+
+    filters = Q()
+    if weekdays:
+        filters &= Q(start_time__iso_week_day__in=[day + 1 for day in weekdays])
+    if earliest:
+        filters &= Q(start_time__time__gte=earliest)
+    if latest:
+        filters &= Q(start_time__time__lte=latest)
+
+    streams = [
+        provider_slot_stream(provider_id, filters, limit)
+        for provider_id in provider_ids
+    ]
+    merged = heapq.merge(*streams, key=lambda slot: (slot.start_time, slot.id))
+    return list(islice(merged, limit))
+
+
+def encode_cursor(slot):
+    """Encode the ``(start_time, id)`` position just after ``slot``."""
+    return cursors.encode_cursor(slot.start_time.isoformat(), slot.id)
+
+
+def decode_cursor(cursor):
+    return cursors.decode_cursor(cursor, cursors.aware_datetime, int)
+
+
+def slot_page(slots, limit=SLOT_PAGE_SIZE):
+    """Return ``(page, next_cursor)`` for ``slots`` ordered by (start_time, id).
+
+    Pages are located by keyset rather than OFFSET: the cursor holds the last
+    ``(start_time, id)`` seen and is passed back to ``available_time_slots``
+    as ``after``, so a deep page costs the same as the first one.
+    """
+    page = list(slots[: limit + 1])
+    if len(page) > limit:
+        page = page[:limit]
+        return page, encode_cursor(page[-1])
+    return page, None
+
+
+def claim_seat(slot_id):
+    """Take one seat of ``slot_id``, returning False if none is left.
+
+    A single conditional UPDATE counts the seat and recomputes
+    ``is_available`` from the row's own counters. Concurrent claims are
+    serialised by the database, so the slot is never overbooked.
+    """
+    return bool(
+        TimeSlot.objects.filter(id=slot_id, is_available=True).update(
+            booked_seats=F("booked_seats") + 1,
+            is_available=Case(
+                When(booked_seats__lt=F("capacity") - 1, then=Value(True)),
+                default=Value(False),
+            ),
+        )
+    )
+
+
+def release_seat(slot_id):
+    """Give back one seat of ``slot_id``."""
+    TimeSlot.objects.filter(id=slot_id).update(
+        booked_seats=Greatest(F("booked_seats") - 1, Value(0)), is_available=True
+    )
+
+
+def book_time_slot(appointment, slot_id):
+    """Claim a seat of ``slot_id`` and save ``appointment`` in it atomically.
+
+    The claim is a single conditional UPDATE, so however many bookings race
+    for a slot, at most ``capacity`` of them succeed. The check constraint on
+    TimeSlot backs this up, and the unique constraint on Appointment stops a
+    client from taking two seats of the same slot.
+    """
+    slot_id = int(slot_id)
+    try:
+        with transaction.atomic():
+            if not claim_seat(slot_id):
+                raise SlotUnavailable
+            appointment.time_slot_id = slot_id
+            appointment.save()
+    except IntegrityError:
+        raise SlotUnavailable
+    finally:
+        soonest_slots.discard_slot(slot_id)
+    return appointment
+
+
+def cancel_booking(appointment):
+    """Delete ``appointment`` and give its seat back to the slot."""
+    # Delete the appointment before releasing its seat, so a new booking can
+    # never claim the seat while this one still holds it
+    with transaction.atomic():
+        appointment.delete()
+        release_seat(appointment.time_slot_id)
+    slot = appointment.time_slot
+    slot.is_available = True
+    soonest_slots.offer(slot)
+
+
+def reschedule_appointment(appointment, slot_id):
+    """Move ``appointment`` to ``slot_id``, saving its edited fields with it.
+
+    A seat of the new slot is claimed and the old seat released in one
+    transaction, both by conditional UPDATEs issued in ascending slot id
+    order so that two concurrent reschedules always take row locks in the
+    same order. The appointment itself is only moved if it still holds the
+    slot it was loaded with. Raises SlotUnavailable, rolling everything
+    back, if either check fails.
+    """
+    slot_id = int(slot_id)
+    old_slot_id = appointment.time_slot_id
+    try:
+        with transaction.atomic():
+            if slot_id != old_slot_id:
+                for locked_id in sorted((old_slot_id, slot_id)):
+                    if locked_id == slot_id:
+                        if not claim_seat(slot_id):
+                            raise SlotUnavailable
+                    else:
+                        release_seat(old_slot_id)
+
+            moved = Appointment.objects.filter(
+                id=appointment.id, time_slot_id=old_slot_id
+            ).update(
+                time_slot_id=slot_id,
+                comments=appointment.comments,
+                appointment_type=appointment.appointment_type,
+                updated_at=timezone.now(),
+            )
+            if not moved:
+                raise SlotUnavailable
+    except IntegrityError:
+        raise SlotUnavailable
+    finally:
+        soonest_slots.discard_slot(slot_id)
+    if slot_id != old_slot_id:
+        # The released slot may now be its provider's soonest
+        soonest_slots.offer(appointment.time_slot)
+    appointment.time_slot_id = slot_id
+    return appointment
+
+
+def recurring_time_slots(
+    provider, start_time, end_time, days, num_weeks, first_day, capacity=1
+):
+    """Build, without saving, the weekly series of slots starting ``first_day``.
+
+    Slots are returned sorted by start time. Unknown or repeated day names are
+    ignored.
+    """
+    weekdays = sorted({WEEKDAYS[day] for day in days if day in WEEKDAYS})
+    slots = []
+    for week in range(num_weeks):
+        for weekday_index in weekdays:
+            days_until_next = (weekday_index - first_day.weekday()) % 7
+            slot_date = first_day + timedelta(days=days_until_next + week * 7)
+            slots.append(
+                TimeSlot(
+                    provider=provider,
+                    start_time=timezone.make_aware(
+                        datetime.combine(slot_date, start_time)
+                    ),
+                    end_time=timezone.make_aware(datetime.combine(slot_date, end_time)),
+                    capacity=capacity,
+                    is_available=True,
+                )
+            )
+    slots.sort(key=lambda slot: slot.start_time)
+    return slots
+
+
+def find_overlaps(new_slots, existing_slots):
+    """Return the slots of ``new_slots`` that overlap any of ``existing_slots``.
+
+    ``new_slots`` must be sorted and must not overlap each other, which holds
+    for a recurring series. Both lists are swept once in start order: a new
+    slot conflicts if it starts before the furthest end seen among the
+    existing slots, or if an existing slot starts before it ends.
+    """
+    events = sorted(
+        [(slot.start_time, 1, i, slot) for i, slot in enumerate(new_slots)]
+        + [(slot.start_time, 0, i, slot) for i, slot in enumerate(existing_slots)],
+        key=lambda event: event[:3],
+    )
+    conflicts = {}
+    existing_reach = None
+    last_new = None
+    for start, is_new, index, slot in events:
+        if is_new:
+            if existing_reach is not None and start < existing_reach:
+                conflicts[index] = slot
+            last_new = (index, slot)
+        else:
+            if last_new is not None and start < last_new[1].end_time:
+                conflicts[last_new[0]] = last_new[1]
+            if existing_reach is None or slot.end_time > existing_reach:
+                existing_reach = slot.end_time
+    return [conflicts[index] for index in sorted(conflicts)]
+
+
+def create_time_slots(provider, new_slots):
+    """Save the non-overlapping part of ``new_slots`` in one bulk insert.
+
+    ``new_slots`` must be sorted by start time. Returns ``(created,
+    conflicts)``; conflicting slots are left unsaved.
+    """
+    if not new_slots:
+        return [], []
+    with transaction.atomic():
+        existing_slots = list(
+            TimeSlot.objects.filter(
+                provider=provider,
+                start_time__lt=new_slots[-1].end_time,
+                end_time__gt=new_slots[0].start_time,
+            ).only("start_time", "end_time")
+        )
+        conflicts = find_overlaps(new_slots, existing_slots)
+        conflicting = {id(slot) for slot in conflicts}
+        slots = [slot for slot in new_slots if id(slot) not in conflicting]
+        created = TimeSlot.objects.bulk_create(slots)
+    if created:
+        soonest_slots.offer(created[0])
+    return created, conflicts
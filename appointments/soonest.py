@@ -0,0 +1,123 @@
+import threading
+import time
+
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from accounts.models import Profile
+
+from .models import TimeSlot
+
+# Seconds an entry is trusted before it is reloaded, so changes made by other
+# processes are picked up even though only this process's writes update it
+SOONEST_TTL = 60
+
+
+class SoonestSlotIndex:
+    """Per-process map of each provider's soonest available future slot.
+
+    Entries are loaded lazily from the ``(provider, start_time)`` index and
+    kept current by the booking, cancel and slot creation paths of this
+    process. An entry may still be stale when another process claimed the
+    slot; callers claim slots with a conditional UPDATE and ``discard`` the
+    provider when that fails.
+    """
+
+    def __init__(self, ttl=SOONEST_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # provider id -> (start_time, slot_id, loaded_at); start_time and
+        # slot_id are None when the provider has no future availability
+        self.entries = {}
+        self.providers_by_slot = {}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.providers_by_slot.clear()
+
+    def soonest(self, provider_ids):
+        """Return ``(start_time, slot_id, provider_id)`` per provider.
+
+        Missing, expired and passed entries are reloaded together in one
+        query. Providers without future availability are left out.
+        """
+        now = timezone.now()
+        loaded_before = time.monotonic() - self.ttl
+        entries = {}
+        stale = []
+        for provider_id in provider_ids:
+            entry = self.entries.get(provider_id)
+            if (
+                entry is None
+                or entry[2] < loaded_before
+                or (entry[0] is not None and entry[0] < now)
+            ):
+                stale.append(provider_id)
+            else:
+                entries[provider_id] = entry
+        if stale:
+            entries.update(self.load(stale, now))
+        return [
+            (entry[0], entry[1], provider_id)
+            for provider_id, entry in entries.items()
+            if entry[0] is not None
+        ]
+
+    def load(self, provider_ids, now):
+        # One correlated subquery per provider, each a seek on the
+        # (provider, start_time) index
+        first_slot = TimeSlot.objects.filter(
+            provider_id=OuterRef("pk"), is_available=True, start_time__gte=now
+        ).order_by("start_time", "id")
+        rows = Profile.objects.filter(id__in=provider_ids).values_list(
+            "id",
+            Subquery(first_slot.values("start_time")[:1]),
+            Subquery(first_slot.values("id")[:1]),
+        )
+        loaded_at = time.monotonic()
+        entries = {
+            provider_id: (start_time, slot_id, loaded_at)
+            for provider_id, start_time, slot_id in rows
+        }
+        with self.lock:
+            for provider_id, entry in entries.items():
+                self.drop(provider_id)
+                self.entries[provider_id] = entry
+                if entry[1] is not None:
+                    self.providers_by_slot[entry[1]] = provider_id
+        return entries
+
+    def discard(self, provider_id):
+        with self.lock:
+            self.drop(provider_id)
+
+    def discard_slot(self, slot_id):
+        """Forget the entry pointing at ``slot_id``, which is no longer free."""
+        with self.lock:
+            provider_id = self.providers_by_slot.get(slot_id)
+            if provider_id is not None:
+                self.drop(provider_id)
+
+    def offer(self, slot):
+        """Record that ``slot`` became available, if it is now the soonest."""
+        with self.lock:
+            entry = self.entries.get(slot.provider_id)
+            if entry is None or slot.start_time < timezone.now():
+                return
+            if entry[0] is None or (slot.start_time, slot.id) < entry[:2]:
+                self.drop(slot.provider_id)
+                self.entries[slot.provider_id] = (
+                    slot.start_time,
+                    slot.id,
+                    entry[2],
+                )
+                self.providers_by_slot[slot.id] = slot.provider_id
+
+    def drop(self, provider_id):
+        entry = self.entries.pop(provider_id, None)
+        if entry is not None:
+            self.providers_by_slot.pop(entry[1], None)
+
+
+soonest_slots = SoonestSlotIndex()
@@ -1,10 +1,51 @@
 # Create your tests here.
-from django.test import TestCase
+import base64
+import random
+import smtplib
+import threading
+from io import StringIO
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from datetime import datetime, timedelta
-from appointments.models import TimeSlot, Appointment
-from accounts.models import Profile
+from datetime import datetime, time, timedelta
+from appointments.archive import archive_batch, archived_appointments
+from appointments.emergency import book_emergency_appointment
+from appointments.holds import hold_slot, release_slot
+from appointments.reminders import (
+    MAX_REMINDER_ATTEMPTS,
+    REMINDER_SENDING_TIMEOUT,
+    schedule_reminders,
+    send_due_reminders,
+)
+from appointments.ical import feed_token
+from appointments.models import (
+    ArchivedAppointment,
+    ArchivedTimeSlot,
+    Reminder,
+    TimeSlot,
+    Appointment,
+)
+from appointments.slots import (
+    SlotUnavailable,
+    available_time_slots,
+    book_time_slot,
+    cancel_booking,
+    decode_cursor,
+    earliest_available_slots,
+    reschedule_appointment,
+    slot_page,
+)
+from appointments.soonest import soonest_slots
+from accounts.models import Profile, Provider
+from calmseek.cursors import InvalidCursor
+from messaging.models import Message
 
 
 class AppointmentTests(TestCase):
@@ -234,6 +275,8 @@ class BookAppointmentViewTest(TestCase):
             email="provider@example.com",
         )
 
+        self.addCleanup(cache.clear)
+
         # Create a time slot
         self.time_slot = TimeSlot.objects.create(
             provider=self.provider,
@@ -288,6 +331,25 @@ class BookAppointmentViewTest(TestCase):
         self.time_slot.refresh_from_db()
         self.assertFalse(self.time_slot.is_available)
 
+    def test_booking_slot_taken_after_form_opened(self):
+        other = Profile.objects.create_user(
+            username="other", password="password", role="User", email="o@example.com"
+        )
+        book_time_slot(
+            Appointment(user=other, appointment_type="Checkup"), self.time_slot.id
+        )
+
+        self.client.login(username="user", password="password")
+        response = self.client.post(
+            reverse("appointments:book_appointment"),
+            {"time_slot": self.time_slot.id, "appointment_type": "Consultation"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].non_field_errors())
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(Appointment.objects.get().user, other)
+
 
 class UpdateAppointmentViewTests(TestCase):
     def setUp(self):
@@ -305,7 +367,7 @@ class UpdateAppointmentViewTests(TestCase):
             provider=self.provider,
             start_time=datetime(2024, 12, 1, 10, 0),
             end_time=datetime(2024, 12, 1, 11, 0),
-            is_available=True,
+            is_available=False,  # Booked by self.appointment below
         )
         self.time_slot2 = TimeSlot.objects.create(
             id=2,
@@ -382,6 +444,12 @@ class UpdateAppointmentViewTests(TestCase):
         self.assertEqual(self.appointment.time_slot, self.time_slot1)
         self.assertNotEqual(self.appointment.appointment_type, "")
 
+        # Neither slot changes hands when validation fails
+        self.time_slot1.refresh_from_db()
+        self.assertFalse(self.time_slot1.is_available)
+        self.time_slot2.refresh_from_db()
+        self.assertTrue(self.time_slot2.is_available)
+
     def test_update_appointment_invalid_appointment_id(self):
         """Test that updating with an invalid appointment ID returns a 404 error."""
         response = self.client.post(
@@ -393,3 +461,1120 @@ class UpdateAppointmentViewTests(TestCase):
             },
         )
         self.assertEqual(response.status_code, 404)
+
+
+class SlotQueryTests(TestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.other_provider = Profile.objects.create_user(
+            username="other_provider",
+            password="pass",
+            role="Provider",
+            email="other@example.com",
+        )
+
+    def make_slot(self, provider, start, is_available=True):
+        return TimeSlot.objects.create(
+            provider=provider,
+            start_time=start,
+            end_time=start + timedelta(hours=1),
+            is_available=is_available,
+        )
+
+    @override_settings(TIME_ZONE="America/New_York")
+    def test_selected_day_uses_local_day_bounds(self):
+        tz = timezone.get_current_timezone()
+        day = timezone.localdate() + timedelta(days=2)
+        late = self.make_slot(
+            self.provider, timezone.make_aware(datetime.combine(day, time(23, 30)), tz)
+        )
+        self.make_slot(
+            self.provider,
+            timezone.make_aware(
+                datetime.combine(day + timedelta(days=1), time(0, 30)), tz
+            ),
+        )
+
+        slots = available_time_slots(selected_date=day.isoformat())
+
+        self.assertEqual(list(slots), [late])
+
+    def test_filters_provider_and_availability(self):
+        start = timezone.now() + timedelta(days=1)
+        open_slot = self.make_slot(self.provider, start)
+        self.make_slot(self.provider, start + timedelta(hours=1), is_available=False)
+        self.make_slot(self.other_provider, start)
+        self.make_slot(self.provider, start - timedelta(days=3))
+
+        slots = available_time_slots(provider_id=self.provider.id)
+
+        self.assertEqual(list(slots), [open_slot])
+
+    def test_invalid_date_is_ignored(self):
+        slot = self.make_slot(self.provider, timezone.now() + timedelta(days=1))
+
+        self.assertEqual(list(available_time_slots(selected_date="2024-13-45")), [slot])
+
+    def test_queries_use_availability_indexes(self):
+        plan = available_time_slots().explain()
+        self.assertIn("timeslot_avail_start", plan)
+
+        plan = available_time_slots(provider_id=self.provider.id).explain()
+        self.assertIn("timeslot_provider_avail_start", plan)
+
+
+class BookingContentionTests(TransactionTestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.users = [
+            Profile.objects.create(
+                username=f"user{i}", email=f"user{i}@example.com", role="User"
+            )
+            for i in range(8)
+        ]
+        start = timezone.now() + timedelta(days=1)
+        self.slots = [
+            TimeSlot.objects.create(
+                provider=self.provider,
+                start_time=start + timedelta(hours=i),
+                end_time=start + timedelta(hours=i + 1),
+            )
+            for i in range(5)
+        ]
+
+    def test_concurrent_bookings_never_double_book(self):
+        barrier = threading.Barrier(len(self.users))
+        booked = []
+
+        def book(user):
+            try:
+                barrier.wait()
+                for slot in self.slots:
+                    appointment = Appointment(user=user, appointment_type="Checkup")
+                    while True:
+                        try:
+                            book_time_slot(appointment, slot.id)
+                        except SlotUnavailable:
+                            break
+                        except OperationalError:
+                            # Shared-cache SQLite reports lock contention
+                            # instead of waiting; retry the booking
+                            continue
+                        booked.append(slot.id)
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(u,)) for u in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(booked), sorted(s.id for s in self.slots))
+        self.assertEqual(Appointment.objects.count(), len(self.slots))
+        self.assertFalse(TimeSlot.objects.filter(is_available=True).exists())
+
+    def run_concurrently(self, work):
+        barrier = threading.Barrier(len(self.users))
+
+        def run(user):
+            try:
+                barrier.wait()
+                work(user)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(u,)) for u in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def retry_locked(self, action):
+        # Shared-cache SQLite reports lock contention instead of waiting
+        while True:
+            try:
+                return action()
+            except OperationalError:
+                continue
+
+    def test_concurrent_group_bookings_and_cancels_keep_count(self):
+        for capacity, slot in enumerate(self.slots, start=1):
+            TimeSlot.objects.filter(id=slot.id).update(capacity=capacity)
+
+        def book(user):
+            for slot in self.slots:
+                appointment = Appointment(user=user, appointment_type="Checkup")
+                try:
+                    self.retry_locked(lambda: book_time_slot(appointment, slot.id))
+                except SlotUnavailable:
+                    pass
+
+        self.run_concurrently(book)
+        for capacity, slot in enumerate(self.slots, start=1):
+            slot.refresh_from_db()
+            self.assertEqual(slot.booked_seats, capacity)
+            self.assertEqual(slot.appointment_set.count(), capacity)
+            self.assertFalse(slot.is_available)
+
+        def cancel(user):
+            ids = self.retry_locked(
+                lambda: list(
+                    Appointment.objects.filter(user=user).values_list("id", flat=True)
+                )
+            )
+            appointments = Appointment.objects.select_related("time_slot")
+            for appointment_id in ids:
+                self.retry_locked(
+                    lambda: cancel_booking(appointments.get(id=appointment_id))
+                )
+
+        self.run_concurrently(cancel)
+        self.assertFalse(Appointment.objects.exists())
+        self.assertEqual(
+            list(TimeSlot.objects.values_list("booked_seats", "is_available")),
+            [(0, True)] * len(self.slots),
+        )
+
+    def test_second_seat_for_same_client_is_rejected(self):
+        slot = self.slots[0]
+        TimeSlot.objects.filter(id=slot.id).update(capacity=2)
+        book_time_slot(
+            Appointment(user=self.users[0], appointment_type="Checkup"), slot.id
+        )
+
+        with self.assertRaises(SlotUnavailable):
+            book_time_slot(
+                Appointment(user=self.users[0], appointment_type="Checkup"), slot.id
+            )
+
+        # The seat claimed for the rejected booking is rolled back
+        slot.refresh_from_db()
+        self.assertTrue(slot.is_available)
+        self.assertEqual(slot.booked_seats, 1)
+        self.assertEqual(Appointment.objects.filter(time_slot=slot).count(), 1)
+
+
+class TimeSlotsApiTests(TestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.other_provider = Profile.objects.create_user(
+            username="other_provider",
+            password="pass",
+            role="Provider",
+            email="other@example.com",
+        )
+        Provider.objects.create(
+            user=self.other_provider,
+            bio="Therapist",
+            phone_number="1234567890",
+            license_number="LIC1",
+            specialization="Psychiatry",
+        )
+        self.user = Profile.objects.create_user(
+            username="user", password="pass", role="User", email="user@example.com"
+        )
+        self.client.login(username="user", password="pass")
+
+        start = timezone.now() + timedelta(days=1)
+        # Several slots share a start time so the id tie-breaker is exercised
+        self.slots = [
+            TimeSlot.objects.create(
+                provider=self.provider,
+                start_time=start + timedelta(hours=i // 3),
+                end_time=start + timedelta(hours=i // 3 + 1),
+            )
+            for i in range(10)
+        ]
+
+    def fetch(self, **params):
+        response = self.client.get(reverse("appointments:time_slots_api"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_cover_every_slot_once(self):
+        seen = []
+        data = self.fetch(limit=3)
+        seen += [slot["id"] for slot in data["slots"]]
+        while data["next_cursor"]:
+            data = self.fetch(limit=3, cursor=data["next_cursor"])
+            seen += [slot["id"] for slot in data["slots"]]
+
+        self.assertEqual(seen, [slot.id for slot in self.slots])
+
+    def test_group_slot_stays_listed_until_full(self):
+        slot = self.slots[0]
+        TimeSlot.objects.filter(id=slot.id).update(capacity=2)
+        book_time_slot(Appointment(user=self.user, appointment_type="Checkup"), slot.id)
+
+        listed = self.fetch(limit=1)["slots"][0]
+        self.assertEqual(listed["id"], slot.id)
+        self.assertEqual((listed["capacity"], listed["seats_left"]), (2, 1))
+
+        book_time_slot(
+            Appointment(user=self.other_provider, appointment_type="Checkup"), slot.id
+        )
+        self.assertNotEqual(self.fetch(limit=1)["slots"][0]["id"], slot.id)
+
+    def test_filters(self):
+        slot = TimeSlot.objects.create(
+            provider=self.other_provider,
+            start_time=timezone.now() + timedelta(days=5),
+            end_time=timezone.now() + timedelta(days=5, hours=1),
+        )
+
+        data = self.fetch(provider=self.other_provider.id)
+        self.assertEqual([s["id"] for s in data["slots"]], [slot.id])
+
+        data = self.fetch(specialization="Psychiatry")
+        self.assertEqual([s["id"] for s in data["slots"]], [slot.id])
+
+        day = timezone.localtime(slot.start_time).date().isoformat()
+        data = self.fetch(date=day)
+        self.assertEqual([s["id"] for s in data["slots"]], [slot.id])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse("appointments:time_slots_api"), {"cursor": "not-a-cursor"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_naive_cursor_is_invalid(self):
+        naive = base64.urlsafe_b64encode(b'["2030-01-01T09:00:00", 1]').decode()
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(naive)
+        response = self.client.get(
+            reverse("appointments:time_slots_api"), {"cursor": naive}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_query_seeks_index(self):
+        _, cursor = slot_page(available_time_slots(), limit=3)
+
+        plan = available_time_slots(after=decode_cursor(cursor)).explain()
+
+        self.assertIn("timeslot_avail_start (start_time>?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_time_slots_page_renders_first_page(self):
+        response = self.client.get(reverse("appointments:time_slots"))
+        self.assertEqual(len(response.context["time_slots"]), 10)
+        self.assertIsNone(response.context["next_cursor"])
+
+
+class RescheduleContentionTests(TransactionTestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create(
+            username="provider", email="provider@example.com", role="Provider"
+        )
+        start = timezone.now() + timedelta(days=1)
+        self.slots = [
+            TimeSlot.objects.create(
+                provider=self.provider,
+                start_time=start + timedelta(hours=i),
+                end_time=start + timedelta(hours=i + 1),
+            )
+            for i in range(10)
+        ]
+        self.appointments = []
+        for i in range(6):
+            user = Profile.objects.create(
+                username=f"user{i}", email=f"user{i}@example.com", role="User"
+            )
+            self.appointments.append(
+                book_time_slot(
+                    Appointment(user=user, appointment_type="Checkup"),
+                    self.slots[i].id,
+                )
+            )
+
+    def test_concurrent_reschedules_keep_slots_consistent(self):
+        slot_ids = [slot.id for slot in self.slots]
+        barrier = threading.Barrier(6)
+
+        def reschedule(seed):
+            rng = random.Random(seed)
+            try:
+                barrier.wait()
+                for _ in range(30):
+                    appointment_id = rng.choice(self.appointments).id
+                    target = rng.choice(slot_ids)
+                    try:
+                        appointment = Appointment.objects.get(id=appointment_id)
+                        reschedule_appointment(appointment, target)
+                    except (SlotUnavailable, OperationalError):
+                        # Lost the race for the slot or, on shared-cache
+                        # SQLite, for the table lock; either way nothing moved
+                        continue
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reschedule, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        booked = set(Appointment.objects.values_list("time_slot_id", flat=True))
+        self.assertEqual(len(booked), len(self.appointments))
+        self.assertEqual(
+            set(
+                TimeSlot.objects.filter(is_available=False).values_list("id", flat=True)
+            ),
+            booked,
+        )
+
+    def test_failed_claim_keeps_old_slot(self):
+        appointment = self.appointments[0]
+        taken = self.slots[1]
+
+        with self.assertRaises(SlotUnavailable):
+            reschedule_appointment(appointment, taken.id)
+
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.time_slot_id, self.slots[0].id)
+        self.slots[0].refresh_from_db()
+        self.assertFalse(self.slots[0].is_available)
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+            first_name="Pat",
+            last_name="Doe",
+        )
+        self.user = Profile.objects.create_user(
+            username="user",
+            password="pass",
+            role="User",
+            email="user@example.com",
+            first_name="Sam",
+            last_name="Lee",
+        )
+        start = timezone.now() + timedelta(days=1)
+        self.slot = TimeSlot.objects.create(
+            provider=self.provider,
+            start_time=start,
+            end_time=start + timedelta(hours=1),
+        )
+        self.appointment = book_time_slot(
+            Appointment(
+                user=self.user,
+                appointment_type="Checkup",
+                comments="First visit; bring notes, please",
+            ),
+            self.slot.id,
+        )
+
+    def feed_url(self, user):
+        return reverse("appointments:calendar_feed", args=[feed_token(user)])
+
+    def read(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_client_and_provider_feeds(self):
+        response = self.client.get(self.feed_url(self.user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/calendar; charset=utf-8")
+        body = self.read(response)
+        self.assertIn("SUMMARY:Checkup with Pat Doe\r\n", body)
+        self.assertIn(r"DESCRIPTION:First visit\; bring notes\, please", body)
+        self.assertTrue(body.endswith("END:VCALENDAR\r\n"))
+
+        body = self.read(self.client.get(self.feed_url(self.provider)))
+        self.assertIn("SUMMARY:Checkup with Sam Lee\r\n", body)
+
+    def test_invalid_token(self):
+        url = reverse("appointments:calendar_feed", args=[f"{self.user.pk}:forged"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_unchanged_feed_returns_not_modified(self):
+        url = self.feed_url(self.user)
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Rescheduling and cancelling both change the feed's ETag
+        start = timezone.now() + timedelta(days=2)
+        other = TimeSlot.objects.create(
+            provider=self.provider, start_time=start, end_time=start
+        )
+        reschedule_appointment(self.appointment, other.id)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        self.appointment.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_long_lines_are_folded(self):
+        self.appointment.comments = "é" * 100
+        self.appointment.save()
+
+        body = self.read(self.client.get(self.feed_url(self.user)))
+
+        for line in body.split("\r\n"):
+            self.assertLessEqual(len(line.encode()), 75)
+        self.assertIn("DESCRIPTION:" + "é" * 31 + "\r\n " + "é" * 37, body)
+
+
+class EarliestSlotSearchTests(TestCase):
+    def setUp(self):
+        self.providers = [
+            Profile.objects.create_user(
+                username=f"provider{i}",
+                password="pass",
+                role="Provider",
+                email=f"provider{i}@example.com",
+            )
+            for i in range(3)
+        ]
+        for provider, specialization in zip(
+            self.providers, ["Psychiatry", "Psychiatry", "Neuropsychology"]
+        ):
+            Provider.objects.create(
+                user=provider,
+                bio="Therapist",
+                phone_number="1234567890",
+                license_number="LIC1",
+                specialization=specialization,
+            )
+        self.user = Profile.objects.create_user(
+            username="user", password="pass", role="User", email="user@example.com"
+        )
+
+        rng = random.Random(7)
+        start = timezone.make_aware(
+            datetime.combine(timezone.localdate() + timedelta(days=1), time(8))
+        )
+        for _ in range(300):
+            slot_start = start + timedelta(hours=rng.randrange(24 * 28))
+            TimeSlot.objects.create(
+                provider=rng.choice(self.providers),
+                start_time=slot_start,
+                end_time=slot_start + timedelta(hours=1),
+                is_available=rng.random() < 0.8,
+            )
+
+    def expected(self, limit, match=lambda slot: True):
+        slots = TimeSlot.objects.filter(is_available=True).order_by("start_time", "id")
+        return [slot.id for slot in slots if match(slot)][:limit]
+
+    def test_merges_providers_in_start_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            slots = earliest_available_slots(10)
+        self.assertEqual([slot.id for slot in slots], self.expected(10))
+        # One query for the providers, then at most a couple of small
+        # chunks each; the hundreds of later slots are never read
+        self.assertLessEqual(len(queries), 1 + 3 * 3)
+
+    def test_specialization(self):
+        slots = earliest_available_slots(10, specialization="Psychiatry")
+        self.assertEqual(
+            [slot.id for slot in slots],
+            self.expected(10, lambda slot: slot.provider_id != self.providers[2].id),
+        )
+
+    def test_weekday_and_time_of_day(self):
+        slots = earliest_available_slots(
+            10, weekdays=[0, 4], earliest=time(9), latest=time(17)
+        )
+
+        def match(slot):
+            local = timezone.localtime(slot.start_time)
+            return local.weekday() in (0, 4) and time(9) <= local.time() <= time(17)
+
+        self.assertEqual([slot.id for slot in slots], self.expected(10, match))
+
+    def test_api(self):
+        self.client.login(username="user", password="pass")
+        url = reverse("appointments:earliest_time_slots_api")
+
+        response = self.client.get(
+            url, {"specialization": "Neuropsychology", "days": "Monday,Friday"}
+        )
+        self.assertEqual(response.status_code, 200)
+        ids = [slot["id"] for slot in response.json()["slots"]]
+        self.assertEqual(
+            ids,
+            self.expected(
+                20,
+                lambda slot: slot.provider_id == self.providers[2].id
+                and timezone.localtime(slot.start_time).weekday() in (0, 4),
+            ),
+        )
+
+        self.assertEqual(self.client.get(url, {"days": "Someday"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"from": "25:00"}).status_code, 400)
+
+
+class EmergencyAppointmentTests(TestCase):
+    def setUp(self):
+        soonest_slots.clear()
+        self.addCleanup(soonest_slots.clear)
+        self.providers = {}
+        for name, specialization, activated in [
+            ("psychiatrist", "Psychiatry", True),
+            ("counselor", "Counseling Psychology", True),
+            ("inactive", "Psychiatry", False),
+        ]:
+            profile = Profile.objects.create_user(
+                username=name,
+                password="pass",
+                role="Provider",
+                email=f"{name}@example.com",
+            )
+            Provider.objects.create(
+                user=profile,
+                bio="Therapist",
+                phone_number="1234567890",
+                license_number="LIC1",
+                specialization=specialization,
+                is_activated=activated,
+            )
+            self.providers[name] = profile
+        self.user = Profile.objects.create_user(
+            username="user", password="pass", role="User", email="user@example.com"
+        )
+
+        now = timezone.now()
+        self.slots = {}
+        for name, hours in [
+            ("inactive", [1]),
+            ("counselor", [2, 6]),
+            ("psychiatrist", [3, 5]),
+        ]:
+            self.slots[name] = [
+                TimeSlot.objects.create(
+                    provider=self.providers[name],
+                    start_time=now + timedelta(hours=hour),
+                    end_time=now + timedelta(hours=hour + 1),
+                )
+                for hour in hours
+            ]
+
+    def test_books_soonest_slot_of_activated_providers(self):
+        appointment = book_emergency_appointment(self.user, comments="Panic attack")
+
+        self.assertEqual(appointment.time_slot_id, self.slots["counselor"][0].id)
+        self.assertEqual(appointment.appointment_type, "Emergency")
+        self.assertFalse(TimeSlot.objects.get(id=appointment.time_slot_id).is_available)
+        message = Message.objects.get()
+        self.assertEqual(message.sender, self.user)
+        self.assertEqual(message.receiver, self.providers["counselor"])
+        self.assertIn("Panic attack", message.content)
+
+        appointment = book_emergency_appointment(self.user, ["Psychiatry"])
+        self.assertEqual(appointment.time_slot_id, self.slots["psychiatrist"][0].id)
+
+    def test_warm_index_answers_without_queries(self):
+        provider_ids = [profile.id for profile in self.providers.values()]
+        with self.assertNumQueries(1):
+            soonest_slots.soonest(provider_ids)
+        with self.assertNumQueries(0):
+            soonest = soonest_slots.soonest(provider_ids)
+        self.assertEqual(min(soonest)[1], self.slots["inactive"][0].id)
+
+    def test_index_follows_bookings_and_cancels(self):
+        counselor = self.providers["counselor"]
+        first, second = self.slots["counselor"]
+        soonest_slots.soonest([counselor.id])
+
+        appointment = book_time_slot(
+            Appointment(user=self.user, appointment_type="Checkup"), first.id
+        )
+        self.assertEqual(soonest_slots.soonest([counselor.id])[0][1], second.id)
+
+        self.client.login(username="user", password="pass")
+        self.client.post(
+            reverse("appointments:cancel_appointment", args=[appointment.id])
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(soonest_slots.soonest([counselor.id])[0][1], first.id)
+
+    def test_stale_entry_falls_through_to_next_slot(self):
+        provider_ids = [self.providers["counselor"].id]
+        soonest_slots.soonest(provider_ids)
+        # Taken by another process, which this index never hears about
+        TimeSlot.objects.filter(id=self.slots["counselor"][0].id).update(
+            is_available=False
+        )
+
+        appointment = book_emergency_appointment(self.user, ["Counseling Psychology"])
+        self.assertEqual(appointment.time_slot_id, self.slots["counselor"][1].id)
+
+    def test_api(self):
+        url = reverse("appointments:emergency_appointment")
+        self.client.login(username="user", password="pass")
+
+        response = self.client.post(url, {"specialization": "Psychiatry"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["slot"]["id"], self.slots["psychiatrist"][0].id)
+        self.assertTrue(
+            Appointment.objects.filter(
+                id=data["appointment_id"], appointment_type="Emergency"
+            ).exists()
+        )
+
+        response = self.client.post(url, {"specialization": "Astrology"})
+        self.assertEqual(response.status_code, 400)
+
+        TimeSlot.objects.update(is_available=False)
+        response = self.client.post(url, {"specialization": "Psychiatry"})
+        self.assertEqual(response.status_code, 409)
+
+        self.client.login(username="psychiatrist", password="pass")
+        self.assertEqual(self.client.post(url).status_code, 403)
+
+
+class SenderCrashed(Exception):
+    pass
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    """Locmem backend that counts connections and can refuse recipients.
+
+    With ``crash_after`` set, the process sending is taken to die while
+    handing over the message after that many.
+    """
+
+    connections = 0
+    refused = set()
+    unreachable = False
+    crash_after = None
+
+    def open(self):
+        if self.unreachable:
+            raise ConnectionRefusedError(111, "Connection refused")
+        CountingEmailBackend.connections += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & self.refused:
+                raise smtplib.SMTPRecipientsRefused(message.to)
+            if self.crash_after is not None and len(mail.outbox) >= self.crash_after:
+                raise SenderCrashed
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND="appointments.tests.CountingEmailBackend")
+class AppointmentReminderTests(TestCase):
+    def setUp(self):
+        CountingEmailBackend.connections = 0
+        CountingEmailBackend.refused = set()
+        CountingEmailBackend.unreachable = False
+        CountingEmailBackend.crash_after = None
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.users = [
+            Profile.objects.create_user(
+                username=f"user{i}",
+                password="pass",
+                role="User",
+                email=f"user{i}@example.com",
+            )
+            for i in range(3)
+        ]
+        now = timezone.now()
+        self.appointments = []
+        # Two appointments tomorrow, one next week
+        for user, hours in zip(self.users, [2, 20, 24 * 7]):
+            slot = TimeSlot.objects.create(
+                provider=self.provider,
+                start_time=now + timedelta(hours=hours),
+                end_time=now + timedelta(hours=hours + 1),
+            )
+            self.appointments.append(
+                book_time_slot(
+                    Appointment(user=user, appointment_type="Checkup"), slot.id
+                )
+            )
+
+    def test_schedule_once_per_recipient(self):
+        self.assertEqual(schedule_reminders(), 4)
+        self.assertEqual(schedule_reminders(), 0)
+        self.assertEqual(
+            set(Reminder.objects.values_list("recipient", flat=True)),
+            {"provider@example.com", "user0@example.com", "user1@example.com"},
+        )
+
+    def test_send_in_batches_over_one_connection(self):
+        schedule_reminders()
+        self.assertEqual(send_due_reminders(batch_size=3), (4, 0))
+
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(CountingEmailBackend.connections, 1)
+        self.assertEqual(Reminder.objects.filter(status=Reminder.SENT).count(), 4)
+        # A restarted sender finds nothing left to send
+        self.assertEqual(send_due_reminders(), (0, 0))
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_stuck_reminders_are_failed_not_resent(self):
+        schedule_reminders()
+        now = timezone.now()
+        # A sender that died after claiming, possibly after sending
+        Reminder.objects.filter(recipient="user0@example.com").update(
+            status=Reminder.SENDING, attempts=1, claimed_at=now
+        )
+        self.assertEqual(send_due_reminders(now), (3, 0))
+
+        later = now + REMINDER_SENDING_TIMEOUT + timedelta(minutes=1)
+        self.assertEqual(send_due_reminders(later), (0, 0))
+        self.assertNotIn(["user0@example.com"], [message.to for message in mail.outbox])
+        self.assertEqual(
+            Reminder.objects.get(recipient="user0@example.com").status,
+            Reminder.FAILED,
+        )
+
+    def test_crash_mid_batch_never_sends_twice(self):
+        schedule_reminders()
+        CountingEmailBackend.crash_after = 2
+
+        now = timezone.now()
+        with self.assertRaises(SenderCrashed):
+            send_due_reminders(now)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            sorted(Reminder.objects.values_list("status", flat=True)),
+            sorted([Reminder.SENT] * 2 + [Reminder.SENDING, Reminder.PENDING]),
+        )
+
+        # The restarted sender sends the untried one, and only that
+        CountingEmailBackend.crash_after = None
+        self.assertEqual(send_due_reminders(now), (1, 0))
+        later = now + REMINDER_SENDING_TIMEOUT + timedelta(minutes=1)
+        self.assertEqual(send_due_reminders(later), (0, 0))
+        emails = [(message.to[0], message.subject) for message in mail.outbox]
+        self.assertEqual(len(emails), 3)
+        self.assertEqual(len(set(emails)), 3)
+        self.assertEqual(Reminder.objects.get(status=Reminder.FAILED).attempts, 1)
+        self.assertFalse(Reminder.objects.filter(status=Reminder.PENDING).exists())
+
+    def test_unreachable_mail_server_leaves_reminders_pending(self):
+        schedule_reminders()
+        CountingEmailBackend.unreachable = True
+
+        with self.assertRaises(ConnectionRefusedError):
+            send_due_reminders()
+        self.assertEqual(
+            set(Reminder.objects.values_list("status", "attempts")),
+            {(Reminder.PENDING, 0)},
+        )
+
+        CountingEmailBackend.unreachable = False
+        self.assertEqual(send_due_reminders(), (4, 0))
+
+    def test_nothing_due_opens_no_connection(self):
+        self.assertEqual(send_due_reminders(), (0, 0))
+        self.assertEqual(CountingEmailBackend.connections, 0)
+
+    def test_refused_recipient_is_retried_then_failed(self):
+        schedule_reminders()
+        CountingEmailBackend.refused = {"user1@example.com"}
+
+        now = timezone.now()
+        self.assertEqual(send_due_reminders(now), (3, 1))
+        reminder = Reminder.objects.get(recipient="user1@example.com")
+        self.assertEqual(reminder.status, Reminder.PENDING)
+        self.assertGreater(reminder.send_after, now)
+
+        for _ in range(MAX_REMINDER_ATTEMPTS - 1):
+            now += timedelta(hours=1)
+            self.assertEqual(send_due_reminders(now), (0, 1))
+        reminder.refresh_from_db()
+        self.assertEqual(reminder.status, Reminder.FAILED)
+        self.assertEqual(reminder.attempts, MAX_REMINDER_ATTEMPTS)
+
+    def test_rescheduled_appointment_gets_new_reminders(self):
+        schedule_reminders()
+        appointment = self.appointments[0]
+        start = timezone.now() + timedelta(hours=5)
+        slot = TimeSlot.objects.create(
+            provider=self.provider,
+            start_time=start,
+            end_time=start + timedelta(hours=1),
+        )
+        reschedule_appointment(appointment, slot.id)
+
+        self.assertEqual(schedule_reminders(), 2)
+        send_due_reminders()
+        self.assertEqual(
+            Reminder.objects.filter(
+                appointment=appointment, status=Reminder.SKIPPED
+            ).count(),
+            2,
+        )
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("send_appointment_reminders", stdout=out)
+        self.assertIn("Scheduled 4 reminders. Sent 4, failed 0.", out.getvalue())
+
+
+class SlotHoldTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.alice, self.bob = [
+            Profile.objects.create_user(
+                username=name, password="pass", role="User", email=f"{name}@x.com"
+            )
+            for name in ("alice", "bob")
+        ]
+        start = timezone.now() + timedelta(days=1)
+        self.slots = [
+            TimeSlot.objects.create(
+                provider=self.provider,
+                start_time=start + timedelta(hours=i),
+                end_time=start + timedelta(hours=i + 1),
+            )
+            for i in range(5)
+        ]
+        self.slot = self.slots[0]
+
+    def open_form(self, user, **data):
+        self.client.force_login(user)
+        return self.client.post(
+            reverse("appointments:book_appointment"),
+            {"time_slot": self.slot.id, **data},
+        )
+
+    def listed(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse("appointments:time_slots_api"))
+        return [slot["id"] for slot in response.json()["slots"]]
+
+    def test_hold_semantics(self):
+        self.assertTrue(hold_slot(self.slot, self.alice.id))
+        self.assertTrue(hold_slot(self.slot, self.alice.id))
+        self.assertFalse(hold_slot(self.slot, self.bob.id))
+        release_slot(self.slot, self.bob.id)
+        self.assertFalse(hold_slot(self.slot, self.bob.id))
+        release_slot(self.slot, self.alice.id)
+        self.assertTrue(hold_slot(self.slot, self.bob.id))
+
+    def test_group_slot_is_held_a_seat_at_a_time(self):
+        carol = Profile.objects.create_user(
+            username="carol", password="pass", role="User", email="carol@x.com"
+        )
+        self.slot.capacity = 2
+        self.slot.save()
+
+        self.assertFalse(self.open_form(self.alice).context["form"].non_field_errors())
+        self.assertIn(self.slot.id, self.listed(self.bob))
+        self.assertTrue(hold_slot(self.slot, self.bob.id))
+        # Both seats left are held
+        self.assertNotIn(self.slot.id, self.listed(carol))
+        self.assertFalse(hold_slot(self.slot, carol.id))
+
+        response = self.open_form(self.bob, appointment_type="Checkup")
+        self.assertRedirects(response, reverse("appointments:appointment_success"))
+        # Bob's seat is booked and his hold gone; Alice still holds the last
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.seats_left, 1)
+        self.assertNotIn(self.slot.id, self.listed(carol))
+        self.assertIn(self.slot.id, self.listed(self.alice))
+        release_slot(self.slot, self.alice.id)
+        self.assertIn(self.slot.id, self.listed(carol))
+
+    def test_open_form_hides_slot_from_others(self):
+        self.assertFalse(self.open_form(self.alice).context["form"].non_field_errors())
+
+        self.assertIn(self.slot.id, self.listed(self.alice))
+        self.assertNotIn(self.slot.id, self.listed(self.bob))
+        response = self.client.get(reverse("appointments:time_slots"))
+        self.assertNotIn(self.slot, response.context["time_slots"])
+
+        response = self.open_form(self.bob, appointment_type="Checkup")
+        self.assertTrue(response.context["form"].non_field_errors())
+        self.assertFalse(Appointment.objects.exists())
+
+        response = self.open_form(self.alice, appointment_type="Checkup")
+        self.assertRedirects(response, reverse("appointments:appointment_success"))
+        self.assertEqual(Appointment.objects.get().user, self.alice)
+        # The hold is released once the slot is booked
+        self.assertTrue(hold_slot(self.slot, self.bob.id))
+
+    def test_rescheduling_respects_holds(self):
+        appointment = book_time_slot(
+            Appointment(user=self.alice, appointment_type="Checkup"), self.slots[1].id
+        )
+        self.open_form(self.bob)
+
+        self.client.force_login(self.alice)
+        response = self.client.post(
+            reverse("appointments:reschedule_time_slots"),
+            {"appointment_id": appointment.id},
+        )
+        self.assertNotIn(self.slot, response.context["time_slots"])
+        update = {
+            "appointment_id": appointment.id,
+            "time_slot": self.slot.id,
+            "appointment_type": "Checkup",
+        }
+        response = self.client.post(reverse("appointments:update_appointment"), update)
+        self.assertTrue(response.context["form"].non_field_errors())
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.time_slot, self.slots[1])
+
+        release_slot(self.slot, self.bob.id)
+        response = self.client.post(reverse("appointments:update_appointment"), update)
+        self.assertRedirects(response, reverse("appointments:appointment_success"))
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.time_slot, self.slot)
+
+    def test_holds_cost_no_queries_per_slot(self):
+        self.client.force_login(self.bob)
+        url = reverse("appointments:time_slots_api")
+        with CaptureQueriesContext(connection) as unheld:
+            self.client.get(url)
+        for slot in self.slots[1:]:
+            hold_slot(slot, self.alice.id)
+        with self.assertNumQueries(len(unheld)):
+            self.client.get(url)
+        self.assertEqual(self.listed(self.bob), [self.slot.id])
+
+
+class ArchivePastAppointmentsTests(TestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.user = Profile.objects.create_user(
+            username="user",
+            password="pass",
+            role="User",
+            email="user@example.com",
+        )
+        now = timezone.now()
+        self.past_slots = [
+            TimeSlot.objects.create(
+                provider=self.provider,
+                start_time=now - timedelta(days=day, hours=1),
+                end_time=now - timedelta(days=day),
+                is_available=day % 2 == 0,
+            )
+            for day in range(1, 6)
+        ]
+        self.past_appointment = Appointment.objects.create(
+            user=self.user,
+            time_slot=self.past_slots[0],
+            appointment_type="Checkup",
+            comments="Old visit",
+        )
+        self.future_slot = TimeSlot.objects.create(
+            provider=self.provider,
+            start_time=now + timedelta(days=1),
+            end_time=now + timedelta(days=1, hours=1),
+            is_available=False,
+        )
+        self.future_appointment = Appointment.objects.create(
+            user=self.user, time_slot=self.future_slot, appointment_type="Therapy"
+        )
+
+    def test_command_moves_only_past_rows(self):
+        out = StringIO()
+        call_command("archive_past_appointments", "--batch-size=2", stdout=out)
+        self.assertIn("Archived 5 time slots and 1 appointments.", out.getvalue())
+
+        self.assertEqual(list(TimeSlot.objects.all()), [self.future_slot])
+        self.assertEqual(list(Appointment.objects.all()), [self.future_appointment])
+        self.assertEqual(ArchivedTimeSlot.objects.count(), 5)
+
+        archived = ArchivedAppointment.objects.get()
+        self.assertEqual(archived.id, self.past_appointment.id)
+        self.assertEqual(archived.time_slot_id, self.past_slots[0].id)
+        self.assertEqual(archived.comments, "Old visit")
+        self.assertEqual(archived.booked_on, self.past_appointment.booked_on)
+
+    def test_batches_are_bounded(self):
+        cutoff = timezone.now()
+        # Oldest first; the booked slot ended most recently
+        self.assertEqual(archive_batch(cutoff, 2), (2, 0))
+        self.assertEqual(archive_batch(cutoff, 2), (2, 0))
+        self.assertEqual(archive_batch(cutoff, 2), (1, 1))
+        self.assertEqual(archive_batch(cutoff, 2), (0, 0))
+
+    def test_batches_are_read_off_the_end_time_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            archive_batch(timezone.now(), 2)
+        select = next(q["sql"] for q in queries if q["sql"].startswith("SELECT"))
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {select}")
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("timeslot_end", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_days_keeps_recent_history(self):
+        call_command("archive_past_appointments", "--days=3", stdout=StringIO())
+        self.assertEqual(TimeSlot.objects.count(), 3)
+        self.assertEqual(ArchivedTimeSlot.objects.count(), 3)
+
+    def test_archived_appointments_for_client_and_provider(self):
+        archive_batch(timezone.now())
+        for user in (self.user, self.provider):
+            with self.assertNumQueries(1):
+                appointments = list(archived_appointments(user))
+                self.assertEqual(appointments[0].time_slot.provider, self.provider)
+            self.assertEqual([a.id for a in appointments], [self.past_appointment.id])
+
+    def test_my_appointments_lists_live_and_archived_past_appointments(self):
+        archive_batch(timezone.now())
+        recent_slot = TimeSlot.objects.create(
+            provider=self.provider,
+            start_time=timezone.now() - timedelta(days=3),
+            end_time=timezone.now() - timedelta(days=3) + timedelta(hours=1),
+            is_available=False,
+        )
+        recent = Appointment.objects.create(
+            user=self.user, time_slot=recent_slot, appointment_type="Therapy"
+        )
+        for user in (self.user, self.provider):
+            self.client.force_login(user)
+            response = self.client.get(reverse("appointments:my_appointments"))
+            self.assertEqual(
+                list(response.context["appointments"]), [self.future_appointment]
+            )
+            self.assertEqual(
+                [a.id for a in response.context["past_appointments"]],
+                [self.past_appointment.id, recent.id],
+            )
+            self.assertContains(response, "Past Appointments")
@@ -5,9 +5,21 @@ app_name = "appointments"
 
 urlpatterns = [
     path("time_slots/", views.time_slots, name="time_slots"),
+    path("api/time_slots/", views.time_slots_api, name="time_slots_api"),
+    path(
+        "api/time_slots/earliest/",
+        views.earliest_time_slots_api,
+        name="earliest_time_slots_api",
+    ),
+    path("emergency/", views.emergency_appointment, name="emergency_appointment"),
     path("book/", views.book_appointment, name="book_appointment"),
     path("success/", views.appointment_success, name="appointment_success"),
     path("my-appointments/", views.my_appointments, name="my_appointments"),
+    path(
+        "calendar/<str:token>/appointments.ics",
+        views.calendar_feed,
+        name="calendar_feed",
+    ),
     path(
         "cancel-appointment/<int:appointment_id>/",
         views.cancel_appointment,
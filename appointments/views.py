@@ -1,21 +1,53 @@
 from django.contrib.auth import get_user_model
-from django.http import HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
-from django.utils.dateparse import parse_date
-from datetime import date, datetime
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET, require_POST
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from .emergency import book_emergency_appointment
+from .archive import past_appointments
 from .forms import AppointmentForm
+from .holds import hold_slot, release_slot, without_held
+from .ical import (
+    calendar_stream,
+    feed_appointments,
+    feed_token,
+    feed_user_id,
+    feed_version,
+)
 from .models import Appointment, TimeSlot
-from accounts.models import Profile
+from .slots import (
+    MAX_SLOT_PAGE_SIZE,
+    SLOT_PAGE_SIZE,
+    WEEKDAYS,
+    SlotUnavailable,
+    available_time_slots,
+    book_time_slot,
+    cancel_booking,
+    day_bounds,
+    decode_cursor,
+    earliest_available_slots,
+    parse_time_of_day,
+    reschedule_appointment,
+    slot_page,
+)
+from accounts.models import Profile, Provider
+from calmseek.cursors import InvalidCursor
 
 
 # View to display available time slots by date and provider
 @login_required
 def time_slots(request):
-    today = timezone.now().date().isoformat()
+    today = timezone.localdate().isoformat()
     if request.method == "POST":
         selected_provider_id = request.POST.get("provider")
         selected_date = request.POST.get("date")
@@ -26,23 +58,16 @@ def time_slots(request):
     # Filter providers based on Profile role 'Provider'
     providers = Profile.objects.filter(role="Provider")
 
-    # Filter available time slots
-    time_slots = TimeSlot.objects.filter(is_available=True, start_time__gte=today)
-
-    # Filter by provider if selected
-    if selected_provider_id:
-        time_slots = time_slots.filter(provider__id=selected_provider_id)
-
-    # Filter by date if selected
-    if selected_date:
-        selected_date_obj = parse_date(selected_date)
-        if selected_date_obj:
-            start_of_day = datetime.combine(selected_date_obj, datetime.min.time())
-            end_of_day = datetime.combine(selected_date_obj, datetime.max.time())
-            time_slots = time_slots.filter(start_time__range=(start_of_day, end_of_day))
+    # Filter available time slots by provider and date if selected. Only the
+    # first page is rendered, the page fetches the rest from time_slots_api
+    time_slots, next_cursor = slot_page(
+        available_time_slots(selected_provider_id, selected_date)
+    )
+    time_slots = without_held(time_slots, request.user.id)
 
     context = {
         "time_slots": time_slots,
+        "next_cursor": next_cursor,
         "providers": providers,
         "selected_provider_id": (
             int(selected_provider_id) if selected_provider_id else None
@@ -53,6 +78,128 @@ def time_slots(request):
     return render(request, "appointments/time_slots.html", context)
 
 
+def page_limit(request):
+    try:
+        limit = min(int(request.GET.get("limit", SLOT_PAGE_SIZE)), MAX_SLOT_PAGE_SIZE)
+    except ValueError:
+        limit = SLOT_PAGE_SIZE
+    if limit < 1:
+        limit = SLOT_PAGE_SIZE
+    return limit
+
+
+def slot_json(slot):
+    return {
+        "id": slot.id,
+        "provider_id": slot.provider_id,
+        "provider_name": slot.provider.get_full_name(),
+        "start_time": timezone.localtime(slot.start_time).isoformat(),
+        "end_time": timezone.localtime(slot.end_time).isoformat(),
+        "capacity": slot.capacity,
+        "seats_left": slot.seats_left,
+    }
+
+
+# JSON list of available time slots, paginated by a (start_time, id) cursor
+@login_required
+def time_slots_api(request):
+    provider_id = request.GET.get("provider") or None
+    if provider_id and not provider_id.isdigit():
+        return JsonResponse(
+            {"status": "error", "message": "Invalid provider."}, status=400
+        )
+
+    limit = page_limit(request)
+    cursor = request.GET.get("cursor")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        return JsonResponse(
+            {"status": "error", "message": "Invalid cursor."}, status=400
+        )
+
+    slots = available_time_slots(
+        provider_id,
+        request.GET.get("date"),
+        specialization=request.GET.get("specialization"),
+        after=after,
+    )
+    page, next_cursor = slot_page(slots, limit)
+    page = without_held(page, request.user.id)
+
+    return JsonResponse(
+        {
+            "status": "success",
+            "slots": [slot_json(slot) for slot in page],
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+# JSON list of the earliest available slots across all providers
+@login_required
+def earliest_time_slots_api(request):
+    days = [day for day in request.GET.get("days", "").split(",") if day]
+    if any(day not in WEEKDAYS for day in days):
+        return JsonResponse(
+            {"status": "error", "message": "Invalid weekday."}, status=400
+        )
+
+    bounds = {}
+    for key in ("from", "to"):
+        value = request.GET.get(key)
+        bounds[key] = parse_time_of_day(value)
+        if value and bounds[key] is None:
+            return JsonResponse(
+                {"status": "error", "message": "Invalid time of day."}, status=400
+            )
+
+    slots = earliest_available_slots(
+        page_limit(request),
+        specialization=request.GET.get("specialization"),
+        weekdays=[WEEKDAYS[day] for day in days],
+        earliest=bounds["from"],
+        latest=bounds["to"],
+    )
+    slots = without_held(slots, request.user.id)
+    return JsonResponse(
+        {"status": "success", "slots": [slot_json(slot) for slot in slots]}
+    )
+
+
+# Book the soonest free slot with an activated provider, for emergencies
+@login_required
+@require_POST
+def emergency_appointment(request):
+    if request.user.role != "User":
+        return JsonResponse(
+            {"status": "error", "message": "Only clients can request appointments."},
+            status=403,
+        )
+
+    specializations = request.POST.getlist("specialization")
+    valid = {value for value, _ in Provider.MENTAL_HEALTH_SPECIALIZATIONS}
+    if any(value not in valid for value in specializations):
+        return JsonResponse(
+            {"status": "error", "message": "Invalid specialization."}, status=400
+        )
+
+    try:
+        appointment = book_emergency_appointment(
+            request.user, specializations, request.POST.get("comments", "")
+        )
+    except SlotUnavailable:
+        return JsonResponse(
+            {"status": "error", "message": "No emergency slot is available."},
+            status=409,
+        )
+
+    slot = TimeSlot.objects.select_related("provider").get(id=appointment.time_slot_id)
+    return JsonResponse(
+        {"status": "success", "appointment_id": appointment.id, "slot": slot_json(slot)}
+    )
+
+
 # View to handle appointment booking
 @login_required
 def book_appointment(request):
@@ -64,26 +211,41 @@ def book_appointment(request):
         )  # Redirect provider to their dashboard
 
     # Proceed with appointment booking if user is not a 'Provider'
-    slot_id = request.POST.get("time_slot")
-    time_slot = get_object_or_404(TimeSlot, id=slot_id, is_available=True)
+    time_slot = get_object_or_404(TimeSlot, id=request.POST.get("time_slot"))
+    slot_taken = False
 
     if request.method == "POST":
         form = AppointmentForm(request.POST)
-        if form.is_valid():
+        # Hold a seat, or renew the hold, while the client fills in the form
+        if time_slot.is_available and not hold_slot(time_slot, request.user.id):
+            form.add_error(
+                None,
+                "Someone else is booking this time slot. Please choose another "
+                "one or try again in a few minutes.",
+            )
+        elif form.is_valid():
             appointment = form.save(commit=False)
             appointment.user = request.user
-            appointment.time_slot = time_slot
-            appointment.save()
-
-            # Mark the time slot as no longer available
-            time_slot.is_available = False
-            time_slot.save()
-
-            return redirect("appointments:appointment_success")
+            try:
+                # Claim the slot and save the appointment in one transaction
+                book_time_slot(appointment, time_slot.id)
+            except SlotUnavailable:
+                slot_taken = True
+                form.add_error(
+                    None,
+                    "This time slot has just been booked. Please choose another one.",
+                )
+            else:
+                return redirect("appointments:appointment_success")
+            finally:
+                release_slot(time_slot, request.user.id)
 
     else:
         form = AppointmentForm()
 
+    if not (slot_taken or time_slot.is_available):
+        raise Http404
+
     return render(
         request,
         "appointments/book_appointment.html",
@@ -99,24 +261,53 @@ def appointment_success(request):
 @login_required
 def my_appointments(request):
     profile = request.user
-    today = timezone.now().date().isoformat()
+    today, _ = day_bounds(timezone.localdate())
 
     if profile.role == "Provider":
         # Provider sees all appointments related to their time slots
         provider_appointments = Appointment.objects.filter(
             time_slot__provider=request.user, time_slot__start_time__gte=today
-        ).select_related("time_slot")
+        ).select_related("time_slot__provider", "user")
         context = {"appointments": provider_appointments}
     else:
         # Normal users see only their own appointments
         user_appointments = Appointment.objects.filter(
             user=request.user, time_slot__start_time__gte=today
-        ).select_related("time_slot")
+        ).select_related("time_slot__provider", "user")
         context = {"appointments": user_appointments}
 
+    # Earlier ones, including those moved to the archive
+    context["past_appointments"] = past_appointments(request.user, today)
+    context["calendar_feed_url"] = request.build_absolute_uri(
+        reverse("appointments:calendar_feed", args=[feed_token(request.user)])
+    )
     return render(request, "appointments/my_appointments.html", context)
 
 
+# iCalendar feed of a user's appointments, authenticated by its secret token
+# since calendar clients cannot log in
+@require_GET
+def calendar_feed(request, token):
+    user_id = feed_user_id(token)
+    if user_id is None:
+        raise Http404
+
+    etag, last_modified = feed_version(feed_appointments(user_id))
+    etag = quote_etag(etag)
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    # Calendar clients poll often; answer unchanged feeds with 304 Not Modified
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = StreamingHttpResponse(
+            calendar_stream(user_id), content_type="text/calendar; charset=utf-8"
+        )
+        response["Content-Disposition"] = 'inline; filename="appointments.ics"'
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
 @login_required
 def cancel_appointment(request, appointment_id):
     appointment = get_object_or_404(Appointment, id=appointment_id)
@@ -127,14 +318,7 @@ def cancel_appointment(request, appointment_id):
         or appointment.time_slot.provider == request.user
     ):
         if request.method == "POST":
-            # Mark the related time slot as available again
-            time_slot = appointment.time_slot
-            time_slot.is_available = True
-            time_slot.save()
-
-            # Delete the appointment
-            appointment.delete()
-
+            cancel_booking(appointment)
             return HttpResponseRedirect(reverse("appointments:my_appointments"))
 
     return HttpResponseRedirect(reverse("appointments:my_appointments"))
@@ -144,7 +328,7 @@ def cancel_appointment(request, appointment_id):
 def reschedule_time_slots(request):
     appointment_id = request.POST.get("appointment_id")
     appointment = get_object_or_404(Appointment, id=appointment_id)
-    today = date.today().isoformat()
+    today = timezone.localdate().isoformat()
     profile = request.user
     selected_provider_id = 0
     providers = get_user_model()
@@ -157,20 +341,11 @@ def reschedule_time_slots(request):
 
     selected_date = request.POST.get("date")
 
-    # Filter available time slots
-    time_slots = TimeSlot.objects.filter(is_available=True, start_time__gte=today)
-
-    # Filter by provider if selected
-    if selected_provider_id:
-        time_slots = time_slots.filter(provider__id=selected_provider_id)
-
-    # Filter by date if selected
-    if selected_date:
-        selected_date_obj = parse_date(selected_date)
-        if selected_date_obj:
-            start_of_day = datetime.combine(selected_date_obj, datetime.min.time())
-            end_of_day = datetime.combine(selected_date_obj, datetime.max.time())
-            time_slots = time_slots.filter(start_time__range=(start_of_day, end_of_day))
+    # Filter available time slots by provider and date if selected, leaving
+    # out those held by clients in the middle of booking them
+    time_slots = without_held(
+        available_time_slots(selected_provider_id, selected_date), request.user.id
+    )
 
     context = {
         "time_slots": time_slots,
@@ -190,27 +365,33 @@ def reschedule_time_slots(request):
 def update_appointment(request):
     appointment_id = request.POST.get("appointment_id")
     appointment = get_object_or_404(Appointment, id=appointment_id)
-    original_user = appointment.user
     slot_id = request.POST.get("time_slot")
     new_time_slot = get_object_or_404(TimeSlot, id=slot_id, is_available=True)
-    form = AppointmentForm()
 
     if request.method == "POST":
         form = AppointmentForm(request.POST, instance=appointment)
-        old_time_slot = appointment.time_slot
-        old_time_slot.is_available = True
-        old_time_slot.save()
-        if form.is_valid():
+        moving = new_time_slot.id != appointment.time_slot_id
+        # Hold a seat of the new slot while the form is open, as for a booking
+        if moving and not hold_slot(new_time_slot, request.user.id):
+            form.add_error(
+                None,
+                "Someone else is booking this time slot. Please choose another "
+                "one or try again in a few minutes.",
+            )
+        elif form.is_valid():
             appointment = form.save(commit=False)
-            appointment.user = original_user
-            appointment.time_slot = new_time_slot
-            appointment.save()
-
-            # Mark the time slot as no longer available
-            new_time_slot.is_available = False
-            new_time_slot.save()
-
-            return redirect("appointments:appointment_success")
+            try:
+                # Claim the new slot and release the old one together
+                reschedule_appointment(appointment, new_time_slot.id)
+            except SlotUnavailable:
+                form.add_error(
+                    None,
+                    "This time slot has just been booked. Please choose another one.",
+                )
+            else:
+                return redirect("appointments:appointment_success")
+            finally:
+                release_slot(new_time_slot, request.user.id)
 
     else:
         form = AppointmentForm(instance=appointment)
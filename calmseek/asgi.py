@@ -9,15 +9,27 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from messaging.routing import websocket_urlpatterns
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "calmseek.settings")
 
+# Set up Django before importing the consumers, which use the models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from groups.routing import (  # noqa: E402
+    websocket_urlpatterns as group_websocket_urlpatterns,
+)
+from messaging.routing import websocket_urlpatterns  # noqa: E402
+from messaging.write_behind import lifespan  # noqa: E402
+
 application = ProtocolTypeRouter(
     {
-        "http": get_asgi_application(),
-        "websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
+        "http": django_asgi_app,
+        "websocket": AuthMiddlewareStack(
+            URLRouter(websocket_urlpatterns + group_websocket_urlpatterns)
+        ),
+        # Writes the chat messages still held in memory before shutting down
+        "lifespan": lifespan,
     }
 )
@@ -0,0 +1,417 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import string
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    process TEXT NOT NULL,
+    channels TEXT NOT NULL,
+    body TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_message_process
+    ON channel_message (process, id);
+CREATE INDEX IF NOT EXISTS channel_message_channels
+    ON channel_message (channels, id);
+CREATE TABLE IF NOT EXISTS channel_group (
+    name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (name, channel)
+) WITHOUT ROWID;
+"""
+
+INSERT_MESSAGE = (
+    "INSERT INTO channel_message (process, channels, body, expires) "
+    "VALUES (?, ?, ?, ?)"
+)
+
+
+def encode(message):
+    """Message body as stored, in JSON like channels_redis's msgpack.
+
+    Bodies are never unpickled: anyone able to write to the shared file
+    could otherwise run code in every worker.
+    """
+    return json.dumps(message, separators=(",", ":"))
+
+
+def decode(body):
+    """Message stored as ``body``, or None if it is not a JSON object."""
+    try:
+        message = json.loads(body)
+    except (TypeError, ValueError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def wakeup_dir(path):
+    """Directory holding the wakeup sockets of every process sharing ``path``.
+
+    It lives in the temp directory because socket paths are limited to about
+    100 characters.
+    """
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"calmseek-channels-{digest}")
+
+
+def channel_process(channel):
+    """Process token of a ``prefix.<process>!<client>`` channel, or ''."""
+    if "!" not in channel:
+        return ""
+    return channel[: channel.index("!")].rsplit(".", 1)[-1]
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """Channel layer shared by the worker processes on one host.
+
+    Messages and group memberships are rows in a SQLite database, so no
+    broker has to run next to the ASGI workers. Each process owns a token
+    that is part of the channel names it hands out. A message for another
+    process's channel is written to the database and the owner is woken
+    with a datagram on its Unix socket. The owner then fetches all of its
+    new rows in a single read and hands them to the waiting consumers. A
+    group message is written once per process, listing that process's
+    members, however many sockets it holds. Messages for this process's
+    own channels never touch the database.
+
+    A process that misses a wakeup still picks its messages up within
+    ``poll_interval`` seconds. Rows for processes that have gone away are
+    dropped once they expire. Messages cross processes as JSON, so they
+    may hold only what JSON can; rows that do not decode are skipped.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        path,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=1.0,
+    ):
+        super().__init__(
+            expiry=expiry, capacity=capacity, channel_capacity=channel_capacity
+        )
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.process = "".join(random.choices(string.ascii_letters, k=12))
+        self.socket_dir = wakeup_dir(self.path)
+        # All database work happens on one thread, which owns the connection
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="channel-layer")
+        self.connection = None
+        self.notifier = None
+        self.wakeup_socket = None
+        self.loop = None
+        self.reader = None
+        self.poller = None
+        self.wakeup = None
+        self.cleaned_at = 0.0
+        # Highest message id read, and the highest already deleted
+        self.read_id = self.deleted_id = 0
+        self.queues = {}
+
+    # Database side; these run on the executor thread
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def execute(self, sql, params=()):
+        with self.connect() as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def read_messages(self):
+        """Return the live messages for this process's channels not yet read.
+
+        This is a plain read, so processes fetching their messages at the
+        same moment do not queue for the write lock. Ids only grow as rows
+        are committed, so nothing is skipped. Read rows are deleted later
+        by ``forget_read``.
+        """
+        now = time.time()
+        rows = self.connect().execute(
+            "SELECT id, channels, body, expires FROM channel_message "
+            "WHERE process = ? AND id > ? ORDER BY id",
+            (self.process, self.read_id),
+        )
+        messages = []
+        for message_id, channels, body, expires in rows:
+            self.read_id = message_id
+            message = decode(body)
+            if expires > now and message is not None:
+                messages.append((channels, message))
+        return messages
+
+    def forget_read(self):
+        if self.read_id > self.deleted_id:
+            self.execute(
+                "DELETE FROM channel_message WHERE process = ? AND id <= ?",
+                (self.process, self.read_id),
+            )
+            self.deleted_id = self.read_id
+
+    def take_message(self, channel):
+        """Remove and return the oldest live message on a shared channel."""
+        now = time.time()
+        while True:
+            rows = self.execute(
+                "DELETE FROM channel_message WHERE id = ("
+                "SELECT id FROM channel_message WHERE channels = ? "
+                "ORDER BY id LIMIT 1"
+                ") RETURNING body, expires",
+                (channel,),
+            )
+            if not rows:
+                return None
+            body, expires = rows[0]
+            message = decode(body)
+            if expires > now and message is not None:
+                return message
+
+    def fan_out(self, group, body):
+        """Queue ``body`` for the group's remote members; return its members.
+
+        Remote members get one row per process, with their channel names
+        space-separated in ``channels``.
+        """
+        now = time.time()
+        with self.connect() as connection:
+            channels = [
+                channel
+                for (channel,) in connection.execute(
+                    "SELECT channel FROM channel_group WHERE name = ? AND expires > ?",
+                    (group, now),
+                )
+            ]
+            by_process = {}
+            for channel in channels:
+                by_process.setdefault(channel_process(channel), []).append(channel)
+            by_process.pop(self.process, None)
+            connection.executemany(
+                INSERT_MESSAGE,
+                [
+                    (process, " ".join(members), body, now + self.expiry)
+                    for process, members in by_process.items()
+                ],
+            )
+        return channels
+
+    def clean_up(self):
+        now = time.time()
+        self.execute("DELETE FROM channel_message WHERE expires < ?", (now,))
+        self.execute("DELETE FROM channel_group WHERE expires < ?", (now,))
+
+    def run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args
+        )
+
+    # Wakeups
+
+    def notify(self, processes):
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        if self.notifier is None:
+            self.notifier = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.notifier.setblocking(False)
+        for process in processes:
+            try:
+                self.notifier.sendto(b"1", os.path.join(self.socket_dir, process))
+            except OSError:
+                # Gone, or its socket buffer is full of wakeups already
+                pass
+
+    def drain_wakeups(self):
+        try:
+            while self.wakeup_socket.recv(16):
+                pass
+        except OSError:
+            pass
+        self.wakeup.set()
+
+    def start_reader(self):
+        """Listen for this process's messages on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(
+                self.stop_reader, self.loop, self.reader, self.poller
+            )
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        if hasattr(socket, "AF_UNIX"):
+            if self.wakeup_socket is None:
+                os.makedirs(self.socket_dir, exist_ok=True)
+                self.wakeup_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self.wakeup_socket.bind(os.path.join(self.socket_dir, self.process))
+                self.wakeup_socket.setblocking(False)
+            loop.add_reader(self.wakeup_socket.fileno(), self.drain_wakeups)
+        self.reader = loop.create_task(self.dispatch())
+        self.poll()
+
+    def poll(self):
+        self.wakeup.set()
+        self.poller = self.loop.call_later(self.poll_interval, self.poll)
+
+    def stop_reader(self, loop, reader, poller):
+        if self.wakeup_socket is not None:
+            loop.remove_reader(self.wakeup_socket.fileno())
+        reader.cancel()
+        poller.cancel()
+
+    async def dispatch(self):
+        while True:
+            await self.wakeup.wait()
+            # Cleared before reading, so a wakeup during the read is kept
+            self.wakeup.clear()
+            messages = await self.run(self.read_messages)
+            for channels, message in messages:
+                for channel in channels.split():
+                    self.deliver(channel, dict(message))
+            if not messages:
+                # Only idle rounds do deletes, off the delivery path
+                await self.run(self.forget_read)
+            if time.time() - self.cleaned_at > self.expiry:
+                self.cleaned_at = time.time()
+                await self.run(self.clean_up)
+
+    def deliver(self, channel, message):
+        """Queue a message for a local channel; dropped if gone or full."""
+        queue = self.queues.get(channel)
+        if queue is None or queue.qsize() >= self.get_capacity(channel):
+            return
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            queue.put_nowait(message)
+        else:
+            self.loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    # Channel layer API
+
+    async def new_channel(self, prefix="specific"):
+        self.start_reader()
+        client = "".join(random.choices(string.ascii_letters, k=12))
+        channel = f"{prefix}.{self.process}!{client}"
+        self.queues[channel] = asyncio.Queue()
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        process = channel_process(channel)
+        if process == self.process:
+            queue = self.queues.get(channel)
+            if queue is not None and queue.qsize() >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            self.deliver(channel, dict(message))
+            return
+        body = encode(message)
+        await self.run(
+            self.execute,
+            INSERT_MESSAGE,
+            (process, channel, body, time.time() + self.expiry),
+        )
+        if process:
+            self.notify([process])
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        if channel_process(channel) != self.process:
+            # A shared channel that any process may read; polled
+            delay = 0.01
+            while True:
+                message = await self.run(self.take_message, channel)
+                if message is not None:
+                    return message
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.poll_interval)
+        self.start_reader()
+        queue = self.queues.setdefault(channel, asyncio.Queue())
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            # The consumer is closing; stop accepting its messages
+            self.queues.pop(channel, None)
+            raise
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.run(
+            self.execute,
+            "INSERT OR REPLACE INTO channel_group (name, channel, expires) "
+            "VALUES (?, ?, ?)",
+            (group, channel, time.time() + self.group_expiry),
+        )
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.run(
+            self.execute,
+            "DELETE FROM channel_group WHERE name = ? AND channel = ?",
+            (group, channel),
+        )
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        channels = await self.run(self.fan_out, group, encode(message))
+        processes = set()
+        for channel in channels:
+            process = channel_process(channel)
+            if process == self.process:
+                self.deliver(channel, dict(message))
+            else:
+                processes.add(process)
+        processes.discard("")
+        self.notify(processes)
+
+    async def flush(self):
+        await self.run(self.execute, "DELETE FROM channel_message")
+        await self.run(self.execute, "DELETE FROM channel_group")
+        self.queues.clear()
+
+    async def close(self):
+        """Stop reading and release this process's socket."""
+        if self.loop is not None and not self.loop.is_closed():
+            self.stop_reader(self.loop, self.reader, self.poller)
+        self.loop = None
+        for sock in (self.wakeup_socket, self.notifier):
+            if sock is not None:
+                sock.close()
+        if self.wakeup_socket is not None:
+            try:
+                os.unlink(os.path.join(self.socket_dir, self.process))
+            except OSError:
+                pass
+        self.wakeup_socket = self.notifier = None
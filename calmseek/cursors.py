@@ -0,0 +1,42 @@
+import base64
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(*values):
+    """Opaque, URL-safe cursor holding the JSON ``values`` of a keyset position."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, *types):
+    """Return the values held by ``cursor``, each converted by its type.
+
+    ``types`` has one callable per value, such as ``int`` or
+    ``aware_datetime``; a callable raising ValueError or TypeError, like a
+    malformed or tampered cursor, raises InvalidCursor.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(values)
+        return tuple(convert(value) for convert, value in zip(types, values))
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def aware_datetime(value):
+    """Parse an ISO 8601 time that includes its offset.
+
+    A naive time would be read in the server's zone rather than the one it
+    was written in, and could skip or repeat rows.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None or timezone.is_naive(parsed):
+        raise ValueError(value)
+    return parsed
@@ -58,12 +58,31 @@ INSTALLED_APPS = [
 ASGI_APPLICATION = "calmseek.asgi.application"
 WSGI_APPLICATION = "calmseek.wsgi.application"
 
+# Shared by every ASGI worker on the host through a SQLite file, so chat
+# messages reach sockets held by other processes
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "BACKEND": "calmseek.channel_layers.SQLiteChannelLayer",
+        "CONFIG": {"path": BASE_DIR / "channels.sqlite3"},
     },
 }
 
+# Slot holds live in the cache and must be seen by every worker process, so
+# the cache is a database table rather than each process's memory. Create
+# it with ``python manage.py createcachetable``.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "calmseek_cache",
+    },
+}
+
+# Chat messages from sockets are broadcast at once and written to the
+# database in batches: within this many seconds of being sent, with at most
+# this many waiting in each process
+CHAT_WRITE_BEHIND_WINDOW = 0.5
+CHAT_WRITE_BEHIND_LIMIT = 500
+
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
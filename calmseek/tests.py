@@ -1,6 +1,20 @@
-from django.test import TestCase
+import asyncio
+import json
+import pickle
+import tempfile
+from pathlib import Path
+
+from channels.exceptions import ChannelFull
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
 from accounts.models import Client, Profile
+from calmseek.channel_layers import SQLiteChannelLayer
+from calmseek.cursors import (
+    InvalidCursor,
+    aware_datetime,
+    decode_cursor,
+    encode_cursor,
+)
 from django.contrib.auth.models import AnonymousUser
 
 
@@ -58,3 +72,138 @@ class LoginViewTest(TestCase):
         self.assertRedirects(response, self.login_url)
         user = response.wsgi_request.user
         self.assertTrue(isinstance(user, AnonymousUser))
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor("2030-01-01T09:00:00+00:00", 7)
+        timestamp, row_id = decode_cursor(cursor, aware_datetime, int)
+        self.assertEqual(
+            (timestamp.isoformat(), row_id), ("2030-01-01T09:00:00+00:00", 7)
+        )
+        self.assertEqual(decode_cursor(encode_cursor(-1.5, 3), float, int), (-1.5, 3))
+
+    def test_bad_cursors_are_invalid(self):
+        for cursor in [
+            "not-a-cursor",
+            encode_cursor("2030-01-01T09:00:00", 7),
+            encode_cursor("yesterday", 7),
+            encode_cursor("2030-01-01T09:00:00+00:00"),
+            encode_cursor("2030-01-01T09:00:00+00:00", "x"),
+            encode_cursor(None, 7),
+        ]:
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                decode_cursor(cursor, aware_datetime, int)
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """Two layer instances stand in for two worker processes."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "channels.sqlite3"
+
+    def layer(self, **config):
+        return SQLiteChannelLayer(self.path, **config)
+
+    async def test_group_send_reaches_other_processes(self):
+        sender, receiver = self.layer(), self.layer()
+        local = await sender.new_channel()
+        remote = await receiver.new_channel()
+        await sender.group_add("chat_1_2", local)
+        await receiver.group_add("chat_1_2", remote)
+
+        await sender.group_send("chat_1_2", {"type": "chat.message", "text": "hi"})
+
+        for layer, channel in ((sender, local), (receiver, remote)):
+            message = await asyncio.wait_for(layer.receive(channel), 1)
+            self.assertEqual(message, {"type": "chat.message", "text": "hi"})
+        await sender.close()
+        await receiver.close()
+
+    async def test_remote_delivery_does_not_wait_for_the_poll(self):
+        sender, receiver = self.layer(), self.layer(poll_interval=60)
+        channel = await receiver.new_channel()
+        await sender.send(channel, {"type": "ping"})
+
+        message = await asyncio.wait_for(receiver.receive(channel), 1)
+
+        self.assertEqual(message, {"type": "ping"})
+        await sender.close()
+        await receiver.close()
+
+    async def test_group_discard_stops_delivery(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+        await receiver.group_add("group_1", channel)
+        await receiver.group_discard("group_1", channel)
+
+        await sender.group_send("group_1", {"type": "group.message"})
+        await sender.send(channel, {"type": "direct"})
+
+        message = await asyncio.wait_for(receiver.receive(channel), 1)
+        self.assertEqual(message, {"type": "direct"})
+        await sender.close()
+        await receiver.close()
+
+    async def test_full_local_channel_rejects_messages(self):
+        layer = self.layer(capacity=2)
+        channel = await layer.new_channel()
+        await layer.send(channel, {"type": "one"})
+        await layer.send(channel, {"type": "two"})
+
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {"type": "three"})
+        await layer.close()
+
+    async def test_shared_channel_is_read_by_any_process(self):
+        sender, receiver = self.layer(), self.layer()
+        await sender.send("reminders", {"type": "reminder.due", "id": 7})
+
+        message = await asyncio.wait_for(receiver.receive("reminders"), 1)
+
+        self.assertEqual(message, {"type": "reminder.due", "id": 7})
+        await sender.close()
+        await receiver.close()
+
+    async def test_expired_messages_are_dropped(self):
+        sender, receiver = self.layer(expiry=-1), self.layer()
+        channel = await receiver.new_channel()
+        await sender.send(channel, {"type": "stale"})
+        await sender.send("reminders", {"type": "stale"})
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(receiver.receive(channel), 0.2)
+        self.assertIsNone(await receiver.run(receiver.take_message, "reminders"))
+        await sender.close()
+        await receiver.close()
+
+    async def test_messages_are_stored_as_json_not_pickled(self):
+        sender, receiver = self.layer(), self.layer(poll_interval=60)
+        channel = await receiver.new_channel()
+        # A pickle planted in the shared file is skipped, never loaded
+        await sender.run(
+            sender.execute,
+            "INSERT INTO channel_message (process, channels, body, expires) "
+            "VALUES (?, ?, ?, ?)",
+            (receiver.process, channel, pickle.dumps({"type": "evil"}), 2e9),
+        )
+        await sender.send(channel, {"type": "chat.message", "users": [[1, "online"]]})
+
+        message = await asyncio.wait_for(receiver.receive(channel), 1)
+
+        self.assertEqual(message, {"type": "chat.message", "users": [[1, "online"]]})
+        # Stored for a process that is not reading, so the row stays put
+        idle = f"specific.{self.layer().process}!client"
+        await sender.send(idle, {"type": "chat.message"})
+        (body,) = await sender.run(
+            sender.execute,
+            "SELECT body FROM channel_message WHERE channels = ?",
+            (idle,),
+        )
+        self.assertEqual(json.loads(body[0]), {"type": "chat.message"})
+        with self.assertRaises(TypeError):
+            await sender.send(channel, {"type": "chat.message", "at": object()})
+        await sender.close()
+        await receiver.close()
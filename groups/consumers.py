@@ -0,0 +1,26 @@
+from messaging.consumers import ChatConsumer
+from .models import Group, GroupMessage
+
+
+def group_room(group_id):
+    """Channel group of a group chat's open sockets."""
+    return f"group_{group_id}"
+
+
+class GroupChatConsumer(ChatConsumer):
+    """Chat room of a group, open to its members."""
+
+    def get_room(self, user):
+        self.group_id = self.scope["url_route"]["kwargs"]["group_id"]
+        if not Group.objects.filter(id=self.group_id, members=user).exists():
+            return None
+        return group_room(self.group_id)
+
+    def new_message(self, content):
+        return GroupMessage(
+            group_id=self.group_id, sender=self.scope["user"], content=content
+        )
+
+    @staticmethod
+    def save_messages(messages):
+        GroupMessage.objects.bulk_create(messages)
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import consumers
+
+websocket_urlpatterns = [
+    path("ws/groups/<int:group_id>/", consumers.GroupChatConsumer.as_asgi()),
+]
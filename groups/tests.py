@@ -1,7 +1,9 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.test import TestCase, TransactionTestCase
 from django.urls import reverse
 
 from accounts.models import Profile
+from messaging.tests import open_socket, receive_json, send_json
 from .models import Group, GroupMessage, Invitation
 
 
@@ -303,3 +305,43 @@ class GroupsTests(TestCase):
             data={"response": "accept"},
         )
         self.assertEqual(response.status_code, 404)
+
+
+class GroupChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.owner = Profile.objects.create(username="owner", role="Provider")
+        self.member = Profile.objects.create(username="member", role="User")
+        self.outsider = Profile.objects.create(username="outsider", role="User")
+        self.group = Group.objects.create(name="Support", created_by=self.owner)
+        self.group.members.add(self.owner, self.member)
+        self.path = f"/ws/groups/{self.group.id}/"
+
+    async def test_members_receive_saved_messages(self):
+        owner = await open_socket(self.path, self.owner)
+        member = await open_socket(self.path, self.member)
+
+        await send_json(member, {"message": "Hi all"})
+        for socket in (owner, member):
+            event = await receive_json(socket)
+            self.assertEqual(event["content"], "Hi all")
+            self.assertEqual(event["sender"], "member")
+            saved = await receive_json(socket)
+            self.assertEqual(saved["type"], "saved")
+
+        message = await GroupMessage.objects.aget(id=saved["ids"][event["key"]])
+        self.assertEqual(message.group_id, self.group.id)
+        for socket in (owner, member):
+            await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+
+    async def test_outsiders_are_refused(self):
+        self.assertIsNone(await open_socket(self.path, self.outsider))
+
+    async def test_posted_message_reaches_open_page(self):
+        owner = await open_socket(self.path, self.owner)
+        await sync_to_async(self.client.force_login)(self.member)
+        await sync_to_async(self.client.post)(
+            reverse("groups:send_message", args=[self.group.id]),
+            {"content": "Posted"},
+        )
+        self.assertEqual((await receive_json(owner))["content"], "Posted")
+        await owner.send_input({"type": "websocket.disconnect", "code": 1000})
@@ -5,6 +5,10 @@ from django.http import JsonResponse
 
 from accounts.models import Profile
 from calmseek import settings
+from messaging.consumers import broadcast
+from messaging.ephemeral import EPHEMERAL_INTERVAL
+from messaging.presence import HEARTBEAT_INTERVAL
+from .consumers import group_room
 from .models import Group, GroupMessage, Invitation
 
 
@@ -22,7 +26,7 @@ def group_list_view(request):
 @login_required
 def group_detail_view(request, group_id):
     group = get_object_or_404(Group, id=group_id, members=request.user)
-    messages = group.messages.all().order_by("timestamp")
+    messages = group.messages.select_related("sender").order_by("timestamp")
     return render(
         request,
         "groups/group_detail.html",
@@ -30,6 +34,8 @@ def group_detail_view(request, group_id):
             "group": group,
             "messages": messages,
             "MEDIA_URL": settings.MEDIA_URL,
+            "heartbeat_interval": HEARTBEAT_INTERVAL,
+            "typing_interval": EPHEMERAL_INTERVAL,
         },
     )
 
@@ -52,7 +58,11 @@ def send_group_message(request, group_id):
     if request.method == "POST":
         group = get_object_or_404(Group, id=group_id, members=request.user)
         content = request.POST.get("content")
-        GroupMessage.objects.create(group=group, sender=request.user, content=content)
+        message = GroupMessage.objects.create(
+            group=group, sender=request.user, content=content
+        )
+        # Show the message on the members' open group pages
+        broadcast(group_room(group.id), message)
         return redirect("groups:group_detail", group_id=group.id)
     return JsonResponse({"status": "error", "message": "Invalid request method."})
 
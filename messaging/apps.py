@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def restore_search_triggers(sender, using, **kwargs):
+    """Put back search index triggers dropped by a table rebuild."""
+    from .directory import PROFILE_SEARCH
+    from .search import MESSAGE_SEARCH
+
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        for index in (MESSAGE_SEARCH, PROFILE_SEARCH):
+            index.restore(connection)
 
 
 class MessagingConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "messaging"
+
+    def ready(self):
+        post_migrate.connect(restore_search_triggers, sender=self)
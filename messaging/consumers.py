@@ -1,41 +1,232 @@
+import abc
 import json
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
 
+from accounts.models import Profile
+from .conversations import post_messages
+from .history import message_json
+from .models import Message, conversation_key
+from . import ephemeral, presence, write_behind
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
-        self.room_group_name = f"chat_{self.room_name}"
 
+def direct_room(user_id, partner_id):
+    """Channel group shared by the two sides of a direct conversation."""
+    return f"chat_{conversation_key(user_id, partner_id)}"
+
+
+def message_event(message, key=None):
+    """Channel layer event announcing ``message`` to a chat room.
+
+    A message broadcast before it is written has no id yet; ``key`` then
+    identifies it until a ``chat.saved`` event gives the id.
+    """
+    event = {"type": "chat_message", **message_json(message)}
+    if key:
+        event["key"] = key
+    return event
+
+
+def broadcast(room, message):
+    """Push ``message`` to the sockets in ``room`` from synchronous code."""
+    async_to_sync(get_channel_layer().group_send)(room, message_event(message))
+
+
+class ChatConsumer(abc.ABC, AsyncWebsocketConsumer):
+    """A chat room for signed-in users; abstract.
+
+    Subclasses provide three hooks:
+
+    - ``get_room(user)`` returns the channel group the user may join, or
+      None to refuse the connection. It runs in a worker thread.
+    - ``new_message(content)`` builds the user's unsaved message in the
+      room, without any query.
+    - ``save_messages(messages)``, a static method, writes a batch of
+      ``new_message`` results in order, in the calling transaction.
+
+    Incoming messages are broadcast at once, then written in batches by
+    the process's write-behind buffer through ``save_messages``. The buffer
+    writes them within the ``CHAT_WRITE_BEHIND_WINDOW`` setting, in the
+    order they were broadcast, and the room then learns their ids, or which
+    could not be saved.
+
+    Besides chat messages, clients send ``{"type": "heartbeat", "state":
+    "online" | "away"}`` every ``presence.HEARTBEAT_INTERVAL`` seconds, and
+    ``{"type": "presence", "user_ids": [...]}`` to get the presence of those
+    users now and whenever it changes. ``{"type": "typing"}`` and the other
+    ``ephemeral.EPHEMERAL_EVENTS`` reach the rest of the room coalesced and
+    are never stored.
+    """
+
+    room_group_name = None
+
+    async def connect(self):
+        user = self.scope["user"]
+        if user.is_authenticated:
+            self.room_group_name = await database_sync_to_async(self.get_room)(user)
+        if self.room_group_name is None:
+            await self.close()
+            return
+        self.followed = set()
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
+        await presence.registry.heartbeat(
+            self.channel_layer, user.id, self.channel_name
+        )
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.room_group_name:
+            await self.channel_layer.group_discard(
+                self.room_group_name, self.channel_name
+            )
+            for user_id in self.followed:
+                await self.channel_layer.group_discard(
+                    presence.presence_group(user_id), self.channel_name
+                )
+            await presence.registry.disconnect(
+                self.channel_layer, self.scope["user"].id, self.channel_name
+            )
+            # What this socket sent is in the database once it has gone
+            await write_behind.buffer.flush()
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data["message"]
-        sender = data["sender"]
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+        kind = data.get("type", "message")
+        if kind == "message":
+            await self.receive_message(data)
+        elif kind == "heartbeat":
+            await self.receive_heartbeat(data)
+        elif kind == "presence":
+            await self.follow_presence(data)
+        elif kind in ephemeral.EPHEMERAL_EVENTS:
+            user = self.scope["user"]
+            await ephemeral.coalescer.send(
+                self.channel_layer,
+                self.room_group_name,
+                user.id,
+                {
+                    "type": "ephemeral.event",
+                    "event": kind,
+                    "user_id": user.id,
+                    "sender": user.username,
+                },
+            )
 
+    async def receive_message(self, data):
+        content = data.get("message")
+        if not isinstance(content, str) or not content.strip():
+            return
+        message = self.new_message(content.strip())
+        key = uuid.uuid4().hex
+        await write_behind.buffer.add(
+            self.save_messages, message, self.room_group_name, key
+        )
         await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                "type": "chat_message",
-                "message": message,
-                "sender": sender,
-            },
+            self.room_group_name, message_event(message, key)
+        )
+
+    async def receive_heartbeat(self, data):
+        state = data.get("state")
+        if state not in (presence.ONLINE, presence.AWAY):
+            state = presence.ONLINE
+        await presence.registry.heartbeat(
+            self.channel_layer, self.scope["user"].id, self.channel_name, state
+        )
+
+    async def follow_presence(self, data):
+        """Follow the presence of the users the client lists.
+
+        Replaces what was followed before, so a client sends the whole list
+        each time. The reply is one snapshot of all of them.
+        """
+        user_ids = data.get("user_ids")
+        if not isinstance(user_ids, list):
+            return
+        user_ids = {
+            user_id
+            for user_id in user_ids[: presence.MAX_FOLLOWED]
+            if isinstance(user_id, int)
+        }
+        visible = await database_sync_to_async(presence.visible_users)(
+            self.scope["user"], user_ids
+        )
+        for user_id in self.followed - visible:
+            await self.channel_layer.group_discard(
+                presence.presence_group(user_id), self.channel_name
+            )
+        for user_id in visible - self.followed:
+            await self.channel_layer.group_add(
+                presence.presence_group(user_id), self.channel_name
+            )
+        self.followed = visible
+        await self.presence_update(
+            {"users": list(presence.registry.snapshot(visible).items())}
         )
 
     async def chat_message(self, event):
-        message = event["message"]
-        sender = event["sender"]
+        payload = {key: value for key, value in event.items() if key != "type"}
+        await self.send(text_data=json.dumps(payload))
 
+    async def ephemeral_event(self, event):
+        # Others are told the user is typing; the user already knows
+        if event["user_id"] == self.scope["user"].id:
+            return
         await self.send(
             text_data=json.dumps(
                 {
-                    "message": message,
-                    "sender": sender,
+                    "type": event["event"],
+                    "user_id": event["user_id"],
+                    "sender": event["sender"],
                 }
             )
         )
+
+    async def chat_saved(self, event):
+        await self.send(
+            text_data=json.dumps(
+                {"type": "saved", "ids": event["ids"], "unsaved": event["unsaved"]}
+            )
+        )
+
+    async def presence_update(self, event):
+        users = {str(user_id): state for user_id, state in event["users"]}
+        await self.send(text_data=json.dumps({"type": "presence", "users": users}))
+
+    @abc.abstractmethod
+    def get_room(self, user):
+        """The channel group ``user`` may join, or None."""
+
+    @abc.abstractmethod
+    def new_message(self, content):
+        """An unsaved message of the user in this room; no queries."""
+
+    @staticmethod
+    @abc.abstractmethod
+    def save_messages(messages):
+        """Write a batch of ``new_message`` results, in order."""
+
+
+class DirectChatConsumer(ChatConsumer):
+    """One-to-one chat between the user and ``partner_id``."""
+
+    def get_room(self, user):
+        self.partner_id = self.scope["url_route"]["kwargs"]["partner_id"]
+        if not Profile.objects.filter(id=self.partner_id).exists():
+            return None
+        return direct_room(user.id, self.partner_id)
+
+    def new_message(self, content):
+        return Message(
+            sender=self.scope["user"], receiver_id=self.partner_id, content=content
+        )
+
+    save_messages = staticmethod(post_messages)
@@ -0,0 +1,82 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Greatest, Least
+
+from .models import Contact
+
+
+def pair_contacts(user_id, other_id):
+    """The contact between two users, in either direction, as a queryset.
+
+    Filters on the same expressions as the ``unique_contact_pair`` index,
+    so this is a single index lookup.
+    """
+    low, high = sorted((int(user_id), int(other_id)))
+    return Contact.objects.alias(
+        low=Least("user", "friend"), high=Greatest("user", "friend")
+    ).filter(low=low, high=high)
+
+
+def pair_contact(user_id, other_id):
+    return pair_contacts(user_id, other_id).first()
+
+
+def request_friend(user, friend):
+    """Send a friend request from ``user`` to ``friend``.
+
+    Returns ``(contact, changed)``. A request crossing a pending one from
+    ``friend`` accepts it. ``changed`` is False when the pair already had a
+    request from ``user`` or were friends.
+    """
+    contact = pair_contact(user.id, friend.id)
+    if contact is None:
+        try:
+            with transaction.atomic():
+                return Contact.objects.create(user=user, friend=friend), True
+        except IntegrityError:
+            # Created by a concurrent request between the pair
+            contact = pair_contact(user.id, friend.id)
+    if contact.status == Contact.PENDING and contact.user_id == friend.id:
+        contact.status = Contact.ACCEPTED
+        contact.save(update_fields=["status"])
+        return contact, True
+    return contact, False
+
+
+def accept_request(user, contact_id):
+    """Accept a pending request sent to ``user``; False if there is none."""
+    return bool(
+        Contact.objects.filter(
+            id=contact_id, friend=user, status=Contact.PENDING
+        ).update(status=Contact.ACCEPTED)
+    )
+
+
+def remove_friend(user, friend_id):
+    """End the friendship between two users; False if they were not friends."""
+    deleted, _ = (
+        pair_contacts(user.id, friend_id).filter(status=Contact.ACCEPTED).delete()
+    )
+    return bool(deleted)
+
+
+def friend_contacts(user):
+    """The user's accepted contacts, each with the other side as ``partner``.
+
+    The OR is served by the two ``(side, status)`` indexes.
+    """
+    contacts = list(
+        Contact.objects.filter(
+            Q(user=user) | Q(friend=user), status=Contact.ACCEPTED
+        ).select_related("user__provider", "friend__provider")
+    )
+    for contact in contacts:
+        contact.partner = contact.friend if contact.user_id == user.id else contact.user
+    return contacts
+
+
+def friend_requests(user):
+    """Pending requests sent to ``user``, with their senders."""
+    return Contact.objects.filter(friend=user, status=Contact.PENDING).select_related(
+        "user"
+    )
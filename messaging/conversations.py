@@ -0,0 +1,159 @@
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Conversation, Message, conversation_key
+
+# Characters of the latest message kept on the conversation for the chat list
+PREVIEW_LENGTH = 100
+
+
+def read_field(user_id, partner_id):
+    """Name of the Conversation field holding ``user_id``'s read cursor."""
+    return "low_read_id" if int(user_id) < int(partner_id) else "high_read_id"
+
+
+def post_message(sender, receiver_id, content):
+    """Save a direct message and update its conversation in one transaction.
+
+    The conversation row is created by the first message between the pair.
+    Sending a message also marks everything before it as read by the sender.
+    """
+    message = Message(sender=sender, receiver_id=receiver_id, content=content)
+    post_messages([message])
+    return message
+
+
+def post_messages(messages):
+    """Save unsaved direct messages with one INSERT and update their conversations.
+
+    ``messages`` come in the order they were sent, and their ids follow it.
+    Each conversation's summary moves to its newest message in the batch
+    unless the conversation already has a later one, its highest message id
+    moves up to the batch's, and each sender's read cursor moves up to their
+    last message. A conversation costs one UPDATE in the usual case.
+    """
+    latest = {}
+    reads = {}
+    for message in messages:
+        message.conversation = conversation_key(message.sender_id, message.receiver_id)
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        for message in messages:
+            latest[message.conversation] = message
+            read = read_field(message.sender_id, message.receiver_id)
+            reads.setdefault(message.conversation, {})[read] = message.id
+        for key, message in latest.items():
+            summary = {
+                "last_message": message,
+                "last_message_preview": message.content[:PREVIEW_LENGTH],
+                "last_message_at": message.timestamp,
+            }
+            cursors = {
+                read: Greatest(F(read), Value(message_id))
+                for read, message_id in reads[key].items()
+            }
+            # Ids follow the batch, so its last message has the highest
+            cursors["max_message_id"] = Greatest(F("max_message_id"), Value(message.id))
+            conversations = Conversation.objects.filter(key=key)
+            # Messages written behind may land after a later one from
+            # another process; the summary keeps the later one
+            is_older = Q(last_message_at__lte=message.timestamp) | Q(
+                last_message_at__isnull=True
+            )
+            if conversations.filter(is_older).update(**summary, **cursors):
+                continue
+            if conversations.update(**cursors):
+                continue
+            low, high = sorted((message.sender_id, message.receiver_id))
+            try:
+                with transaction.atomic():
+                    Conversation.objects.create(
+                        key=key,
+                        user_low_id=low,
+                        user_high_id=high,
+                        **summary,
+                        **reads[key],
+                        max_message_id=message.id,
+                    )
+            except IntegrityError:
+                # Created by a concurrent first message
+                conversations.filter(is_older).update(**summary)
+                conversations.update(**cursors)
+
+
+def mark_conversation_read(user_id, partner_id, message_id):
+    """Move ``user_id``'s read cursor up to ``message_id`` in one UPDATE.
+
+    The cursor never moves back, so a late request cannot unread messages.
+    """
+    read = read_field(user_id, partner_id)
+    # Capped at the highest message id, so no future message is marked read
+    Conversation.objects.filter(key=conversation_key(user_id, partner_id)).update(
+        **{read: Greatest(F(read), Least(Value(int(message_id)), F("max_message_id")))}
+    )
+
+
+def read_cursor(user_id, partner_id):
+    """``user_id``'s read cursor with ``partner_id``, 0 if they never talked."""
+    read = read_field(user_id, partner_id)
+    cursor = Conversation.objects.filter(
+        key=conversation_key(user_id, partner_id)
+    ).values_list(read, flat=True)
+    return next(iter(cursor), 0)
+
+
+def unread_count(user_id, partner_id, read_id):
+    """Messages from ``partner_id`` after ``read_id``, as an index range count."""
+    return Message.objects.filter(
+        conversation=conversation_key(user_id, partner_id),
+        sender_id=partner_id,
+        id__gt=read_id,
+    ).count()
+
+
+def recent_conversations(user):
+    """The user's conversations, most recently active first.
+
+    Each one gets ``partner`` and ``unread`` attributes for the viewer. The
+    two ``(user, last_message_at)`` indexes serve the OR, and each unread
+    count is a correlated range count on ``message_unread_range``, so this
+    is one query however many messages the user has.
+    """
+    is_low = Q(user_low=user)
+    unread = (
+        Message.objects.filter(
+            conversation=OuterRef("key"),
+            sender_id=OuterRef("partner_id"),
+            id__gt=OuterRef("read_id"),
+        )
+        .order_by()
+        .values("conversation")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    conversations = list(
+        Conversation.objects.filter(is_low | Q(user_high=user))
+        .annotate(
+            partner_id=Case(When(is_low, then="user_high"), default="user_low"),
+            read_id=Case(When(is_low, then="low_read_id"), default="high_read_id"),
+        )
+        .annotate(unread=Coalesce(Subquery(unread), 0))
+        .select_related("user_low__provider", "user_high__provider")
+        .order_by("-last_message_at")
+    )
+    for conversation in conversations:
+        if conversation.user_low_id == user.id:
+            conversation.partner = conversation.user_high
+        else:
+            conversation.partner = conversation.user_low
+    return conversations
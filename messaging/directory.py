@@ -0,0 +1,236 @@
+import difflib
+
+from django.db import connection
+
+from .triggers import TriggerIndex
+
+# Suggestions per typeahead request
+SUGGESTION_LIMIT = 10
+MAX_SUGGESTION_LIMIT = 25
+
+# Profiles per page of the friend directory
+DIRECTORY_PAGE_SIZE = 12
+
+# Trigram candidates scored for substring and misspelt matches
+TRIGRAM_CANDIDATES = 50
+
+# Characters that sort after any other, closing a prefix range
+PREFIX_END = "\U0010ffff"
+
+PREFIX_SQL = """
+    SELECT profile_id FROM profile_prefix
+    WHERE term >= %s AND term < %s
+    ORDER BY term
+    LIMIT %s
+"""
+
+ROLE_PREFIX_SQL = """
+    SELECT profile_id FROM profile_prefix
+    WHERE role = %s AND term >= %s AND term < %s
+    ORDER BY term
+    LIMIT %s
+"""
+
+# The triggers keeping profile_prefix and profile_trigram in step with
+# accounts_profile, as created by migration 0008_profile_search
+PROFILE_TERMS = """
+    INSERT OR IGNORE INTO profile_prefix (term, profile_id, role)
+    SELECT term, {row}.id, {row}.role FROM (
+        SELECT lower({row}.username) AS term
+        UNION SELECT lower({row}.first_name)
+        UNION SELECT lower({row}.last_name)
+        UNION SELECT lower(trim({row}.first_name || ' ' || {row}.last_name))
+    ) WHERE term != '';
+    INSERT INTO profile_trigram (rowid, username, full_name, role)
+    VALUES (
+        {row}.id, {row}.username,
+        trim({row}.first_name || ' ' || {row}.last_name), {row}.role
+    );
+"""
+
+DROP_TERMS = """
+    DELETE FROM profile_prefix WHERE profile_id = old.id;
+    DELETE FROM profile_trigram WHERE rowid = old.id;
+"""
+
+PROFILE_SEARCH = TriggerIndex(
+    tables=["accounts_profile", "profile_prefix", "profile_trigram"],
+    triggers={
+        "profile_search_insert": f"""
+            CREATE TRIGGER profile_search_insert AFTER INSERT ON accounts_profile
+            BEGIN
+                {PROFILE_TERMS.format(row="new")}
+            END
+        """,
+        "profile_search_update": f"""
+            CREATE TRIGGER profile_search_update
+            AFTER UPDATE OF username, first_name, last_name, role
+            ON accounts_profile
+            WHEN old.username IS NOT new.username
+                OR old.first_name IS NOT new.first_name
+                OR old.last_name IS NOT new.last_name
+                OR old.role IS NOT new.role
+            BEGIN
+                {DROP_TERMS}
+                {PROFILE_TERMS.format(row="new")}
+            END
+        """,
+        "profile_search_delete": f"""
+            CREATE TRIGGER profile_search_delete AFTER DELETE ON accounts_profile
+            BEGIN
+                {DROP_TERMS}
+            END
+        """,
+    },
+    refill=[
+        "DELETE FROM profile_prefix",
+        "DELETE FROM profile_trigram",
+        """
+        INSERT OR IGNORE INTO profile_prefix (term, profile_id, role)
+        SELECT term, id, role FROM (
+            SELECT lower(username) AS term, id, role FROM accounts_profile
+            UNION ALL SELECT lower(first_name), id, role FROM accounts_profile
+            UNION ALL SELECT lower(last_name), id, role FROM accounts_profile
+            UNION ALL SELECT lower(trim(first_name || ' ' || last_name)), id, role
+            FROM accounts_profile
+        ) WHERE term != ''
+        """,
+        """
+        INSERT INTO profile_trigram (rowid, username, full_name, role)
+        SELECT id, username, trim(first_name || ' ' || last_name), role
+        FROM accounts_profile
+        """,
+    ],
+)
+
+# No ORDER BY rank: ranking every match of a common trigram costs far more
+# than scoring the few candidates in Python
+TRIGRAM_SQL = """
+    SELECT rowid, username, full_name FROM profile_trigram
+    WHERE profile_trigram MATCH %s AND (%s IS NULL OR role = %s)
+    LIMIT %s
+"""
+
+
+def fold(query):
+    """Lowercase ``query`` the way SQLite's lower() does, ASCII only."""
+    return "".join(char.lower() if char.isascii() else char for char in query)
+
+
+def phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def fuzzy_expression(query):
+    """FTS5 trigram query matching ``query`` with one character wrong.
+
+    A typo at one position spoils the (up to three) trigrams covering it,
+    so for each position the trigrams clear of it must all match. Returns
+    None for queries too short to leave two trigrams standing.
+    """
+    trigrams = ["".join(chars) for chars in zip(query, query[1:], query[2:])]
+    groups = []
+    for position in range(len(query)):
+        kept = [
+            trigram
+            for start, trigram in enumerate(trigrams)
+            if not position - 2 <= start <= position
+        ]
+        if len(kept) >= 2 and kept not in groups:
+            groups.append(kept)
+    if not groups:
+        return None
+    return " OR ".join(
+        "(" + " AND ".join(phrase(trigram) for trigram in group) + ")"
+        for group in groups
+    )
+
+
+def prefix_matches(query, role, limit):
+    """Profile ids with a name term starting with ``query``, in term order."""
+    end = query + PREFIX_END
+    with connection.cursor() as cursor:
+        if role:
+            cursor.execute(ROLE_PREFIX_SQL, [role, query, end, limit])
+        else:
+            cursor.execute(PREFIX_SQL, [query, end, limit])
+        return [profile_id for (profile_id,) in cursor.fetchall()]
+
+
+def trigram_matches(expression, query, role):
+    """Profile ids matching a trigram ``expression``, closest to ``query`` first."""
+    with connection.cursor() as cursor:
+        cursor.execute(TRIGRAM_SQL, [expression, role, role, TRIGRAM_CANDIDATES])
+        rows = cursor.fetchall()
+
+    def closeness(row):
+        _, username, full_name = row
+        return max(
+            difflib.SequenceMatcher(None, query, fold(name)).ratio()
+            for name in (username, full_name)
+        )
+
+    return [
+        profile_id for profile_id, _, _ in sorted(rows, key=closeness, reverse=True)
+    ]
+
+
+def suggest_profiles(query, role=None, exclude=None, limit=SUGGESTION_LIMIT):
+    """Return up to ``limit`` profile ids whose names match ``query``.
+
+    Prefixes of the username, first, last or full name come first, read in
+    order off the ``profile_prefix`` B-tree. Only when they run out are
+    substrings looked up in ``profile_trigram``, and one-typo matches only
+    when nothing else matched.
+    ``role`` limits the matches to one role and ``exclude`` drops a
+    profile, usually the one searching.
+    """
+    query = fold(" ".join(query.split()))
+    if not query:
+        return []
+    found = []
+
+    def add(profile_ids):
+        for profile_id in profile_ids:
+            if profile_id != exclude and profile_id not in found:
+                found.append(profile_id)
+        return len(found) >= limit
+
+    # A profile has at most four terms, so this many rows hold enough profiles
+    if add(prefix_matches(query, role, (limit + 1) * 4)):
+        return found[:limit]
+    if len(query) >= 3 and add(trigram_matches(phrase(query), query, role)):
+        return found[:limit]
+    # Near misses only stand in for a query that matched nothing
+    expression = None if found else fuzzy_expression(query)
+    if expression:
+        add(trigram_matches(expression, query, role))
+    return found[:limit]
+
+
+def directory_page(profiles, after=None, before=None, size=DIRECTORY_PAGE_SIZE):
+    """Return ``(page, next_after, previous_before)`` for ``profiles``.
+
+    Pages are keyed on username and read off the ``(role, username)`` index,
+    so a page costs the same wherever it is and no COUNT(*) is needed.
+    ``after`` and ``before`` are the usernames bounding the page; the
+    returned ones are None when there is no page in that direction.
+    """
+    if before is not None:
+        page = list(
+            profiles.filter(username__lt=before).order_by("-username")[: size + 1]
+        )
+        has_previous = len(page) > size
+        page = page[:size]
+        page.reverse()
+        has_next = True
+    else:
+        if after is not None:
+            profiles = profiles.filter(username__gt=after)
+        page = list(profiles.order_by("username")[: size + 1])
+        has_next = len(page) > size
+        page = page[:size]
+        has_previous = after is not None
+    next_after = page[-1].username if has_next and page else None
+    previous_before = page[0].username if has_previous and page else None
+    return page, next_after, previous_before
@@ -0,0 +1,63 @@
+import asyncio
+from collections import Counter
+
+# Events clients may send to a room that are passed on but never stored
+EPHEMERAL_EVENTS = ("typing", "stopped_typing")
+
+# Seconds between the events of one user passed on to a room
+EPHEMERAL_INTERVAL = 2.0
+
+
+class Coalescer:
+    """Passes on at most one ephemeral event per user and room per interval.
+
+    The first event goes out at once and opens an interval. Events during
+    it replace one another, and the last of them goes out when it ends,
+    opening the next. A user typing steadily so sends one event per
+    interval however fast they type, and the one saying they stopped is
+    never dropped.
+
+    Events received and sent are counted per room, for the rate actually
+    put on the channel layer; ``stats`` hands the counts over and starts
+    them again, so they only ever cover the rooms active since.
+    """
+
+    def __init__(self, interval=EPHEMERAL_INTERVAL):
+        self.interval = interval
+        # (room, user id) -> event held for the end of its interval, or
+        # None while an interval is open with nothing held
+        self.held = {}
+        self.received = Counter()
+        self.sent = Counter()
+
+    async def send(self, layer, room, user_id, event):
+        self.received[room] += 1
+        key = (room, user_id)
+        if key in self.held:
+            self.held[key] = event
+            return
+        self.held[key] = None
+        await self.emit(layer, room, event)
+        asyncio.get_running_loop().call_later(self.interval, self.close, layer, key)
+
+    def close(self, layer, key):
+        event = self.held.pop(key)
+        if event is None:
+            return
+        self.held[key] = None
+        asyncio.ensure_future(self.emit(layer, key[0], event))
+        asyncio.get_running_loop().call_later(self.interval, self.close, layer, key)
+
+    async def emit(self, layer, room, event):
+        self.sent[room] += 1
+        await layer.group_send(room, event)
+
+    def stats(self):
+        """Return ``{room: (received, sent)}`` since the last call and reset."""
+        received, self.received = self.received, Counter()
+        sent, self.sent = self.sent, Counter()
+        # A held event may go out after the call that received it
+        return {room: (received[room], sent[room]) for room in received | sent}
+
+
+coalescer = Coalescer()
@@ -0,0 +1,64 @@
+from django.db.models import Q
+from django.utils import timezone
+
+from calmseek import cursors
+
+from .models import Message, conversation_key
+
+# Messages shown when a chat opens, and per "load older" request
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+
+def message_json(message):
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "sender": message.sender.username,
+        "content": message.content,
+        "timestamp": timezone.localtime(message.timestamp).isoformat(),
+    }
+
+
+def conversation_messages(user_id, partner_id, before=None):
+    """Messages between two users, newest first.
+
+    Both directions share a conversation key, so this reads one range of
+    the ``(conversation, timestamp, id)`` index instead of OR-ing the two
+    sender/receiver pairs. ``before`` is a decoded ``(timestamp, id)``
+    cursor; only messages older than it are returned.
+    """
+    messages = Message.objects.filter(
+        conversation=conversation_key(user_id, partner_id)
+    )
+    if before:
+        timestamp, message_id = before
+        messages = messages.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+        )
+    return messages.select_related("sender").order_by("-timestamp", "-id")
+
+
+def encode_cursor(message):
+    """Encode the ``(timestamp, id)`` position just before ``message``."""
+    return cursors.encode_cursor(message.timestamp.isoformat(), message.id)
+
+
+def decode_cursor(cursor):
+    return cursors.decode_cursor(cursor, cursors.aware_datetime, int)
+
+
+def history_page(messages, limit=HISTORY_PAGE_SIZE):
+    """Return ``(page, older_cursor)`` for newest-first ``messages``.
+
+    The page is the ``limit`` most recent messages in reading order, oldest
+    first. ``older_cursor`` is None once the start of the conversation is
+    reached. Opening a long conversation costs the same as a new one.
+    """
+    page = list(messages[: limit + 1])
+    older_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        older_cursor = encode_cursor(page[-1])
+    page.reverse()
+    return page, older_cursor
@@ -0,0 +1,120 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from calmseek.channel_layers import SQLiteChannelLayer
+
+GROUP = "benchmark"
+
+
+def run_worker(path, connections, messages, ready, results):
+    asyncio.run(listen(path, connections, messages, ready, results))
+
+
+async def listen(path, connections, messages, ready, results):
+    """Hold ``connections`` group members and time every message they get."""
+    layer = SQLiteChannelLayer(path)
+    channels = [await layer.new_channel() for _ in range(connections)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    ready.put(os.getpid())
+
+    async def collect(channel):
+        latencies = []
+        for _ in range(messages):
+            message = await layer.receive(channel)
+            latencies.append((message["seq"], time.time() - message["sent_at"]))
+        return latencies
+
+    gathered = await asyncio.gather(*(collect(channel) for channel in channels))
+    results.put([latency for latencies in gathered for latency in latencies])
+    await layer.close()
+
+
+async def broadcast(path, messages, interval):
+    layer = SQLiteChannelLayer(path)
+    for seq in range(messages):
+        await layer.group_send(
+            GROUP, {"type": "chat.message", "seq": seq, "sent_at": time.time()}
+        )
+        await asyncio.sleep(interval)
+    await layer.close()
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Time group_send fan-out through the SQLite channel layer. Worker "
+        "processes each hold a share of the connections in one group, and a "
+        "separate process sends to the group and records how long each "
+        "message takes to reach every connection."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--connections", type=int, default=1000)
+        parser.add_argument("--messages", type=int, default=50)
+        parser.add_argument("--interval", type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        context = multiprocessing.get_context("spawn")
+        ready, results = context.Queue(), context.Queue()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "channels.sqlite3")
+            processes = [
+                context.Process(
+                    target=run_worker,
+                    args=(
+                        path,
+                        options["connections"] // workers
+                        + (i < options["connections"] % workers),
+                        options["messages"],
+                        ready,
+                        results,
+                    ),
+                )
+                for i in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            for _ in processes:
+                ready.get()
+
+            asyncio.run(broadcast(path, options["messages"], options["interval"]))
+
+            deliveries = []
+            for _ in processes:
+                deliveries.extend(results.get(timeout=60))
+            for process in processes:
+                process.join()
+
+        latencies = sorted(latency for _, latency in deliveries)
+        slowest = {}
+        for seq, latency in deliveries:
+            slowest[seq] = max(slowest.get(seq, 0), latency)
+        fan_out = sorted(slowest.values())
+
+        self.stdout.write(
+            f"{workers} workers, {options['connections']} connections, "
+            f"{options['messages']} messages, {len(deliveries)} deliveries"
+        )
+        self.stdout.write(
+            f"{'':>22} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}"
+        )
+        for label, samples in (
+            ("per connection", latencies),
+            ("whole group", fan_out),
+        ):
+            self.stdout.write(
+                f"{label:>22} {percentile(samples, 0.5):>9.2f} "
+                f"{percentile(samples, 0.95):>9.2f} "
+                f"{percentile(samples, 0.99):>9.2f} {samples[-1] * 1000:>9.2f}"
+            )
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, Concat, Greatest, Least
+
+
+def fill_conversations(apps, schema_editor):
+    # Same "low_high" key that Message.save writes, in one UPDATE
+    apps.get_model("messaging", "Message").objects.update(
+        conversation=Concat(
+            Cast(Least("sender_id", "receiver_id"), models.CharField()),
+            models.Value("_"),
+            Cast(Greatest("sender_id", "receiver_id"), models.CharField()),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0003_remove_contact_added_on_alter_message_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="conversation",
+            field=models.CharField(default="", editable=False, max_length=41),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_conversations, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "timestamp", "id"],
+                name="message_conversation_time",
+            ),
+        ),
+    ]
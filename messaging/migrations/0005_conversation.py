@@ -0,0 +1,98 @@
+# Generated by Django 5.1.15 on 2026-10-18 15:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def create_conversations(apps, schema_editor):
+    # One row per existing conversation, from its latest message. Nothing
+    # was tracked as read before, so unread counts start at zero.
+    Message = apps.get_model("messaging", "Message")
+    Conversation = apps.get_model("messaging", "Conversation")
+    latest = Message.objects.filter(conversation=OuterRef("conversation")).order_by(
+        "-timestamp", "-id"
+    )
+    last_messages = Message.objects.filter(id=Subquery(latest.values("id")[:1]))
+    Conversation.objects.bulk_create(
+        (
+            Conversation(
+                key=message.conversation,
+                user_low_id=min(message.sender_id, message.receiver_id),
+                user_high_id=max(message.sender_id, message.receiver_id),
+                last_message_id=message.id,
+                last_message_preview=message.content[:100],
+                last_message_at=message.timestamp,
+            )
+            for message in last_messages.iterator()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0004_message_conversation"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Conversation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=41, unique=True)),
+                ("last_message_preview", models.CharField(blank=True, max_length=100)),
+                ("last_message_at", models.DateTimeField(null=True)),
+                ("low_unread", models.PositiveIntegerField(default=0)),
+                ("high_unread", models.PositiveIntegerField(default=0)),
+                (
+                    "last_message",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="messaging.message",
+                    ),
+                ),
+                (
+                    "user_high",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "user_low",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user_low", "-last_message_at"],
+                        name="conversation_low_recent",
+                    ),
+                    models.Index(
+                        fields=["user_high", "-last_message_at"],
+                        name="conversation_high_recent",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(create_conversations, migrations.RunPython.noop),
+    ]
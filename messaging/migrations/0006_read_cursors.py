@@ -0,0 +1,64 @@
+# Generated by Django 5.1.15 on 2026-10-18 15:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def counters_to_cursors(apps, schema_editor):
+    # Place each cursor just before that side's unread messages
+    Message = apps.get_model("messaging", "Message")
+    Conversation = apps.get_model("messaging", "Conversation")
+    for conversation in Conversation.objects.iterator():
+        for side, partner_id in [
+            ("low", conversation.user_high_id),
+            ("high", conversation.user_low_id),
+        ]:
+            unread = getattr(conversation, f"{side}_unread")
+            if not unread:
+                read_id = conversation.last_message_id or 0
+            else:
+                read = (
+                    Message.objects.filter(
+                        conversation=conversation.key, sender_id=partner_id
+                    )
+                    .order_by("-id")
+                    .values_list("id", flat=True)
+                )
+                read_id = next(iter(read[unread:][:1]), 0)
+            setattr(conversation, f"{side}_read_id", read_id)
+        conversation.save(update_fields=["low_read_id", "high_read_id"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0005_conversation"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="high_read_id",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="low_read_id",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(counters_to_cursors, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="conversation",
+            name="high_unread",
+        ),
+        migrations.RemoveField(
+            model_name="conversation",
+            name="low_unread",
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "sender", "id"], name="message_unread_range"
+            ),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:40
+
+from django.db import migrations
+
+# One FTS5 table indexes both direct and group messages. A direct message
+# with id N is row 2N and a group message is row 2N + 1. ``scope`` holds
+# the tokens of who may see the row: "u<id>" for both sides of a direct
+# message, "g<id>" for a group message. Triggers keep it in step with the
+# two message tables. Prefix indexes on 2 and 3 characters keep the prefix
+# match on the last word of a query fast.
+CREATE_SEARCH = [
+    """
+    CREATE VIRTUAL TABLE message_search USING fts5(
+        content, scope, tokenize = 'porter unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER message_search_insert AFTER INSERT ON messaging_message BEGIN
+        INSERT INTO message_search (rowid, content, scope)
+        VALUES (
+            new.id * 2, new.content, 'u' || new.sender_id || ' u' || new.receiver_id
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER message_search_update AFTER UPDATE OF content ON messaging_message
+    BEGIN
+        UPDATE message_search SET content = new.content WHERE rowid = new.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER message_search_delete AFTER DELETE ON messaging_message BEGIN
+        DELETE FROM message_search WHERE rowid = old.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER group_message_search_insert AFTER INSERT ON groups_groupmessage
+    BEGIN
+        INSERT INTO message_search (rowid, content, scope)
+        VALUES (new.id * 2 + 1, new.content, 'g' || new.group_id);
+    END
+    """,
+    """
+    CREATE TRIGGER group_message_search_update
+    AFTER UPDATE OF content ON groups_groupmessage BEGIN
+        UPDATE message_search SET content = new.content WHERE rowid = new.id * 2 + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER group_message_search_delete AFTER DELETE ON groups_groupmessage
+    BEGIN
+        DELETE FROM message_search WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+    """
+    INSERT INTO message_search (rowid, content, scope)
+    SELECT id * 2, content, 'u' || sender_id || ' u' || receiver_id
+    FROM messaging_message
+    """,
+    """
+    INSERT INTO message_search (rowid, content, scope)
+    SELECT id * 2 + 1, content, 'g' || group_id FROM groups_groupmessage
+    """,
+]
+
+DROP_SEARCH = [
+    "DROP TRIGGER IF EXISTS message_search_insert",
+    "DROP TRIGGER IF EXISTS message_search_update",
+    "DROP TRIGGER IF EXISTS message_search_delete",
+    "DROP TRIGGER IF EXISTS group_message_search_insert",
+    "DROP TRIGGER IF EXISTS group_message_search_update",
+    "DROP TRIGGER IF EXISTS group_message_search_delete",
+    "DROP TABLE IF EXISTS message_search",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite's; other databases need their own search backend
+        if schema_editor.connection.vendor == "sqlite":
+            for statement in statements:
+                schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0006_read_cursors"),
+        ("groups", "0002_invitation"),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SEARCH), run_on_sqlite(DROP_SEARCH)),
+    ]
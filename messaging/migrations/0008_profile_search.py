@@ -0,0 +1,117 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:20
+
+from django.db import migrations
+
+# Two indexes over every profile's username and full name, kept in step with
+# accounts_profile by triggers so any save of a profile updates them.
+#
+# profile_prefix holds the lowercased username, first name, last name and
+# full name of each profile as separate terms. Typeahead is a range scan of
+# its (term) or (role, term) B-tree, so its cost does not grow with the
+# number of profiles. profile_trigram is an FTS5 trigram index with the
+# profile id as rowid, used for substring and misspelt matches when the
+# prefixes run out.
+PROFILE_TERMS = """
+    INSERT OR IGNORE INTO profile_prefix (term, profile_id, role)
+    SELECT term, {row}.id, {row}.role FROM (
+        SELECT lower({row}.username) AS term
+        UNION SELECT lower({row}.first_name)
+        UNION SELECT lower({row}.last_name)
+        UNION SELECT lower(trim({row}.first_name || ' ' || {row}.last_name))
+    ) WHERE term != '';
+    INSERT INTO profile_trigram (rowid, username, full_name, role)
+    VALUES (
+        {row}.id, {row}.username,
+        trim({row}.first_name || ' ' || {row}.last_name), {row}.role
+    );
+"""
+
+DROP_TERMS = """
+    DELETE FROM profile_prefix WHERE profile_id = old.id;
+    DELETE FROM profile_trigram WHERE rowid = old.id;
+"""
+
+CREATE_SEARCH = [
+    """
+    CREATE TABLE profile_prefix (
+        term TEXT NOT NULL,
+        profile_id INTEGER NOT NULL,
+        role TEXT,
+        PRIMARY KEY (term, profile_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX profile_prefix_role ON profile_prefix (role, term, profile_id)",
+    "CREATE INDEX profile_prefix_profile ON profile_prefix (profile_id)",
+    """
+    CREATE VIRTUAL TABLE profile_trigram USING fts5(
+        username, full_name, role UNINDEXED, tokenize = 'trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER profile_search_insert AFTER INSERT ON accounts_profile BEGIN
+        {PROFILE_TERMS.format(row="new")}
+    END
+    """,
+    # Saves that leave the searchable fields alone, like a login, cost nothing
+    f"""
+    CREATE TRIGGER profile_search_update
+    AFTER UPDATE OF username, first_name, last_name, role ON accounts_profile
+    WHEN old.username IS NOT new.username
+        OR old.first_name IS NOT new.first_name
+        OR old.last_name IS NOT new.last_name
+        OR old.role IS NOT new.role
+    BEGIN
+        {DROP_TERMS}
+        {PROFILE_TERMS.format(row="new")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER profile_search_delete AFTER DELETE ON accounts_profile BEGIN
+        {DROP_TERMS}
+    END
+    """,
+    """
+    INSERT OR IGNORE INTO profile_prefix (term, profile_id, role)
+    SELECT term, id, role FROM (
+        SELECT lower(username) AS term, id, role FROM accounts_profile
+        UNION ALL SELECT lower(first_name), id, role FROM accounts_profile
+        UNION ALL SELECT lower(last_name), id, role FROM accounts_profile
+        UNION ALL SELECT lower(trim(first_name || ' ' || last_name)), id, role
+        FROM accounts_profile
+    ) WHERE term != ''
+    """,
+    """
+    INSERT INTO profile_trigram (rowid, username, full_name, role)
+    SELECT id, username, trim(first_name || ' ' || last_name), role
+    FROM accounts_profile
+    """,
+]
+
+DROP_SEARCH = [
+    "DROP TRIGGER IF EXISTS profile_search_insert",
+    "DROP TRIGGER IF EXISTS profile_search_update",
+    "DROP TRIGGER IF EXISTS profile_search_delete",
+    "DROP TABLE IF EXISTS profile_trigram",
+    "DROP TABLE IF EXISTS profile_prefix",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        # Trigram FTS5 is SQLite's; other databases need their own index
+        if schema_editor.connection.vendor == "sqlite":
+            for statement in statements:
+                schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0007_message_search"),
+        ("accounts", "0009_alter_profile_username"),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SEARCH), run_on_sqlite(DROP_SEARCH)),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:50
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_mirrored_contacts(apps, schema_editor):
+    # Friendships were stored twice, once from each side, and a request
+    # could be sent both ways. Keep the oldest row of each pair, accepted if
+    # any of the pair's rows was.
+    Contact = apps.get_model("messaging", "Contact")
+    kept = {}
+    duplicates = []
+    accepted = set()
+    for contact in Contact.objects.order_by("id").iterator():
+        pair = tuple(sorted((contact.user_id, contact.friend_id)))
+        if pair in kept:
+            duplicates.append(contact.id)
+        else:
+            kept[pair] = contact.id
+        if contact.is_friend:
+            accepted.add(kept[pair])
+    Contact.objects.filter(id__in=duplicates).delete()
+    Contact.objects.filter(id__in=accepted).update(status="accepted")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0008_profile_search"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contact",
+            name="status",
+            field=models.CharField(
+                choices=[("pending", "Pending"), ("accepted", "Accepted")],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(merge_mirrored_contacts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="contact",
+            name="is_friend",
+        ),
+        migrations.AlterField(
+            model_name="contact",
+            name="friend",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="friends",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="contact",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="contacts",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(fields=["user", "status"], name="contact_user_status"),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["friend", "status"], name="contact_friend_status"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="contact",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.comparison.Least("user", "friend"),
+                django.db.models.functions.comparison.Greatest("user", "friend"),
+                name="unique_contact_pair",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0009_contact_status"),
+    ]
+
+    operations = [
+        # The column itself is unchanged. Altering it on SQLite would rebuild
+        # the table and drop the message_search triggers.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="message",
+                    name="timestamp",
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:30
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_max_message_id(apps, schema_editor):
+    Message = apps.get_model("messaging", "Message")
+    Conversation = apps.get_model("messaging", "Conversation")
+    highest = (
+        Message.objects.filter(conversation=OuterRef("key"))
+        .order_by()
+        .values("conversation")
+        .annotate(highest=Max("id"))
+        .values("highest")
+    )
+    Conversation.objects.update(max_message_id=Coalesce(Subquery(highest), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0010_message_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="max_message_id",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_max_message_id, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,52 @@
 from django.db import models
+from django.db.models.functions import Greatest, Least
+from django.utils.timezone import now
 from accounts.models import Profile
 
 
 class Contact(models.Model):
-    user = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="contacts")
+    """Friendship between two users, one row per pair.
+
+    ``user`` sent the request and ``friend`` received it. The pair is unique
+    in either order, and the two ``(side, status)`` indexes serve lookups
+    from both ends.
+    """
+
+    PENDING = "pending"
+    ACCEPTED = "accepted"
+    STATUSES = [(PENDING, "Pending"), (ACCEPTED, "Accepted")]
+    # Covered by the (side, status) indexes below
+    user = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="contacts", db_index=False
+    )
     friend = models.ForeignKey(
-        Profile, on_delete=models.CASCADE, related_name="friends"
+        Profile, on_delete=models.CASCADE, related_name="friends", db_index=False
     )
-    is_friend = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                Least("user", "friend"),
+                Greatest("user", "friend"),
+                name="unique_contact_pair",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "status"], name="contact_user_status"),
+            models.Index(fields=["friend", "status"], name="contact_friend_status"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} -> {self.friend.username}"
 
 
+def conversation_key(user_id, partner_id):
+    """Key shared by both directions of the conversation between two users."""
+    low, high = sorted((int(user_id), int(partner_id)))
+    return f"{low}_{high}"
+
+
 class Message(models.Model):
     sender = models.ForeignKey(
         Profile, on_delete=models.CASCADE, related_name="sent_messages"
@@ -20,8 +54,67 @@ class Message(models.Model):
     receiver = models.ForeignKey(
         Profile, on_delete=models.CASCADE, related_name="received_messages"
     )
+    # Filled in on save, so a conversation's history is one index range
+    conversation = models.CharField(max_length=41, editable=False)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent, not when it reaches the database
+    timestamp = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["conversation", "timestamp", "id"],
+                name="message_conversation_time",
+            ),
+            # Unread counts: one side's messages after the other's read cursor
+            models.Index(
+                fields=["conversation", "sender", "id"],
+                name="message_unread_range",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.conversation = conversation_key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"From {self.sender.username} to {self.receiver.username} at {self.timestamp}"  # noqa: E501
+
+
+class Conversation(models.Model):
+    """Summary of a direct conversation, kept current as messages are sent.
+
+    One row per pair of users, ``user_low`` holding the smaller id. It lets
+    the chat list show the latest message without reading Message. Each
+    side's read cursor is the id of the last message they have seen, so
+    their unread count is a range count on the ``message_unread_range``
+    index. Cursors are capped at ``max_message_id``, the highest message id
+    in the conversation; a message written behind may get a higher id than
+    ``last_message`` though it was sent earlier.
+    """
+
+    key = models.CharField(max_length=41, unique=True)
+    user_low = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="+")
+    user_high = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="+")
+    last_message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    last_message_preview = models.CharField(max_length=100, blank=True)
+    last_message_at = models.DateTimeField(null=True)
+    max_message_id = models.PositiveBigIntegerField(default=0)
+    low_read_id = models.PositiveBigIntegerField(default=0)
+    high_read_id = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user_low", "-last_message_at"], name="conversation_low_recent"
+            ),
+            models.Index(
+                fields=["user_high", "-last_message_at"],
+                name="conversation_high_recent",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Conversation {self.key}"
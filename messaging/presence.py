@@ -0,0 +1,236 @@
+import asyncio
+import threading
+import time
+
+from django.db.models import Exists, OuterRef, Q
+
+from accounts.models import Profile
+
+from .models import Contact, Conversation
+
+ONLINE = "online"
+AWAY = "away"
+OFFLINE = "offline"
+
+# Clients send a heartbeat this often, in seconds. A connection is gone once
+# PRESENCE_TIMEOUT passes without one, and so are another process's users
+# once its announcements stop for as long.
+HEARTBEAT_INTERVAL = 20
+PRESENCE_TIMEOUT = 60
+
+# Users one socket or request may follow at once
+MAX_FOLLOWED = 200
+
+# Channel layer group joined by the presence listener of every process
+PROCESS_GROUP = "presence"
+
+
+def presence_group(user_id):
+    """Channel group of the sockets following ``user_id``'s presence."""
+    return f"presence_{user_id}"
+
+
+def combine(states):
+    """A user's state from those of their connections: the liveliest one."""
+    if ONLINE in states:
+        return ONLINE
+    if AWAY in states:
+        return AWAY
+    return OFFLINE
+
+
+def visible_users(user, user_ids):
+    """The ids in ``user_ids`` whose presence ``user`` may see.
+
+    Providers are visible to everyone, other users to their friends and to
+    whoever they have a conversation with. One query.
+    """
+    is_friend = Contact.objects.filter(
+        Q(user=user, friend=OuterRef("pk")) | Q(user=OuterRef("pk"), friend=user),
+        status=Contact.ACCEPTED,
+    )
+    talked_to = Conversation.objects.filter(
+        Q(user_low=user, user_high=OuterRef("pk"))
+        | Q(user_low=OuterRef("pk"), user_high=user)
+    )
+    return set(
+        Profile.objects.filter(id__in=user_ids)
+        .filter(Q(role="Provider") | Exists(is_friend) | Exists(talked_to))
+        .values_list("id", flat=True)
+    )
+
+
+class PresenceRegistry:
+    """Who is online, kept in memory by each process.
+
+    Every websocket connection has a state and an expiry that its
+    heartbeats push back. Users connected to other processes are known from
+    those processes' announcements on ``PROCESS_GROUP``: one when a user's
+    state on them changes, and a batch of all their users every third of
+    the timeout to keep the entries alive.
+
+    Sockets following a user get a ``presence.update`` event on the user's
+    ``presence_group`` only when their combined state changes, from the
+    process where the change happened. Heartbeats that change nothing cost
+    no channel layer traffic.
+    """
+
+    def __init__(self, timeout=PRESENCE_TIMEOUT, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        # user id -> {connection channel: (state, expires)}
+        self.connections = {}
+        # user id -> {process channel: (state, expires)}
+        self.remote = {}
+        # Last states announced to the other processes and published to
+        # followers; users who are offline are left out
+        self.announced = {}
+        self.published = {}
+        self.process = None
+        self.task = None
+
+    def live_states(self, entries, now):
+        return {state for state, expires in entries.values() if expires > now}
+
+    def local_state(self, user_id, now):
+        return combine(self.live_states(self.connections.get(user_id, {}), now))
+
+    def state(self, user_id, now):
+        return combine(
+            self.live_states(self.connections.get(user_id, {}), now)
+            | self.live_states(self.remote.get(user_id, {}), now)
+        )
+
+    def snapshot(self, user_ids):
+        """``{user_id: state}`` for ``user_ids``, without any query."""
+        now = self.clock()
+        with self.lock:
+            return {user_id: self.state(user_id, now) for user_id in user_ids}
+
+    def ensure_listening(self, layer):
+        """Start this process's listener on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self.task and not self.task.done() and self.task.get_loop() is loop:
+            return
+        self.task = loop.create_task(self.listen(layer))
+
+    async def heartbeat(self, layer, user_id, channel, state=ONLINE):
+        """Record that connection ``channel`` of ``user_id`` is alive."""
+        self.ensure_listening(layer)
+        with self.lock:
+            connections = self.connections.setdefault(user_id, {})
+            connections[channel] = (state, self.clock() + self.timeout)
+        await self.publish(layer, [user_id])
+
+    async def disconnect(self, layer, user_id, channel):
+        with self.lock:
+            connections = self.connections.get(user_id, {})
+            connections.pop(channel, None)
+            if not connections:
+                self.connections.pop(user_id, None)
+        await self.publish(layer, [user_id])
+
+    async def publish(self, layer, user_ids):
+        """Send the changes in ``user_ids``' states since they were last sent."""
+        now = self.clock()
+        announcements = []
+        updates = []
+        with self.lock:
+            for user_id in user_ids:
+                local = self.local_state(user_id, now)
+                if local != self.announced.get(user_id, OFFLINE):
+                    announcements.append([user_id, local])
+                    self.remember(self.announced, user_id, local)
+                state = self.state(user_id, now)
+                if state != self.published.get(user_id, OFFLINE):
+                    updates.append((user_id, state))
+                    self.remember(self.published, user_id, state)
+        if announcements and self.process:
+            await layer.group_send(
+                PROCESS_GROUP,
+                {
+                    "type": "presence.announce",
+                    "process": self.process,
+                    "users": announcements,
+                },
+            )
+        for user_id, state in updates:
+            await layer.group_send(
+                presence_group(user_id),
+                {"type": "presence.update", "users": [[user_id, state]]},
+            )
+
+    def remember(self, states, user_id, state):
+        if state == OFFLINE:
+            states.pop(user_id, None)
+        else:
+            states[user_id] = state
+
+    def receive(self, event):
+        """Apply another process's announcement.
+
+        That process publishes the resulting change to followers itself, so
+        here it only moves what was last published.
+        """
+        process = event["process"]
+        if process == self.process:
+            return
+        now = self.clock()
+        with self.lock:
+            for user_id, state in event["users"]:
+                entries = self.remote.setdefault(user_id, {})
+                if state == OFFLINE:
+                    entries.pop(process, None)
+                else:
+                    entries[process] = (state, now + self.timeout)
+                if not entries:
+                    del self.remote[user_id]
+                self.remember(self.published, user_id, self.state(user_id, now))
+
+    async def sweep(self, layer):
+        """Drop expired entries and publish what that changed.
+
+        Then announce this process's users, keeping them alive on the others.
+        """
+        now = self.clock()
+        with self.lock:
+            for entries_by_user in (self.connections, self.remote):
+                for user_id, entries in list(entries_by_user.items()):
+                    for key, (_, expires) in list(entries.items()):
+                        if expires <= now:
+                            del entries[key]
+                    if not entries:
+                        del entries_by_user[user_id]
+            users = set(self.published) | set(self.announced)
+            alive = [
+                [user_id, self.local_state(user_id, now)]
+                for user_id in self.connections
+            ]
+        await self.publish(layer, users)
+        if alive:
+            await layer.group_send(
+                PROCESS_GROUP,
+                {"type": "presence.announce", "process": self.process, "users": alive},
+            )
+
+    async def listen(self, layer):
+        self.process = await layer.new_channel("presence")
+        sweeper = asyncio.ensure_future(self.sweep_forever(layer))
+        try:
+            while True:
+                event = await layer.receive(self.process)
+                if event.get("type") == "presence.announce":
+                    self.receive(event)
+        finally:
+            sweeper.cancel()
+
+    async def sweep_forever(self, layer):
+        while True:
+            # Joined again each round, before the group membership expires
+            await layer.group_add(PROCESS_GROUP, self.process)
+            await self.sweep(layer)
+            await asyncio.sleep(self.timeout / 3)
+
+
+registry = PresenceRegistry()
@@ -2,5 +2,5 @@ from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
-    path("ws/chat/<str:room_name>/", consumers.ChatConsumer.as_asgi()),
+    path("ws/chat/<int:partner_id>/", consumers.DirectChatConsumer.as_asgi()),
 ]
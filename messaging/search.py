@@ -0,0 +1,187 @@
+import re
+from urllib.parse import urlencode
+
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import escape
+
+from calmseek import cursors
+from groups.models import GroupMessage
+
+from .models import Message
+from .triggers import TriggerIndex
+
+# The triggers keeping message_search in step with the two message tables,
+# as created by migration 0007_message_search
+MESSAGE_SEARCH = TriggerIndex(
+    tables=["messaging_message", "groups_groupmessage", "message_search"],
+    triggers={
+        "message_search_insert": """
+            CREATE TRIGGER message_search_insert AFTER INSERT ON messaging_message
+            BEGIN
+                INSERT INTO message_search (rowid, content, scope)
+                VALUES (
+                    new.id * 2, new.content,
+                    'u' || new.sender_id || ' u' || new.receiver_id
+                );
+            END
+        """,
+        "message_search_update": """
+            CREATE TRIGGER message_search_update
+            AFTER UPDATE OF content ON messaging_message BEGIN
+                UPDATE message_search SET content = new.content
+                WHERE rowid = new.id * 2;
+            END
+        """,
+        "message_search_delete": """
+            CREATE TRIGGER message_search_delete AFTER DELETE ON messaging_message
+            BEGIN
+                DELETE FROM message_search WHERE rowid = old.id * 2;
+            END
+        """,
+        "group_message_search_insert": """
+            CREATE TRIGGER group_message_search_insert
+            AFTER INSERT ON groups_groupmessage BEGIN
+                INSERT INTO message_search (rowid, content, scope)
+                VALUES (new.id * 2 + 1, new.content, 'g' || new.group_id);
+            END
+        """,
+        "group_message_search_update": """
+            CREATE TRIGGER group_message_search_update
+            AFTER UPDATE OF content ON groups_groupmessage BEGIN
+                UPDATE message_search SET content = new.content
+                WHERE rowid = new.id * 2 + 1;
+            END
+        """,
+        "group_message_search_delete": """
+            CREATE TRIGGER group_message_search_delete
+            AFTER DELETE ON groups_groupmessage BEGIN
+                DELETE FROM message_search WHERE rowid = old.id * 2 + 1;
+            END
+        """,
+    },
+    refill=[
+        "DELETE FROM message_search",
+        """
+        INSERT INTO message_search (rowid, content, scope)
+        SELECT id * 2, content, 'u' || sender_id || ' u' || receiver_id
+        FROM messaging_message
+        """,
+        """
+        INSERT INTO message_search (rowid, content, scope)
+        SELECT id * 2 + 1, content, 'g' || group_id FROM groups_groupmessage
+        """,
+    ],
+)
+
+# Results per page of the message search API
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+
+# Words of context around the matches in a result snippet
+SNIPPET_WORDS = 12
+
+# bm25 weights per message_search column: only content counts toward rank
+RANK = "bm25(message_search, 1.0, 0.0)"
+
+SEARCH_SQL = f"""
+    SELECT rowid, {RANK}, snippet(message_search, 0, char(2), char(3), '…', %s)
+    FROM message_search
+    WHERE message_search MATCH %s
+      AND ({RANK} > %s OR ({RANK} = %s AND rowid > %s))
+    ORDER BY {RANK}, rowid
+    LIMIT %s
+"""
+
+
+def match_expression(query, user):
+    """FTS5 query for the words of ``query`` within what ``user`` can read.
+
+    Every word must match, the last one as a prefix so results follow
+    typing. The scope column limits matches to the user's direct messages
+    and the groups they belong to. Returns None when there is nothing to
+    search for.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = " ".join(f'"{word}"' for word in words) + "*"
+    scopes = [f"u{user.id}"] + [
+        f"g{group_id}" for group_id in user.group_members.values_list("id", flat=True)
+    ]
+    return f"content: ({terms}) AND scope: ({' OR '.join(scopes)})"
+
+
+def encode_cursor(rank, rowid):
+    return cursors.encode_cursor(rank, rowid)
+
+
+def decode_cursor(cursor):
+    return cursors.decode_cursor(cursor, float, int)
+
+
+def highlight(snippet):
+    """Escape a snippet, turning FTS5's match markers into <mark> tags."""
+    return escape(snippet).replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+
+def search_messages(user, query, after=None, limit=SEARCH_PAGE_SIZE):
+    """Return ``(results, next_cursor)`` for ``query`` in ``user``'s chats.
+
+    Matches come from the ``message_search`` FTS5 index, best first, and
+    are paged by a ``(rank, rowid)`` keyset. Each result is a dict ready
+    for JSON with a highlighted snippet and a link to its chat.
+    """
+    match = match_expression(query, user)
+    if match is None:
+        return [], None
+    rank, rowid = after or (float("-inf"), 0)
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL, [SNIPPET_WORDS, match, rank, rank, rowid, limit + 1])
+        rows = cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+    # Direct messages are even rows and group messages odd ones
+    direct = Message.objects.select_related("sender").in_bulk(
+        [rowid // 2 for rowid, _, _ in rows if rowid % 2 == 0]
+    )
+    grouped = GroupMessage.objects.select_related("sender", "group").in_bulk(
+        [rowid // 2 for rowid, _, _ in rows if rowid % 2 == 1]
+    )
+    results = []
+    for rowid, _, snippet in rows:
+        if rowid % 2 == 0:
+            message = direct.get(rowid // 2)
+            if message is None:
+                continue
+            partner_id = (
+                message.receiver_id
+                if message.sender_id == user.id
+                else message.sender_id
+            )
+            query_string = urlencode({"section": "chat", "chat_partner": partner_id})
+            result = {
+                "kind": "direct",
+                "url": f"{reverse('messaging:messaging')}?{query_string}",
+            }
+        else:
+            message = grouped.get(rowid // 2)
+            if message is None:
+                continue
+            result = {
+                "kind": "group",
+                "group": message.group.name,
+                "url": reverse("groups:group_detail", args=[message.group_id]),
+            }
+        result.update(
+            id=message.id,
+            sender=message.sender.username,
+            timestamp=timezone.localtime(message.timestamp).isoformat(),
+            snippet=highlight(snippet),
+        )
+        results.append(result)
+    return results, next_cursor
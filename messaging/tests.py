@@ -1,11 +1,83 @@
-from django.test import TestCase, Client
+import asyncio
+import json
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, Client, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from accounts.models import Profile
-from .models import Contact, Message
+from calmseek.channel_layers import SQLiteChannelLayer
+from calmseek.cursors import InvalidCursor, encode_cursor
+from groups.models import Group, GroupMessage
+from groups.routing import websocket_urlpatterns as group_websocket_urlpatterns
+from .contacts import accept_request, friend_contacts, remove_friend, request_friend
+from .conversations import (
+    mark_conversation_read,
+    post_message,
+    post_messages,
+    read_cursor,
+    recent_conversations,
+    unread_count,
+)
+from .directory import DIRECTORY_PAGE_SIZE, PROFILE_SEARCH
+from .history import HISTORY_PAGE_SIZE, conversation_messages, decode_cursor
+from .search import MESSAGE_SEARCH
+from .routing import websocket_urlpatterns
+from .models import Contact, Conversation, Message, conversation_key
+from . import ephemeral, presence, write_behind
+from .consumers import ChatConsumer, direct_room
+from .ephemeral import Coalescer
+from .presence import PresenceRegistry, presence_group
+from .write_behind import WriteBehindBuffer
 
 User = get_user_model()
 
+websocket_application = URLRouter(websocket_urlpatterns + group_websocket_urlpatterns)
+
+
+async def open_socket(path, user):
+    """Connect ``user`` to the websocket at ``path``.
+
+    Returns the communicator, or None if the consumer refused the connection.
+    """
+    socket = ApplicationCommunicator(
+        websocket_application,
+        {
+            "type": "websocket",
+            "path": path,
+            "query_string": b"",
+            "headers": [],
+            "subprotocols": [],
+            "user": user,
+        },
+    )
+    await socket.send_input({"type": "websocket.connect"})
+    response = await socket.receive_output(timeout=3)
+    if response["type"] == "websocket.close":
+        return None
+    return socket
+
+
+async def receive_json(socket):
+    response = await socket.receive_output(timeout=3)
+    return json.loads(response["text"])
+
+
+async def send_json(socket, data):
+    await socket.send_input({"type": "websocket.receive", "text": json.dumps(data)})
+
 
 class MessagingAppTests(TestCase):
     def setUp(self):
@@ -37,7 +109,7 @@ class MessagingAppTests(TestCase):
         url = reverse("messaging:messaging")
         response = self.client.get(url, {"search_query": "user2"})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.context["search_users"].count(), 1)
+        self.assertEqual(len(response.context["search_users"]), 1)
 
     def test_add_friend_notfound(self):
         response = self.client.post({"friend_id": self.user2.id})
@@ -57,7 +129,9 @@ class MessagingAppTests(TestCase):
 
     def test_add_friend_already_exists(self):
         # Create an existing friend relationship
-        Contact.objects.create(user=self.user1, friend=self.user2, is_friend=True)
+        Contact.objects.create(
+            user=self.user1, friend=self.user2, status=Contact.ACCEPTED
+        )
         url = reverse("messaging:add_friend")
         response = self.client.post(url, {"friend_id": self.user2.id})
         self.assertEqual(response.status_code, 200)
@@ -71,17 +145,19 @@ class MessagingAppTests(TestCase):
 
     def test_confirm_request(self):
         request_contact = Contact.objects.create(
-            user=self.user2, friend=self.user1, is_friend=False
+            user=self.user2, friend=self.user1, status=Contact.PENDING
         )
         url = reverse("messaging:confirm_request")
         response = self.client.post(url, {"request_id": request_contact.id})
         # Check the response status and that the contact is now a friend
         self.assertEqual(response.status_code, 302)
         request_contact.refresh_from_db()
-        self.assertTrue(request_contact.is_friend)
+        self.assertEqual(request_contact.status, Contact.ACCEPTED)
 
     def test_delete_friend(self):
-        Contact.objects.create(user=self.user1, friend=self.user2, is_friend=True)
+        Contact.objects.create(
+            user=self.user1, friend=self.user2, status=Contact.ACCEPTED
+        )
         url = reverse("messaging:delete_friend")
         response = self.client.post(url, {"friend_id": self.user2.id})
         self.assertEqual(response.status_code, 302)  # Expecting a redirect
@@ -113,4 +189,968 @@ class MessagingAppTests(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context["chat_partner"], self.user2)
-        self.assertEqual(response.context["messages"].count(), 1)
+        self.assertEqual(len(response.context["messages"]), 1)
+
+
+class ContactTests(TestCase):
+    def setUp(self):
+        self.user = Profile.objects.create_user(
+            username="client", password="pass", email="client@example.com"
+        )
+        self.other = Profile.objects.create_user(
+            username="other", password="pass", email="other@example.com"
+        )
+        self.client.login(username="client", password="pass")
+
+    def test_one_row_per_pair_in_either_order(self):
+        Contact.objects.create(user=self.user, friend=self.other)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Contact.objects.create(user=self.other, friend=self.user)
+
+    def test_crossing_requests_make_friends(self):
+        Contact.objects.create(user=self.other, friend=self.user)
+
+        response = self.client.post(
+            reverse("messaging:add_friend"), {"friend_id": self.other.id}
+        )
+
+        self.assertEqual(
+            response.json()["message"],
+            f"You are now friends with {self.other.username}.",
+        )
+        self.assertEqual(Contact.objects.get().status, Contact.ACCEPTED)
+        self.assertEqual(
+            [contact.partner for contact in friend_contacts(self.other)], [self.user]
+        )
+
+    def test_friendship_is_seen_and_ended_from_both_sides(self):
+        contact = Contact.objects.create(user=self.other, friend=self.user)
+        self.client.post(
+            reverse("messaging:confirm_request"), {"request_id": contact.id}
+        )
+
+        response = self.client.get(
+            reverse("messaging:messaging"), {"section": "contacts"}
+        )
+        self.assertEqual(
+            [friend.partner for friend in response.context["friends"]], [self.other]
+        )
+        self.assertEqual(list(response.context["friend_requests"]), [])
+
+        url = reverse("messaging:delete_friend")
+        response = self.client.post(url, {"friend_id": self.other.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Contact.objects.exists())
+        response = self.client.post(url, {"friend_id": self.other.id})
+        self.assertEqual(response.status_code, 404)
+
+    def test_contacts_actions_are_single_indexed_queries(self):
+        # Lookup of the pair, then the insert inside a savepoint
+        with self.assertNumQueries(4):
+            contact, changed = request_friend(self.user, self.other)
+        self.assertTrue(changed)
+        with self.assertNumQueries(1):
+            self.assertTrue(accept_request(self.other, contact.id))
+        with self.assertNumQueries(1):
+            friend_contacts(self.user)
+        self.assertTrue(remove_friend(self.user, self.other.id))
+
+        plan = Contact.objects.filter(
+            Q(user=self.user) | Q(friend=self.user), status=Contact.ACCEPTED
+        ).explain()
+        self.assertIn("contact_user_status", plan)
+        self.assertIn("contact_friend_status", plan)
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.user = Profile.objects.create_user(
+            username="client", password="pass", email="client@example.com"
+        )
+        self.partner = Profile.objects.create_user(
+            username="partner", password="pass", email="partner@example.com"
+        )
+        self.other = Profile.objects.create_user(
+            username="other", password="pass", email="other@example.com"
+        )
+        self.client.login(username="client", password="pass")
+
+    def make_messages(self, count):
+        """Alternate ``count`` messages between the pair, a minute apart."""
+        start = timezone.now() - timedelta(days=1)
+        messages = []
+        for i in range(count):
+            sender, receiver = (
+                (self.user, self.partner) if i % 2 else (self.partner, self.user)
+            )
+            message = Message.objects.create(
+                sender=sender, receiver=receiver, content=f"message {i}"
+            )
+            Message.objects.filter(id=message.id).update(
+                timestamp=start + timedelta(minutes=i)
+            )
+            messages.append(message.id)
+        return messages
+
+    def history(self, **params):
+        url = reverse("messaging:message_history", args=[self.partner.id])
+        return self.client.get(url, params)
+
+    def test_chat_opens_on_the_latest_messages(self):
+        messages = self.make_messages(HISTORY_PAGE_SIZE + 5)
+        Message.objects.create(sender=self.other, receiver=self.user, content="x")
+
+        response = self.client.get(
+            reverse("messaging:messaging"),
+            {"section": "chat", "chat_partner": self.partner.id},
+        )
+
+        shown = [message.id for message in response.context["messages"]]
+        self.assertEqual(shown, messages[-HISTORY_PAGE_SIZE:])
+        self.assertIsNotNone(response.context["older_cursor"])
+        self.assertContains(response, "Load older messages")
+
+    def test_load_older_walks_back_to_the_first_message(self):
+        messages = self.make_messages(25)
+        # Messages sharing a timestamp are still each returned once
+        Message.objects.filter(id__in=messages[5:10]).update(
+            timestamp=timezone.now() - timedelta(days=2)
+        )
+        expected = [
+            message.id
+            for message in reversed(
+                conversation_messages(self.user.id, self.partner.id)
+            )
+        ]
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 10}
+            if cursor:
+                params["before"] = cursor
+            data = self.history(**params).json()
+            seen = [message["id"] for message in data["messages"]] + seen
+            cursor = data["older_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 25)
+
+    def test_history_is_shared_by_both_sides_only(self):
+        Message.objects.create(sender=self.user, receiver=self.partner, content="hi")
+        Message.objects.create(sender=self.partner, receiver=self.user, content="yo")
+        Message.objects.create(sender=self.user, receiver=self.other, content="no")
+
+        data = self.history().json()
+
+        self.assertEqual(
+            [message["content"] for message in data["messages"]], ["hi", "yo"]
+        )
+        self.assertIsNone(data["older_cursor"])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.history(before="not-a-cursor")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["status"], "error")
+
+    def test_naive_cursor_is_rejected(self):
+        naive = encode_cursor("2030-01-01T09:00:00", 1)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(naive)
+        self.assertEqual(self.history(before=naive).status_code, 400)
+
+    def test_history_query_uses_conversation_index(self):
+        plan = conversation_messages(self.user.id, self.partner.id).explain()
+        self.assertIn("message_conversation_time", plan)
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.user = Profile.objects.create_user(
+            username="client", password="pass", email="client@example.com"
+        )
+        self.partner = Profile.objects.create_user(
+            username="partner", password="pass", email="partner@example.com"
+        )
+        self.other = Profile.objects.create_user(
+            username="other", password="pass", email="other@example.com"
+        )
+        self.client.login(username="client", password="pass")
+
+    def chat_page(self, **params):
+        return self.client.get(
+            reverse("messaging:messaging"), {"section": "chat", **params}
+        )
+
+    def test_messages_keep_the_conversation_summary_current(self):
+        post_message(self.user, self.partner.id, "Hello")
+        question = post_message(self.user, self.partner.id, "Are you there?")
+        reply = post_message(self.partner, self.user.id, "Yes " * 60)
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(
+            (conversation.user_low, conversation.user_high), (self.user, self.partner)
+        )
+        self.assertEqual(conversation.last_message, reply)
+        self.assertEqual(conversation.last_message_at, reply.timestamp)
+        self.assertEqual(conversation.last_message_preview, ("Yes " * 60)[:100])
+        # Senders have read everything up to their own message
+        self.assertEqual(conversation.low_read_id, question.id)
+        self.assertEqual(conversation.high_read_id, reply.id)
+
+    def test_a_batch_keeps_summaries_and_cursors_current(self):
+        latest = post_message(self.partner, self.user.id, "Latest")
+        earlier = timezone.now() - timedelta(minutes=1)
+        batch = [
+            Message(sender=self.user, receiver_id=self.partner.id, content="Late"),
+            Message(sender=self.user, receiver_id=self.other.id, content="One"),
+            Message(sender=self.other, receiver_id=self.user.id, content="Two"),
+        ]
+        batch[0].timestamp = earlier
+
+        post_messages(batch)
+
+        self.assertEqual([message.id for message in batch], sorted(m.id for m in batch))
+        # Written after a later message, the late one leaves the summary be
+        # but still moves its sender's read cursor
+        conversation = Conversation.objects.get(user_high=self.partner)
+        self.assertEqual(conversation.last_message, latest)
+        self.assertEqual(read_cursor(self.user.id, self.partner.id), batch[0].id)
+        conversation = Conversation.objects.get(user_high=self.other)
+        self.assertEqual(conversation.last_message, batch[2])
+        self.assertEqual(read_cursor(self.user.id, self.other.id), batch[1].id)
+        self.assertEqual(read_cursor(self.other.id, self.user.id), batch[2].id)
+
+    def test_a_message_written_late_can_be_read(self):
+        post_message(self.partner, self.user.id, "Latest")
+        # Sent a minute earlier but written behind, so it has the higher id
+        late = Message(sender=self.partner, receiver_id=self.user.id, content="Late")
+        late.timestamp = timezone.now() - timedelta(minutes=1)
+        post_messages([late])
+        self.assertEqual(Conversation.objects.get().max_message_id, late.id)
+
+        response = self.chat_page(chat_partner=self.partner.id)
+
+        self.assertEqual(list(response.context["messages"])[0], late)
+        self.assertEqual(read_cursor(self.user.id, self.partner.id), late.id)
+        self.assertEqual(recent_conversations(self.user)[0].unread, 0)
+
+        mark_read = reverse("messaging:mark_read", args=[self.partner.id])
+        response = self.client.post(mark_read, {"message_id": late.id})
+        self.assertEqual(response.json(), {"status": "success", "unread": 0})
+
+    def test_unread_counts_come_from_the_read_cursor(self):
+        first = post_message(self.partner, self.user.id, "One")
+        post_message(self.partner, self.user.id, "Two")
+        post_message(self.partner, self.user.id, "Three")
+
+        self.assertEqual(unread_count(self.user.id, self.partner.id, 0), 3)
+        self.assertEqual(unread_count(self.user.id, self.partner.id, first.id), 2)
+        plan = (
+            Message.objects.filter(
+                conversation=conversation_key(self.user.id, self.partner.id),
+                sender_id=self.partner.id,
+                id__gt=first.id,
+            )
+            .values("id")
+            .explain()
+        )
+        self.assertIn("message_unread_range", plan)
+
+    def test_opening_a_chat_marks_it_read_in_one_write(self):
+        post_message(self.partner, self.user.id, "One")
+        last = post_message(self.partner, self.user.id, "Two")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.chat_page(chat_partner=self.partner.id)
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.low_read_id, last.id)
+        updates = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "messaging_conversation"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(recent_conversations(self.user)[0].unread, 0)
+
+    def test_read_cursor_never_moves_back_or_past_the_latest_message(self):
+        first = post_message(self.partner, self.user.id, "One")
+        last = post_message(self.partner, self.user.id, "Two")
+
+        mark_conversation_read(self.user.id, self.partner.id, last.id + 100)
+        self.assertEqual(read_cursor(self.user.id, self.partner.id), last.id)
+        mark_conversation_read(self.user.id, self.partner.id, first.id)
+        self.assertEqual(read_cursor(self.user.id, self.partner.id), last.id)
+
+    def test_mark_read_endpoint(self):
+        first = post_message(self.partner, self.user.id, "One")
+        post_message(self.partner, self.user.id, "Two")
+        url = reverse("messaging:mark_read", args=[self.partner.id])
+
+        response = self.client.post(url, {"message_id": first.id})
+
+        self.assertEqual(response.json(), {"status": "success", "unread": 1})
+        self.assertEqual(self.client.post(url, {"message_id": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_own_message_read_by_partner_is_marked_seen(self):
+        read = post_message(self.user, self.partner.id, "Read")
+        post_message(self.user, self.partner.id, "Not read yet")
+        mark_conversation_read(self.partner.id, self.user.id, read.id)
+
+        response = self.chat_page(chat_partner=self.partner.id)
+
+        self.assertEqual(response.context["seen_id"], read.id)
+        self.assertContains(response, "Seen", count=1)
+
+    def test_chat_list_is_sorted_by_recent_activity(self):
+        Contact.objects.create(
+            user=self.user, friend=self.other, status=Contact.ACCEPTED
+        )
+        friend = Profile.objects.create_user(
+            username="friend", password="pass", email="friend@example.com"
+        )
+        Contact.objects.create(user=self.user, friend=friend, status=Contact.ACCEPTED)
+        post_message(self.user, self.other.id, "Earlier")
+        post_message(self.partner, self.user.id, "Later")
+
+        response = self.chat_page()
+
+        chats = response.context["chats"]
+        self.assertEqual([chat.partner for chat in chats], [self.partner, self.other])
+        self.assertEqual([chat.unread for chat in chats], [1, 0])
+        self.assertEqual(
+            [contact.partner for contact in response.context["new_chats"]], [friend]
+        )
+        self.assertContains(response, "Later")
+
+    def test_chat_list_is_one_indexed_query(self):
+        for partner in (self.partner, self.other):
+            post_message(self.user, partner.id, "Hi")
+
+        with self.assertNumQueries(1):
+            recent_conversations(self.user)
+        plan = (
+            Conversation.objects.filter(Q(user_low=self.user) | Q(user_high=self.user))
+            .order_by("-last_message_at")
+            .explain()
+        )
+        self.assertIn("conversation_low_recent", plan)
+        self.assertIn("conversation_high_recent", plan)
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.user = Profile.objects.create_user(
+            username="client", password="pass", email="client@example.com"
+        )
+        self.partner = Profile.objects.create_user(
+            username="partner", password="pass", email="partner@example.com"
+        )
+        self.other = Profile.objects.create_user(
+            username="other", password="pass", email="other@example.com"
+        )
+        self.group = Group.objects.create(name="Support", created_by=self.partner)
+        self.group.members.add(self.user, self.partner)
+        self.outside_group = Group.objects.create(name="Other", created_by=self.other)
+        self.outside_group.members.add(self.other)
+        self.client.login(username="client", password="pass")
+
+    def search(self, **params):
+        return self.client.get(reverse("messaging:search_messages"), params)
+
+    def found(self, query):
+        return [
+            (result["kind"], result["id"])
+            for result in self.search(q=query).json()["results"]
+        ]
+
+    def test_triggers_are_restored_after_a_table_rebuild(self):
+        message = post_message(self.user, self.partner.id, "Booking on Monday")
+        self.assertEqual(MESSAGE_SEARCH.missing_triggers(connection), set())
+        # What a migration that rebuilds messaging_message does on SQLite
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER message_search_update")
+        Message.objects.filter(id=message.id).update(content="Booking on Friday")
+        self.assertEqual(
+            MESSAGE_SEARCH.missing_triggers(connection), {"message_search_update"}
+        )
+
+        emit_post_migrate_signal(verbosity=0, interactive=False, db="default")
+
+        self.assertEqual(MESSAGE_SEARCH.missing_triggers(connection), set())
+        self.assertEqual(self.found("friday"), [("direct", message.id)])
+        self.assertEqual(self.found("monday"), [])
+
+    def test_search_is_scoped_to_the_users_chats_and_groups(self):
+        sent = post_message(self.user, self.partner.id, "Booking an appointment")
+        received = post_message(self.partner, self.user.id, "Your appointment is set")
+        post_message(self.partner, self.other.id, "Their appointment")
+        in_group = GroupMessage.objects.create(
+            group=self.group, sender=self.partner, content="Group appointment notes"
+        )
+        GroupMessage.objects.create(
+            group=self.outside_group, sender=self.other, content="Appointment"
+        )
+
+        self.assertCountEqual(
+            self.found("appointment"),
+            [("direct", sent.id), ("direct", received.id), ("group", in_group.id)],
+        )
+
+    def test_results_are_ranked_highlighted_and_escaped(self):
+        post_message(
+            self.partner, self.user.id, "a long note that mentions the refund once"
+        )
+        best = post_message(self.partner, self.user.id, "<b>Refund</b> refund")
+
+        results = self.search(q="refund").json()["results"]
+
+        self.assertEqual(results[0]["id"], best.id)
+        self.assertEqual(
+            results[0]["snippet"],
+            "&lt;b&gt;<mark>Refund</mark>&lt;/b&gt; <mark>refund</mark>",
+        )
+        self.assertEqual(results[0]["sender"], "partner")
+        self.assertIn(f"chat_partner={self.partner.id}", results[0]["url"])
+
+    def test_words_are_stemmed_and_the_last_is_a_prefix(self):
+        message = post_message(self.user, self.partner.id, "Cancelled appointments")
+
+        self.assertEqual(self.found("cancel appoint"), [("direct", message.id)])
+        self.assertEqual(self.found("appointment"), [("direct", message.id)])
+        self.assertEqual(self.found("cancelled meeting"), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = post_message(self.user, self.partner.id, "See you Monday")
+        group_message = GroupMessage.objects.create(
+            group=self.group, sender=self.user, content="Monday session"
+        )
+
+        Message.objects.filter(id=message.id).update(content="See you Tuesday")
+        group_message.delete()
+
+        self.assertEqual(self.found("monday"), [])
+        self.assertEqual(self.found("tuesday"), [("direct", message.id)])
+
+    def test_pages_follow_the_cursor(self):
+        ids = {
+            ("direct", post_message(self.partner, self.user.id, f"invoice {i}").id)
+            for i in range(25)
+        }
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"q": "invoice", "limit": 10}
+            if cursor:
+                params["cursor"] = cursor
+            data = self.search(**params).json()
+            seen += [(result["kind"], result["id"]) for result in data["results"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(set(seen), ids)
+
+    def test_empty_query_and_invalid_cursor(self):
+        post_message(self.partner, self.user.id, "Hello")
+
+        self.assertEqual(self.search(q=' "* ').json()["results"], [])
+        self.assertEqual(self.search(q="hello", cursor="bad").status_code, 400)
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.user = Profile.objects.create_user(
+            username="searcher", password="pass", email="searcher@example.com"
+        )
+        self.anna = Profile.objects.create_user(
+            username="asmith",
+            password="pass",
+            email="anna@example.com",
+            first_name="Anna",
+            last_name="Garcia",
+            role="Provider",
+        )
+        self.annie = Profile.objects.create_user(
+            username="annie_k", password="pass", email="annie@example.com", role="User"
+        )
+        self.client.login(username="searcher", password="pass")
+
+    def suggest(self, **params):
+        return self.client.get(reverse("messaging:search_users"), params)
+
+    def found(self, query, **params):
+        results = self.suggest(q=query, **params).json()["results"]
+        return [result["username"] for result in results]
+
+    def test_triggers_are_restored_after_a_table_rebuild(self):
+        self.assertEqual(PROFILE_SEARCH.missing_triggers(connection), set())
+        # What a migration that rebuilds accounts_profile does on SQLite
+        with connection.cursor() as cursor:
+            for name in PROFILE_SEARCH.triggers:
+                cursor.execute(f"DROP TRIGGER {name}")
+        Profile.objects.filter(id=self.anna.id).update(username="bsmith")
+        self.assertEqual(
+            PROFILE_SEARCH.missing_triggers(connection), set(PROFILE_SEARCH.triggers)
+        )
+
+        emit_post_migrate_signal(verbosity=0, interactive=False, db="default")
+
+        self.assertEqual(PROFILE_SEARCH.missing_triggers(connection), set())
+        self.assertEqual(self.found("bsm"), ["bsmith"])
+        self.assertEqual(self.found("asmi"), [])
+
+    def test_prefixes_of_usernames_and_names(self):
+        self.assertEqual(self.found("ANN"), ["asmith", "annie_k"])
+        self.assertEqual(self.found("garc"), ["asmith"])
+        self.assertEqual(self.found("anna  gar"), ["asmith"])
+        self.assertEqual(self.found("searcher"), [])
+
+        result = self.suggest(q="asm").json()["results"][0]
+        self.assertEqual(
+            result,
+            {
+                "id": self.anna.id,
+                "username": "asmith",
+                "full_name": "Anna Garcia",
+                "role": "Provider",
+            },
+        )
+
+    def test_role_filter(self):
+        self.assertEqual(self.found("ann", role="provider"), ["asmith"])
+        self.assertEqual(self.found("ann", role="User"), ["annie_k"])
+        self.assertEqual(self.suggest(q="ann", role="owner").status_code, 400)
+
+    def test_substrings_and_typos_follow_prefixes(self):
+        self.assertEqual(self.found("nie"), ["annie_k"])
+        self.assertEqual(self.found("garcai"), ["asmith"])
+        self.assertEqual(self.found("zzz"), [])
+        self.assertEqual(self.found(' "* '), [])
+
+    def test_index_follows_profile_saves(self):
+        self.anna.last_name = "Lopez"
+        self.anna.role = "User"
+        self.anna.save()
+        self.annie.delete()
+
+        self.assertEqual(self.found("lop", role="user"), ["asmith"])
+        self.assertEqual(self.found("garc"), [])
+        self.assertEqual(self.found("annie"), [])
+
+    def test_directory_pages_by_username_without_counting(self):
+        usernames = sorted(
+            Profile.objects.create_user(
+                username=f"provider{i:02}",
+                password="pass",
+                email=f"provider{i}@example.com",
+                role="Provider",
+            ).username
+            for i in range(DIRECTORY_PAGE_SIZE + 3)
+        )
+        usernames = sorted(usernames + ["asmith"])
+        url = reverse("messaging:messaging")
+        params = {"section": "contacts", "role": "provider"}
+
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url, params).context
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+        self.assertEqual(
+            [user.username for user in first["paginated_users"]],
+            usernames[:DIRECTORY_PAGE_SIZE],
+        )
+        self.assertIsNone(first["previous_before"])
+
+        second = self.client.get(url, {**params, "after": first["next_after"]}).context
+        self.assertEqual(
+            [user.username for user in second["paginated_users"]],
+            usernames[DIRECTORY_PAGE_SIZE:],
+        )
+        self.assertIsNone(second["next_after"])
+
+        back = self.client.get(
+            url, {**params, "before": second["previous_before"]}
+        ).context
+        self.assertEqual(
+            [user.username for user in back["paginated_users"]],
+            usernames[:DIRECTORY_PAGE_SIZE],
+        )
+        self.assertIsNone(back["previous_before"])
+
+
+class CoalescerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.layer = SQLiteChannelLayer(Path(directory.name) / "channels.sqlite3")
+
+    async def test_one_event_per_interval_and_the_last_is_kept(self):
+        coalescer = Coalescer(interval=0.2)
+        listener = await self.layer.new_channel()
+        await self.layer.group_add("room", listener)
+
+        for _ in range(50):
+            await coalescer.send(self.layer, "room", 1, {"type": "typing"})
+        await coalescer.send(self.layer, "room", 1, {"type": "stopped"})
+        await coalescer.send(self.layer, "room", 2, {"type": "typing"})
+
+        events = [await self.layer.receive(listener) for _ in range(3)]
+        self.assertEqual(
+            [event["type"] for event in events], ["typing", "typing", "stopped"]
+        )
+        self.assertEqual(coalescer.stats(), {"room": (52, 3)})
+        self.assertEqual(coalescer.stats(), {})
+        # The interval after the trailing event closes with nothing held
+        await asyncio.sleep(0.5)
+        self.assertEqual(coalescer.held, {})
+        await self.layer.close()
+
+
+class PresenceRegistryTests(SimpleTestCase):
+    """Two layer instances stand in for two worker processes."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "channels.sqlite3"
+        self.now = 1000.0
+
+    def registry(self):
+        return PresenceRegistry(timeout=60, clock=lambda: self.now)
+
+    async def updates(self, layer, channel):
+        """Presence updates received by ``channel`` so far.
+
+        A cancelled receive closes the channel, so rather than waiting for
+        silence this reads up to a marker sent after them.
+        """
+        await layer.send(channel, {"type": "marker"})
+        received = []
+        while True:
+            event = await layer.receive(channel)
+            if event["type"] == "marker":
+                return received
+            received += event["users"]
+
+    async def test_followers_get_transitions_only(self):
+        layer = SQLiteChannelLayer(self.path)
+        registry = self.registry()
+        follower = await layer.new_channel()
+        await layer.group_add(presence_group(1), follower)
+
+        await registry.heartbeat(layer, 1, "first")
+        for _ in range(5):
+            await registry.heartbeat(layer, 1, "first")
+        self.assertEqual(await self.updates(layer, follower), [[1, "online"]])
+
+        await registry.heartbeat(layer, 1, "first", presence.AWAY)
+        await registry.heartbeat(layer, 1, "second")
+        await registry.disconnect(layer, 1, "second")
+        self.assertEqual(
+            await self.updates(layer, follower),
+            [[1, "away"], [1, "online"], [1, "away"]],
+        )
+
+        # A connection whose heartbeats stop expires
+        self.now += 61
+        self.assertEqual(registry.snapshot([1, 2]), {1: "offline", 2: "offline"})
+        await registry.sweep(layer)
+        self.assertEqual(await self.updates(layer, follower), [[1, "offline"]])
+        self.assertEqual(registry.connections, {})
+        await layer.close()
+
+    async def test_processes_share_their_users(self):
+        first_layer = SQLiteChannelLayer(self.path)
+        second_layer = SQLiteChannelLayer(self.path)
+        first, second = self.registry(), self.registry()
+        second.ensure_listening(second_layer)
+        await asyncio.sleep(0.2)
+
+        await first.heartbeat(first_layer, 1, "socket")
+        for _ in range(20):
+            if second.snapshot([1]) == {1: "online"}:
+                break
+            await asyncio.sleep(0.1)
+        self.assertEqual(second.snapshot([1]), {1: "online"})
+
+        await first.disconnect(first_layer, 1, "socket")
+        for _ in range(20):
+            if second.snapshot([1]) == {1: "offline"}:
+                break
+            await asyncio.sleep(0.1)
+        self.assertEqual(second.snapshot([1]), {1: "offline"})
+        for registry in (first, second):
+            registry.task.cancel()
+        await first_layer.close()
+        await second_layer.close()
+
+
+class PresenceTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = Profile.objects.create(username="alice", role="User")
+        self.bob = Profile.objects.create(username="bob", role="User")
+        self.carol = Profile.objects.create(username="carol", role="User")
+        Contact.objects.create(
+            user=self.alice, friend=self.bob, status=Contact.ACCEPTED
+        )
+        registry = presence.registry
+        presence.registry = PresenceRegistry()
+        self.addCleanup(setattr, presence, "registry", registry)
+
+    async def test_sockets_follow_visible_users(self):
+        alice = await open_socket(f"/ws/chat/{self.bob.id}/", self.alice)
+        await send_json(
+            alice, {"type": "presence", "user_ids": [self.bob.id, self.carol.id]}
+        )
+        self.assertEqual(
+            await receive_json(alice),
+            {"type": "presence", "users": {str(self.bob.id): "offline"}},
+        )
+
+        bob = await open_socket(f"/ws/chat/{self.alice.id}/", self.bob)
+        self.assertEqual(
+            (await receive_json(alice))["users"], {str(self.bob.id): "online"}
+        )
+        for _ in range(3):
+            await send_json(bob, {"type": "heartbeat", "state": "online"})
+        await send_json(bob, {"type": "heartbeat", "state": "away"})
+        self.assertEqual(
+            (await receive_json(alice))["users"], {str(self.bob.id): "away"}
+        )
+
+        await bob.send_input({"type": "websocket.disconnect", "code": 1000})
+        self.assertEqual(
+            (await receive_json(alice))["users"], {str(self.bob.id): "offline"}
+        )
+        self.assertTrue(await alice.receive_nothing())
+        await alice.send_input({"type": "websocket.disconnect", "code": 1000})
+
+    def test_chat_list_gets_one_snapshot(self):
+        post_message(self.carol, self.alice.id, "Hi")
+        async_to_sync(presence.registry.heartbeat)(
+            get_channel_layer(), self.bob.id, "socket"
+        )
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse("messaging:messaging"))
+        states = {
+            item.partner: item.presence
+            for item in response.context["chats"] + response.context["new_chats"]
+        }
+        self.assertEqual(states, {self.carol: "offline", self.bob: "online"})
+
+        url = reverse("messaging:presence")
+        ids = f"{self.bob.id},{self.carol.id},{self.alice.id}"
+        response = self.client.get(url, {"ids": ids})
+        self.assertEqual(
+            response.json()["users"],
+            {str(self.bob.id): "online", str(self.carol.id): "offline"},
+        )
+        self.assertEqual(self.client.get(url, {"ids": "1,x"}).status_code, 400)
+
+
+class WriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = Profile.objects.create(username="alice", role="User")
+        self.bob = Profile.objects.create(username="bob", role="User")
+        self.carol = Profile.objects.create(username="carol", role="User")
+
+    def message(self, sender, receiver, content):
+        return Message(sender=sender, receiver_id=receiver.id, content=content)
+
+    async def test_messages_are_written_in_order_after_the_window(self):
+        buffer = WriteBehindBuffer(window=0.2)
+        layer = get_channel_layer()
+        listener = await layer.new_channel()
+        for room in ("one", "two"):
+            await layer.group_add(room, listener)
+        messages = [
+            self.message(self.alice, self.bob, "First"),
+            self.message(self.bob, self.carol, "Second"),
+            self.message(self.bob, self.alice, "Third"),
+        ]
+
+        for message, room, key in zip(messages, ["one", "two", "one"], "abc"):
+            await buffer.add(post_messages, message, room, key)
+        self.assertFalse(await Message.objects.aexists())
+
+        events = [await layer.receive(listener) for _ in range(2)]
+        self.assertEqual(
+            sorted((event["ids"] for event in events), key=len, reverse=True),
+            [{"a": messages[0].id, "c": messages[2].id}, {"b": messages[1].id}],
+        )
+        ids = [message.id for message in messages]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(
+            [message async for message in Message.objects.order_by("id")], messages
+        )
+        self.assertEqual(buffer.held, [])
+
+    async def test_a_full_buffer_is_written_before_adding(self):
+        buffer = WriteBehindBuffer(window=60, limit=2)
+        for content in ("One", "Two", "Three"):
+            await buffer.add(
+                post_messages, self.message(self.alice, self.bob, content), "r", content
+            )
+        self.assertEqual(await Message.objects.acount(), 2)
+        self.assertEqual(len(buffer.held), 1)
+
+        await buffer.flush()
+        self.assertEqual(await Message.objects.acount(), 3)
+        buffer.flusher.cancel()
+
+    async def test_messages_wait_while_the_database_is_unavailable(self):
+        buffer = WriteBehindBuffer(window=10)
+        failures = [OperationalError("database is locked")]
+
+        def save(messages):
+            if failures:
+                raise failures.pop()
+            post_messages(messages)
+
+        await buffer.add(save, self.message(self.alice, self.bob, "One"), "r", "1")
+        with self.assertLogs("messaging.write_behind", "WARNING"):
+            self.assertFalse(await buffer.flush())
+        # Kept, and tried again later and later
+        self.assertEqual(len(buffer.held), 1)
+        self.assertEqual(buffer.delay, 20)
+        await buffer.add(save, self.message(self.alice, self.bob, "Two"), "r", "2")
+        self.assertTrue(await buffer.flush())
+
+        self.assertEqual(
+            [message.content async for message in Message.objects.order_by("id")],
+            ["One", "Two"],
+        )
+        self.assertEqual(buffer.delay, 10)
+        buffer.flusher.cancel()
+
+    async def test_a_message_that_cannot_be_saved_is_dropped_alone(self):
+        buffer = WriteBehindBuffer(window=60)
+        layer = get_channel_layer()
+        listener = await layer.new_channel()
+        await layer.group_add("r", listener)
+        gone = await Profile.objects.acreate(username="gone", role="User")
+        orphan = self.message(self.alice, gone, "Lost")
+        await gone.adelete()
+
+        await buffer.add(
+            post_messages, self.message(self.alice, self.bob, "One"), "r", "1"
+        )
+        await buffer.add(post_messages, orphan, "r", "2")
+        await buffer.add(
+            post_messages, self.message(self.bob, self.alice, "Two"), "r", "3"
+        )
+        with self.assertLogs("messaging.write_behind", "ERROR"):
+            self.assertTrue(await buffer.flush())
+
+        saved = await layer.receive(listener)
+        self.assertEqual(saved["unsaved"], ["2"])
+        self.assertEqual(sorted(saved["ids"]), ["1", "3"])
+        self.assertEqual(
+            [message.content async for message in Message.objects.order_by("id")],
+            ["One", "Two"],
+        )
+        self.assertEqual(buffer.held, [])
+        buffer.flusher.cancel()
+
+
+class DirectChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = Profile.objects.create(username="alice", role="User")
+        self.bob = Profile.objects.create(username="bob", role="Provider")
+        buffer = write_behind.buffer
+        write_behind.buffer = WriteBehindBuffer(window=0.1)
+        self.addCleanup(setattr, write_behind, "buffer", buffer)
+
+    async def test_message_is_saved_and_delivered_to_both_sides(self):
+        alice = await open_socket(f"/ws/chat/{self.bob.id}/", self.alice)
+        bob = await open_socket(f"/ws/chat/{self.alice.id}/", self.bob)
+
+        await send_json(alice, {"message": "  Hello Bob  "})
+        for socket in (alice, bob):
+            event = await receive_json(socket)
+            self.assertEqual(event["content"], "Hello Bob")
+            self.assertEqual(event["sender_id"], self.alice.id)
+            self.assertEqual(event["sender"], "alice")
+            # Broadcast before it is written; the id follows
+            self.assertIsNone(event["id"])
+            saved = await receive_json(socket)
+            self.assertEqual(saved["type"], "saved")
+
+        message = await Message.objects.aget(id=saved["ids"][event["key"]])
+        self.assertEqual(
+            (message.sender_id, message.receiver_id), (self.alice.id, self.bob.id)
+        )
+        conversation = await Conversation.objects.aget()
+        self.assertEqual(conversation.last_message_id, message.id)
+        await alice.send_input({"type": "websocket.disconnect", "code": 1000})
+        await bob.send_input({"type": "websocket.disconnect", "code": 1000})
+
+    async def test_closing_the_socket_writes_its_messages(self):
+        write_behind.buffer.window = 60
+        alice = await open_socket(f"/ws/chat/{self.bob.id}/", self.alice)
+        await send_json(alice, {"message": "Bye"})
+        self.assertEqual((await receive_json(alice))["content"], "Bye")
+        self.assertFalse(await Message.objects.aexists())
+
+        await alice.send_input({"type": "websocket.disconnect", "code": 1000})
+        await alice.wait(timeout=3)
+        self.assertEqual((await Message.objects.aget()).content, "Bye")
+        write_behind.buffer.flusher.cancel()
+
+    async def test_blank_and_malformed_messages_are_ignored(self):
+        alice = await open_socket(f"/ws/chat/{self.bob.id}/", self.alice)
+        await send_json(alice, {"message": "   "})
+        await alice.send_input({"type": "websocket.receive", "text": "not json"})
+        self.assertTrue(await alice.receive_nothing())
+        self.assertFalse(await Message.objects.aexists())
+        await alice.send_input({"type": "websocket.disconnect", "code": 1000})
+
+    async def test_typing_is_coalesced_and_never_stored(self):
+        coalescer = ephemeral.coalescer
+        ephemeral.coalescer = Coalescer(interval=0.3)
+        self.addCleanup(setattr, ephemeral, "coalescer", coalescer)
+        alice = await open_socket(f"/ws/chat/{self.bob.id}/", self.alice)
+        bob = await open_socket(f"/ws/chat/{self.alice.id}/", self.bob)
+
+        for _ in range(20):
+            await send_json(alice, {"type": "typing"})
+        typing = {"type": "typing", "user_id": self.alice.id, "sender": "alice"}
+        self.assertEqual(await receive_json(bob), typing)
+        self.assertEqual(await receive_json(bob), typing)
+        self.assertTrue(await bob.receive_nothing(timeout=0.5))
+        self.assertTrue(await alice.receive_nothing())
+
+        room = direct_room(self.alice.id, self.bob.id)
+        self.assertEqual(ephemeral.coalescer.stats(), {room: (20, 2)})
+        self.assertFalse(await Message.objects.aexists())
+        await alice.send_input({"type": "websocket.disconnect", "code": 1000})
+        await bob.send_input({"type": "websocket.disconnect", "code": 1000})
+
+    def test_chat_consumer_is_abstract(self):
+        with self.assertRaises(TypeError):
+            ChatConsumer()
+
+    async def test_refuses_anonymous_users_and_unknown_partners(self):
+        self.assertIsNone(
+            await open_socket(f"/ws/chat/{self.bob.id}/", AnonymousUser())
+        )
+        self.assertIsNone(await open_socket("/ws/chat/999999/", self.alice))
+
+    async def test_posted_message_reaches_open_chat(self):
+        bob = await open_socket(f"/ws/chat/{self.alice.id}/", self.bob)
+        await sync_to_async(self.client.force_login)(self.alice)
+        await sync_to_async(self.client.post)(
+            reverse("messaging:send_message"),
+            {"receiver_id": self.bob.id, "content": "Posted"},
+        )
+        self.assertEqual((await receive_json(bob))["content"], "Posted")
+        await bob.send_input({"type": "websocket.disconnect", "code": 1000})
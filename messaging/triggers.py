@@ -0,0 +1,44 @@
+from django.db import transaction
+
+
+class TriggerIndex:
+    """A search table kept in step with model tables by SQLite triggers.
+
+    SQLite drops a table's triggers, without any error, when a migration
+    rebuilds the table to alter a column, and the index silently goes
+    stale from then on. ``restore`` runs after every migrate: when any of
+    ``triggers`` is missing it refills the index from scratch and creates
+    them all again.
+
+    ``tables`` are the tables that must exist first, ``triggers`` maps each
+    trigger's name to its CREATE TRIGGER statement, and ``refill`` empties
+    and refills the index.
+    """
+
+    def __init__(self, tables, triggers, refill):
+        self.tables = tables
+        self.triggers = triggers
+        self.refill = refill
+
+    def missing_triggers(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+            )
+            existing = {name for (name,) in cursor.fetchall()}
+        if not set(self.tables) <= existing:
+            # Not migrated this far yet
+            return set()
+        return set(self.triggers) - existing
+
+    def restore(self, connection):
+        """Recreate the triggers if any is missing; True if it did."""
+        if not self.missing_triggers(connection):
+            return False
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                for name in self.triggers:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                for statement in self.refill + list(self.triggers.values()):
+                    cursor.execute(statement)
+        return True
@@ -9,4 +9,13 @@ urlpatterns = [
     path("confirm_request/", views.confirm_request, name="confirm_request"),
     path("delete_friend/", views.delete_friend, name="delete_friend"),
     path("send_message/", views.send_message, name="send_message"),
+    path(
+        "api/history/<int:partner_id>/",
+        views.message_history,
+        name="message_history",
+    ),
+    path("api/read/<int:partner_id>/", views.mark_read, name="mark_read"),
+    path("api/search/", views.search_messages_api, name="search_messages"),
+    path("api/users/", views.search_users_api, name="search_users"),
+    path("api/presence/", views.presence_api, name="presence"),
 ]
@@ -1,13 +1,36 @@
-from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.db import models
 from accounts.models import Profile
 from calmseek import settings
-from .models import Contact, Message
+from calmseek.cursors import InvalidCursor
+from .consumers import broadcast, direct_room
+from .contacts import (
+    accept_request,
+    friend_contacts,
+    friend_requests,
+    remove_friend,
+    request_friend,
+)
+from .conversations import (
+    mark_conversation_read,
+    post_message,
+    read_cursor,
+    recent_conversations,
+    unread_count,
+)
+from .history import (
+    HISTORY_PAGE_SIZE,
+    MAX_HISTORY_PAGE_SIZE,
+    conversation_messages,
+    decode_cursor,
+    history_page,
+    message_json,
+)
+from .models import Contact
+from . import directory, ephemeral, presence, search
 from urllib.parse import urlencode
 
 User = get_user_model()
@@ -17,23 +40,52 @@ User = get_user_model()
 def messaging_view(request):
     section = request.GET.get("section", "chat")
     role = request.GET.get("role", "provider")
-    page_number = request.GET.get("page", 1)
+    after = request.GET.get("after")
+    before = request.GET.get("before")
     chat_partner_id = request.GET.get("chat_partner")
     search_query = request.GET.get("search_query", "")  # Add search query filter
     chat_partner = None
     messages = []
+    older_cursor = None
+    seen_id = None
 
     if section == "chat" and chat_partner_id:
         chat_partner = get_object_or_404(User, id=chat_partner_id)
-        messages = Message.objects.filter(
-            (
-                models.Q(sender=request.user, receiver=chat_partner)
-                | models.Q(sender=chat_partner, receiver=request.user)
+        # Only the latest messages; older ones are fetched by message_history
+        messages, older_cursor = history_page(
+            conversation_messages(request.user.id, chat_partner.id)
+        )
+        if messages:
+            # In time order; a message written behind may have the highest id
+            mark_conversation_read(
+                request.user.id, chat_partner.id, max(m.id for m in messages)
             )
-        ).order_by("timestamp")
+        # The last message of ours the partner has read gets a "Seen" mark
+        partner_read_id = read_cursor(chat_partner.id, request.user.id)
+        seen_id = max(
+            (
+                message.id
+                for message in messages
+                if message.sender_id == request.user.id
+                and message.id <= partner_read_id
+            ),
+            default=None,
+        )
 
-    friends = Contact.objects.filter(user=request.user, is_friend=True)
-    friend_requests = Contact.objects.filter(friend=request.user, is_friend=False)
+    friends = friend_contacts(request.user)
+    chats = []
+    new_chats = []
+    if section == "chat":
+        # Conversations by latest activity, then friends not yet written to
+        chats = recent_conversations(request.user)
+        talked_to = {chat.partner.id for chat in chats}
+        new_chats = [friend for friend in friends if friend.partner.id not in talked_to]
+        # One snapshot of the registry for the whole list
+        states = presence.registry.snapshot(
+            [item.partner.id for item in chats + new_chats]
+        )
+        for item in chats + new_chats:
+            item.presence = states[item.partner.id]
 
     if role == "provider":
         filtered_users = Profile.objects.filter(role="Provider").exclude(
@@ -42,13 +94,21 @@ def messaging_view(request):
     else:  # Default to "user" role
         filtered_users = Profile.objects.filter(role="User").exclude(id=request.user.id)
 
-    search_users = ""
-    # Search users by username
+    search_users = []
+    # Search users by the start of their username or name, then near matches
     if search_query:
-        search_users = Profile.objects.filter(username=search_query)
+        search_users = profiles_in_order(
+            directory.suggest_profiles(
+                search_query,
+                exclude=request.user.id,
+                limit=directory.DIRECTORY_PAGE_SIZE,
+            )
+        )
 
-    paginator = Paginator(filtered_users, 12)  # Show 12 users per page
-    paginated_users = paginator.get_page(page_number)
+    # Keyset pages by username, 12 users per page
+    paginated_users, next_after, previous_before = directory.directory_page(
+        filtered_users.select_related("provider"), after, before
+    )
 
     return render(
         request,
@@ -58,16 +118,29 @@ def messaging_view(request):
             "role": role,
             "chat_partner": chat_partner,
             "messages": messages,
+            "older_cursor": older_cursor,
+            "seen_id": seen_id,
             "friends": friends,
-            "friend_requests": friend_requests,
+            "chats": chats,
+            "new_chats": new_chats,
+            "friend_requests": friend_requests(request.user),
             "paginated_users": paginated_users,
+            "next_after": next_after,
+            "previous_before": previous_before,
             "search_query": search_query,
             "search_users": search_users,
             "MEDIA_URL": settings.MEDIA_URL,
+            "heartbeat_interval": presence.HEARTBEAT_INTERVAL,
+            "typing_interval": ephemeral.EPHEMERAL_INTERVAL,
         },
     )
 
 
+def profiles_in_order(profile_ids):
+    profiles = Profile.objects.select_related("provider").in_bulk(profile_ids)
+    return [profiles[pk] for pk in profile_ids if pk in profiles]
+
+
 @login_required
 def add_friend(request):
     if request.method == "POST":
@@ -75,32 +148,26 @@ def add_friend(request):
             friend_id = request.POST.get("friend_id")
             friend = get_object_or_404(User, id=friend_id)
 
-            # Check if the user is already friends with the selected friend
-            existing_friendship1 = Contact.objects.filter(
-                user_id=request.user.id, friend_id=friend_id, is_friend=True
-            ).exists()
-
-            existing_friendship2 = Contact.objects.filter(
-                user_id=friend_id, friend_id=request.user.id, is_friend=True
-            ).exists()
-
-            if existing_friendship1 or existing_friendship2:
-                # If already friends, return an instruction
+            contact, changed = request_friend(request.user, friend)
+            if contact.status == Contact.PENDING:
                 return JsonResponse(
                     {
-                        "status": "error",
-                        "message": f"You are already friends with {friend.username}.",
+                        "status": "success",
+                        "message": f"Friend request sent to {friend.username}.",
+                    }
+                )
+            if changed:
+                # Their request to us was still pending, so this accepted it
+                return JsonResponse(
+                    {
+                        "status": "success",
+                        "message": f"You are now friends with {friend.username}.",
                     }
                 )
-
-            # Create a new friend request if not already friends
-            Contact.objects.get_or_create(
-                user=request.user, friend=friend, is_friend=False
-            )
             return JsonResponse(
                 {
-                    "status": "success",
-                    "message": f"Friend request sent to {friend.username}.",
+                    "status": "error",
+                    "message": f"You are already friends with {friend.username}.",
                 }
             )
         except Exception as e:
@@ -118,13 +185,8 @@ def add_friend(request):
 def confirm_request(request):
     if request.method == "POST":
         request_id = request.POST.get("request_id")
-        contact = get_object_or_404(Contact, id=request_id, friend=request.user)
-        contact.is_friend = True
-        contact.save()
-
-        Contact.objects.get_or_create(
-            user=request.user, friend=contact.user, is_friend=True
-        )
+        if not accept_request(request.user, request_id):
+            raise Http404("No friend request matches the given query.")
 
         base_url = reverse("messaging:messaging")
         query_string = urlencode({"section": "contacts"})
@@ -135,17 +197,8 @@ def confirm_request(request):
 def delete_friend(request):
     if request.method == "POST":
         friend_id = request.POST.get("friend_id")
-        friend_contact = get_object_or_404(
-            Contact, user=request.user, friend_id=friend_id, is_friend=True
-        )
-        friend_contact.delete()
-
-        # Delete the reverse contact
-        reverse_contact = Contact.objects.filter(
-            user=friend_id, friend=request.user, is_friend=True
-        ).first()
-        if reverse_contact:
-            reverse_contact.delete()
+        if not remove_friend(request.user, friend_id):
+            raise Http404("No friend matches the given query.")
 
         base_url = reverse("messaging:messaging")
         query_string = urlencode({"section": "contacts"})
@@ -159,8 +212,162 @@ def send_message(request):
         content = request.POST.get("content")
         receiver = get_object_or_404(User, id=receiver_id)
 
-        Message.objects.create(sender=request.user, receiver=receiver, content=content)
+        message = post_message(request.user, receiver.id, content)
+        # Show the message on any open chat page of either side
+        broadcast(direct_room(request.user.id, receiver.id), message)
 
         base_url = reverse("messaging:messaging")
         query_string = urlencode({"section": "chat", "chat_partner": receiver.id})
         return redirect(f"{base_url}?{query_string}")
+
+
+# JSON page of older messages with a chat partner, keyed by a
+# (timestamp, id) cursor
+@login_required
+def message_history(request, partner_id):
+    partner = get_object_or_404(User, id=partner_id)
+    try:
+        limit = min(
+            int(request.GET.get("limit", HISTORY_PAGE_SIZE)), MAX_HISTORY_PAGE_SIZE
+        )
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+    if limit < 1:
+        limit = HISTORY_PAGE_SIZE
+    cursor = request.GET.get("before")
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        return JsonResponse(
+            {"status": "error", "message": "Invalid cursor."}, status=400
+        )
+
+    page, older_cursor = history_page(
+        conversation_messages(request.user.id, partner.id, before), limit
+    )
+    return JsonResponse(
+        {
+            "status": "success",
+            "messages": [message_json(message) for message in page],
+            "older_cursor": older_cursor,
+        }
+    )
+
+
+# Advance the read cursor with a partner while their chat is open; the page
+# sends the newest message id it has shown, at most once a second
+@login_required
+def mark_read(request, partner_id):
+    if request.method != "POST":
+        return JsonResponse(
+            {"status": "error", "message": "Invalid request method."}, status=400
+        )
+    partner = get_object_or_404(User, id=partner_id)
+    try:
+        message_id = int(request.POST.get("message_id", ""))
+    except ValueError:
+        return JsonResponse(
+            {"status": "error", "message": "Invalid message."}, status=400
+        )
+
+    mark_conversation_read(request.user.id, partner.id, message_id)
+    return JsonResponse(
+        {
+            "status": "success",
+            "unread": unread_count(
+                request.user.id, partner.id, read_cursor(request.user.id, partner.id)
+            ),
+        }
+    )
+
+
+# JSON search over the user's direct and group messages, best matches first,
+# paginated by a (rank, rowid) cursor
+@login_required
+def search_messages_api(request):
+    try:
+        limit = min(
+            int(request.GET.get("limit", search.SEARCH_PAGE_SIZE)),
+            search.MAX_SEARCH_PAGE_SIZE,
+        )
+    except ValueError:
+        limit = search.SEARCH_PAGE_SIZE
+    if limit < 1:
+        limit = search.SEARCH_PAGE_SIZE
+    cursor = request.GET.get("cursor")
+    try:
+        after = search.decode_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        return JsonResponse(
+            {"status": "error", "message": "Invalid cursor."}, status=400
+        )
+
+    results, next_cursor = search.search_messages(
+        request.user, request.GET.get("q", ""), after, limit
+    )
+    return JsonResponse(
+        {"status": "success", "results": results, "next_cursor": next_cursor}
+    )
+
+
+# JSON typeahead over usernames and full names, optionally for one role
+@login_required
+def search_users_api(request):
+    try:
+        limit = min(
+            int(request.GET.get("limit", directory.SUGGESTION_LIMIT)),
+            directory.MAX_SUGGESTION_LIMIT,
+        )
+    except ValueError:
+        limit = directory.SUGGESTION_LIMIT
+    if limit < 1:
+        limit = directory.SUGGESTION_LIMIT
+    role = request.GET.get("role")
+    if role:
+        roles = {value.lower(): value for value, _ in Profile.ROLE_TYPES}
+        role = roles.get(role.lower())
+        if role is None:
+            return JsonResponse(
+                {"status": "error", "message": "Invalid role."}, status=400
+            )
+
+    profiles = profiles_in_order(
+        directory.suggest_profiles(
+            request.GET.get("q", ""), role, exclude=request.user.id, limit=limit
+        )
+    )
+    return JsonResponse(
+        {
+            "status": "success",
+            "results": [
+                {
+                    "id": profile.id,
+                    "username": profile.username,
+                    "full_name": profile.get_full_name(),
+                    "role": profile.role,
+                }
+                for profile in profiles
+            ],
+        }
+    )
+
+
+# Presence of the listed users, for chat lists without an open socket
+@login_required
+def presence_api(request):
+    try:
+        user_ids = [
+            int(user_id) for user_id in request.GET.get("ids", "").split(",") if user_id
+        ]
+    except ValueError:
+        return JsonResponse(
+            {"status": "error", "message": "Invalid user ids."}, status=400
+        )
+    visible = presence.visible_users(request.user, user_ids[: presence.MAX_FOLLOWED])
+    states = presence.registry.snapshot(visible)
+    return JsonResponse(
+        {
+            "status": "success",
+            "users": {str(user_id): state for user_id, state in states.items()},
+        }
+    )
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+logger = logging.getLogger(__name__)
+
+# Longest wait, in seconds, between tries while the database is unavailable
+MAX_RETRY_DELAY = 30
+
+
+class WriteBehindBuffer:
+    """Chat messages from sockets, written to the database in batches.
+
+    A consumer adds a message and broadcasts it straight away. Everything
+    held is written in one transaction once ``window`` seconds have passed
+    since the first held message, when the buffer is full (adding then
+    waits for the write), and on shutdown. Messages are written in the
+    order they were added, one bulk insert per ``save`` function, so their
+    ids follow that order. ``window`` and ``limit`` default to the
+    ``CHAT_WRITE_BEHIND_WINDOW`` and ``CHAT_WRITE_BEHIND_LIMIT`` settings.
+
+    When a batch cannot be written its messages are written one at a time,
+    and those that still fail are logged and dropped; a bad message never
+    holds back the ones after it. While the database is unavailable
+    (``OperationalError``, such as a lock timeout) everything is kept and
+    tried again after a delay that doubles up to ``MAX_RETRY_DELAY``.
+
+    Each room is then sent a ``chat.saved`` event mapping the keys its
+    messages were broadcast with to their ids, and listing the keys of
+    those that were dropped.
+    """
+
+    def __init__(self, window=None, limit=None):
+        self.window = settings.CHAT_WRITE_BEHIND_WINDOW if window is None else window
+        self.limit = settings.CHAT_WRITE_BEHIND_LIMIT if limit is None else limit
+        self.delay = self.window
+        # (save, message, room, key) in the order they were added
+        self.held = []
+        self.flusher = None
+        self.lock = None
+
+    async def add(self, save, message, room, key):
+        """Hold an unsaved ``message`` until ``save([message, ...])`` writes it."""
+        while len(self.held) >= self.limit:
+            if not await self.flush():
+                await asyncio.sleep(self.delay)
+        self.held.append((save, message, room, key))
+        self.schedule()
+
+    def schedule(self):
+        loop = asyncio.get_running_loop()
+        if (
+            self.flusher is None
+            or self.flusher.done()
+            or (self.flusher.get_loop() is not loop)
+        ):
+            self.flusher = loop.create_task(self.flush_later())
+
+    def loop_lock(self):
+        """The lock serialising flushes, one per event loop."""
+        loop = asyncio.get_running_loop()
+        if self.lock is None or self.lock[0] is not loop:
+            self.lock = (loop, asyncio.Lock())
+        return self.lock[1]
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        while not await self.flush():
+            await asyncio.sleep(self.delay)
+
+    async def flush(self):
+        """Write everything held, then tell each room the new ids.
+
+        Returns False if the database was unavailable and messages are kept
+        for a later try.
+        """
+        # One flush at a time, so batches reach the database in order
+        async with self.loop_lock():
+            batch, self.held = self.held, []
+            if not batch:
+                return True
+            dropped, kept = await database_sync_to_async(self.write)(batch)
+            if kept:
+                # Ahead of anything added meanwhile
+                self.held[:0] = kept
+                self.delay = min(self.delay * 2, MAX_RETRY_DELAY)
+                self.schedule()
+            else:
+                self.delay = self.window
+        # What was kept is the end of the batch
+        done = batch[: len(batch) - len(kept)]
+        dropped = {key for _, _, _, key in dropped}
+        rooms = {}
+        for _, message, room, key in done:
+            saved = rooms.setdefault(room, {"ids": {}, "unsaved": []})
+            if key in dropped:
+                saved["unsaved"].append(key)
+            else:
+                saved["ids"][key] = message.id
+        layer = get_channel_layer()
+        for room, saved in rooms.items():
+            await layer.group_send(room, {"type": "chat.saved", **saved})
+        return not kept
+
+    def write(self, batch):
+        """Write ``batch`` in order.
+
+        Returns the entries dropped for good and those kept because the
+        database was unavailable.
+        """
+        try:
+            self.save(batch)
+            return [], []
+        except OperationalError:
+            logger.warning("Database unavailable; keeping %d chat messages", len(batch))
+            self.unsave(batch)
+            return [], batch
+        except Exception:
+            logger.warning("Writing %d chat messages failed", len(batch), exc_info=True)
+            self.unsave(batch)
+        dropped = []
+        for position, entry in enumerate(batch):
+            try:
+                self.save([entry])
+            except OperationalError:
+                self.unsave(batch[position:])
+                return dropped, batch[position:]
+            except Exception:
+                _, message, room, key = entry
+                logger.exception(
+                    "Dropped chat message %s to %s from user %s: %r",
+                    key,
+                    room,
+                    message.sender_id,
+                    message.content,
+                )
+                self.unsave([entry])
+                dropped.append(entry)
+        return dropped, []
+
+    def save(self, batch):
+        messages = {}
+        for save, message, _, _ in batch:
+            messages.setdefault(save, []).append(message)
+        with transaction.atomic():
+            for save, unsaved in messages.items():
+                save(unsaved)
+
+    def unsave(self, batch):
+        # Ids given by a rolled back insert are not the messages' own
+        for _, message, _, _ in batch:
+            message.pk = None
+
+
+buffer = WriteBehindBuffer()
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan handler that writes held messages before shutdown."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await buffer.flush()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -1,9 +1,14 @@
+import calendar
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, datetime, time, timedelta
 from appointments.models import TimeSlot, Appointment
+from appointments.slots import create_time_slots, find_overlaps, recurring_time_slots
 from accounts.models import Profile, Provider
 
 User = get_user_model()
@@ -266,3 +271,182 @@ class ProviderViewsTest(TestCase):
             reverse("providers:delete_slot", args=[invalid_slot_id])
         )
         self.assertEqual(response.status_code, 404)
+
+
+class RecurringTimeSlotTests(TestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.client.login(username="provider", password="pass")
+
+    def test_full_year_series_is_one_bulk_insert(self):
+        series = recurring_time_slots(
+            self.provider,
+            time(9, 0),
+            time(10, 0),
+            list(calendar.day_name),
+            52,
+            date(2030, 1, 7),
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            created, conflicts = create_time_slots(self.provider, series)
+
+        inserts = [q for q in queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(created), 364)
+        self.assertEqual(conflicts, [])
+        # One bulk_create; SQLite's 999-parameter limit splits it in batches
+        self.assertLessEqual(len(inserts), 3)
+        self.assertEqual(TimeSlot.objects.filter(provider=self.provider).count(), 364)
+
+    def test_overlapping_slots_are_skipped_and_reported(self):
+        monday = date(2030, 1, 7)
+        existing = TimeSlot.objects.create(
+            provider=self.provider,
+            start_time=timezone.make_aware(datetime.combine(monday, time(9, 30))),
+            end_time=timezone.make_aware(datetime.combine(monday, time(10, 30))),
+        )
+        series = recurring_time_slots(
+            self.provider, time(9, 0), time(10, 0), ["Monday", "Tuesday"], 2, monday
+        )
+
+        created, conflicts = create_time_slots(self.provider, series)
+
+        self.assertEqual(len(created), 3)
+        self.assertEqual(
+            [slot.start_time for slot in conflicts], [series[0].start_time]
+        )
+        self.assertFalse(
+            TimeSlot.objects.filter(start_time=series[0].start_time).exists()
+        )
+        self.assertTrue(TimeSlot.objects.filter(id=existing.id).exists())
+
+    def test_find_overlaps_sweep(self):
+        def slot(start, end):
+            base = timezone.make_aware(datetime(2030, 1, 7))
+            return TimeSlot(
+                start_time=base + timedelta(hours=start),
+                end_time=base + timedelta(hours=end),
+            )
+
+        new = [slot(1, 2), slot(3, 4), slot(5, 6), slot(7, 8)]
+        existing = [slot(0, 3.5), slot(5.5, 5.75), slot(6, 7), slot(8, 9)]
+
+        self.assertEqual(find_overlaps(new, existing), new[:3])
+
+    def test_recurring_view_reports_conflicts(self):
+        response = self.client.post(
+            reverse("providers:create_time_slot"),
+            {
+                "form_type": "recurring",
+                "start_time": "10:00",
+                "end_time": "11:00",
+                "repeat_days": ["Monday"],
+                "num_weeks": 2,
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+
+        response = self.client.post(
+            reverse("providers:create_time_slot"),
+            {
+                "form_type": "recurring",
+                "start_time": "10:30",
+                "end_time": "11:30",
+                "repeat_days": ["Monday"],
+                "num_weeks": 2,
+            },
+            follow=True,
+        )
+
+        self.assertContains(response, "Skipped 2 that overlap existing slots")
+        self.assertEqual(TimeSlot.objects.filter(provider=self.provider).count(), 2)
+
+    def test_recurring_view_rejects_end_before_start(self):
+        response = self.client.post(
+            reverse("providers:create_time_slot"),
+            {
+                "form_type": "recurring",
+                "start_time": "11:00",
+                "end_time": "10:00",
+                "repeat_days": ["Monday"],
+                "num_weeks": 1,
+            },
+        )
+
+        self.assertContains(response, "End time must be after start time.")
+        self.assertFalse(TimeSlot.objects.exists())
+
+
+class ProviderScheduleTests(TestCase):
+    def setUp(self):
+        self.provider = Profile.objects.create_user(
+            username="provider",
+            password="pass",
+            role="Provider",
+            email="provider@example.com",
+        )
+        self.patient = Profile.objects.create_user(
+            username="patient",
+            password="pass",
+            role="User",
+            email="patient@example.com",
+            first_name="Sam",
+            last_name="Lee",
+        )
+        self.client.login(username="provider", password="pass")
+
+    def test_schedule_query_count_is_fixed(self):
+        start = timezone.now() + timedelta(minutes=5)
+        slots = TimeSlot.objects.bulk_create(
+            TimeSlot(
+                provider=self.provider,
+                start_time=start + timedelta(minutes=5 * i),
+                end_time=start + timedelta(minutes=5 * i + 5),
+                is_available=i % 2 == 1,
+            )
+            for i in range(2000)
+        )
+        Appointment.objects.bulk_create(
+            Appointment(user=self.patient, time_slot=slot, appointment_type="Checkup")
+            for slot in slots
+            if not slot.is_available
+        )
+
+        # Session, user, the week's slots and their appointments with clients
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("providers:create_time_slot"))
+
+        self.assertContains(response, "Occupied By:</strong> Sam Lee")
+        self.assertGreater(len(response.context["current_slots"]), 0)
+
+    def test_schedule_is_windowed_by_week(self):
+        today = timezone.localdate()
+        monday = today - timedelta(days=today.weekday())
+        next_monday = monday + timedelta(days=7)
+        slot = TimeSlot.objects.create(
+            provider=self.provider,
+            start_time=timezone.make_aware(
+                datetime.combine(next_monday + timedelta(days=1), time(10))
+            ),
+            end_time=timezone.make_aware(
+                datetime.combine(next_monday + timedelta(days=1), time(11))
+            ),
+        )
+
+        response = self.client.get(reverse("providers:create_time_slot"))
+        self.assertNotIn(slot, response.context["current_slots"])
+        self.assertIsNone(response.context["previous_week"])
+        self.assertEqual(response.context["next_week"], next_monday)
+
+        response = self.client.get(
+            reverse("providers:create_time_slot"),
+            {"week": (next_monday + timedelta(days=3)).isoformat()},
+        )
+        self.assertEqual(list(response.context["current_slots"]), [slot])
+        self.assertEqual(response.context["week"], next_monday)
+        self.assertEqual(response.context["previous_week"], monday)
@@ -4,13 +4,19 @@ from django.utils import timezone
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-import calendar
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.core.paginator import Paginator
 from django.conf import settings
 
 from appointments.forms import TimeSlotForm
 from appointments.models import Appointment, TimeSlot
+from appointments.slots import (
+    create_time_slots,
+    day_bounds,
+    parse_day,
+    recurring_time_slots,
+)
+from appointments.soonest import soonest_slots
 from accounts.models import Profile, Provider
 
 
@@ -18,7 +24,6 @@ from accounts.models import Profile, Provider
 @login_required
 def create_time_slot(request):
     profile = request.user
-    today = timezone.now().date().isoformat()
 
     # Ensure only Providers can access this view
     if profile.role != "Provider":
@@ -34,12 +39,11 @@ def create_time_slot(request):
                 time_slot = form.save(commit=False)
                 time_slot.provider = request.user
                 time_slot.is_available = True  # Automatically set to available
-                time_slot.save()
-                # Refresh the page after saving
-                return redirect("providers:create_time_slot")
-            else:
-                # Handle form errors (optional)
-                pass
+                _, conflicts = create_time_slots(request.user, [time_slot])
+                if not conflicts:
+                    # Refresh the page after saving
+                    return redirect("providers:create_time_slot")
+                form.add_error(None, "This slot overlaps one of your existing slots.")
 
         # Recurring Slot Creation
         elif form_type == "recurring":
@@ -47,67 +51,111 @@ def create_time_slot(request):
             end_time_str = request.POST.get("end_time")
             selected_days = request.POST.getlist("repeat_days")
             num_weeks = int(request.POST.get("num_weeks", 1))
+            try:
+                capacity = int(request.POST.get("capacity") or 1)
+            except ValueError:
+                capacity = 0
 
+            error_message = None
             # Validate required fields
-            if start_time_str and end_time_str and selected_days:
+            if not (start_time_str and end_time_str and selected_days):
+                error_message = "Please fill in all required fields."
+            else:
                 start_time = datetime.strptime(start_time_str, "%H:%M").time()
                 end_time = datetime.strptime(end_time_str, "%H:%M").time()
+                if end_time <= start_time:
+                    error_message = "End time must be after start time."
+                elif capacity < 1:
+                    error_message = "A time slot needs at least one seat."
 
-                today = timezone.now().date()
-
-                for week in range(num_weeks):
-                    for day in selected_days:
-                        weekday_index = list(calendar.day_name).index(day)
-                        days_until_next = (weekday_index - today.weekday()) % 7
-                        slot_date = today + timedelta(days=days_until_next + week * 7)
-
-                        # Create each recurring slot
-                        TimeSlot.objects.create(
-                            provider=request.user,
-                            start_time=timezone.make_aware(
-                                datetime.combine(slot_date, start_time)
-                            ),
-                            end_time=timezone.make_aware(
-                                datetime.combine(slot_date, end_time)
-                            ),
-                            is_available=True,  # Automatically set to available
-                        )
-                # Refresh the page after saving
-                return redirect("providers:create_time_slot")
-            else:
-                # Handle missing data or validation errors
-                error_message = "Please fill in all required fields."
+            if error_message:
                 form = TimeSlotForm()
-                current_slots = TimeSlot.objects.filter(
-                    provider=request.user, start_time__gte=today
-                )
                 return render(
                     request,
                     "providers/create_time_slot.html",
                     {
                         "form": form,
-                        "current_slots": current_slots,
                         "error_message": error_message,
+                        **schedule_context(request),
                     },
                 )
 
+            # Build the whole series in memory and save it in one bulk write,
+            # skipping slots that overlap the provider's existing ones
+            series = recurring_time_slots(
+                request.user,
+                start_time,
+                end_time,
+                selected_days,
+                num_weeks,
+                timezone.localdate(),
+                capacity,
+            )
+            created, conflicts = create_time_slots(request.user, series)
+            if conflicts:
+                skipped = ", ".join(
+                    timezone.localtime(slot.start_time).strftime("%Y-%m-%d %H:%M")
+                    for slot in conflicts
+                )
+                messages.warning(
+                    request,
+                    f"Created {len(created)} slots. Skipped {len(conflicts)} "
+                    f"that overlap existing slots: {skipped}.",
+                )
+            # Refresh the page after saving
+            return redirect("providers:create_time_slot")
+
     else:
         form = TimeSlotForm()
 
-    # Fetch current slots for display
-    current_slots = TimeSlot.objects.filter(
-        provider=request.user, start_time__gte=today
-    )
     return render(
         request,
         "providers/create_time_slot.html",
         {
             "form": form,
-            "current_slots": current_slots,
+            **schedule_context(request),
         },
     )
 
 
+def schedule_context(request):
+    """Context for the provider's own schedule, one week at a time.
+
+    The week is picked by the ``week`` query parameter (any day in it) and
+    defaults to the current one. Each booked slot's appointment and client are
+    loaded up front into ``slot.bookings``, so rendering costs the same two
+    queries however many slots the week holds.
+    """
+    today = timezone.localdate()
+    current_week = today - timedelta(days=today.weekday())
+    week = parse_day(request.GET.get("week")) or today
+    week = max(week - timedelta(days=week.weekday()), current_week)
+
+    week_start, _ = day_bounds(max(week, today))
+    week_end, _ = day_bounds(week + timedelta(days=7))
+    current_slots = (
+        TimeSlot.objects.filter(
+            provider=request.user, start_time__gte=week_start, start_time__lt=week_end
+        )
+        .order_by("start_time")
+        .prefetch_related(
+            Prefetch(
+                "appointment_set",
+                queryset=Appointment.objects.select_related("user").only(
+                    "time_slot", "user__first_name", "user__last_name"
+                ),
+                to_attr="bookings",
+            )
+        )
+    )
+    return {
+        "current_slots": current_slots,
+        "week": week,
+        "previous_week": (week - timedelta(days=7) if week > current_week else None),
+        "next_week": week + timedelta(days=7),
+    }
+
+
 @login_required
 def browse_providers(request):
     # Get filter criteria from the request
@@ -170,9 +218,9 @@ def provider_detail(request, provider_id):
 def delete_slot(request, slot_id):
     slot = get_object_or_404(TimeSlot, id=slot_id)
 
-    # Check if the slot is available
-    if not slot.is_available:
-        # If the slot is not available, find and delete any associated appointments
+    # Check if any seat of the slot is taken
+    if slot.booked_seats:
+        # If so, find and delete any associated appointments
         associated_appointments = Appointment.objects.filter(time_slot=slot)
         associated_appointments.delete()
         messages.warning(
@@ -181,5 +229,6 @@ def delete_slot(request, slot_id):
 
     # Delete the slot
     slot.delete()
+    soonest_slots.discard_slot(slot_id)
     messages.success(request, "Time slot deleted successfully.")
     return redirect("providers:create_time_slot")